@@ -1,6 +1,13 @@
-import { Component, OnInit } from '@angular/core';
+import { Component, OnDestroy, OnInit } from '@angular/core';
 import { CommonModule } from '@angular/common';
-import { FlaskServiceService } from '../../services/flask-service.service';
+import { Subscription } from 'rxjs';
+import { FlaskServiceService, OrderStreamEvent } from '../../services/flask-service.service';
+
+// ordini mostrati nell'anteprima della dashboard
+const RECENT_ORDERS = 5;
+// ricarica periodica: lo stream porta solo gli ordini scritti dal processo a cui è
+// collegato, con più worker gli altri arrivano da qui
+const REFRESH_INTERVAL = 10000;
 
 @Component({
   selector: 'app-dashboard',
@@ -9,7 +16,7 @@ import { FlaskServiceService } from '../../services/flask-service.service';
   templateUrl: './dashboard.component.html',
   styleUrls: ['./dashboard.component.css']
 })
-export class DashboardComponent implements OnInit {
+export class DashboardComponent implements OnInit, OnDestroy {
   orders: any[] = [];
   loading = false;
   error = '';
@@ -21,20 +28,44 @@ export class DashboardComponent implements OnInit {
   totalToday = 0;
   totalRevenue = 0;
 
+  private stream?: Subscription;
+  private refreshTimer?: ReturnType<typeof setInterval>;
+
   constructor(private flaskService: FlaskServiceService) {}
 
   ngOnInit() {
     this.loadOrders();
-    // Aggiorna ogni 10 secondi
-    setInterval(() => this.loadOrders(), 10000);
+    // Aggiornamenti in tempo reale dal server, più una ricarica periodica di sicurezza
+    this.stream = this.flaskService.streamOrders().subscribe(event => this.applyEvent(event));
+    this.refreshTimer = setInterval(() => this.loadOrders(), REFRESH_INTERVAL);
+  }
+
+  ngOnDestroy() {
+    this.stream?.unsubscribe();
+    clearInterval(this.refreshTimer);
+  }
+
+  applyEvent(event: OrderStreamEvent) {
+    if (event.type === 'reset') {
+      // eventi persi (riavvio del server o disconnessione lunga): ricarica tutto
+      this.loadOrders();
+      return;
+    }
+    const shown = this.orders.some(o => o.id === event.order.id);
+    if (shown) {
+      this.orders = this.orders.map(o => o.id === event.order.id ? event.order : o);
+    } else if (event.type === 'order_created') {
+      this.orders = [event.order, ...this.orders].slice(0, RECENT_ORDERS);
+    }
+    // un ordine aggiornato ma non in anteprima è più vecchio di quelli mostrati: conta solo nei contatori
+    this.loadStats();
   }
 
   loadOrders() {
     this.loading = true;
-    this.flaskService.getAllOrders().subscribe({
+    this.flaskService.getRecentOrders(RECENT_ORDERS).subscribe({
       next: (response) => {
         this.orders = response.data;
-        this.calculateStats();
         this.loading = false;
       },
       error: (err) => {
@@ -42,13 +73,23 @@ export class DashboardComponent implements OnInit {
         this.loading = false;
       }
     });
+    this.loadStats();
   }
 
-  calculateStats() {
-    this.pendingCount = this.orders.filter(o => o.status === 'pending').length;
-    this.preparingCount = this.orders.filter(o => o.status === 'preparing').length;
-    this.readyCount = this.orders.filter(o => o.status === 'ready').length;
-    this.totalToday = this.orders.length;
-    this.totalRevenue = this.orders.reduce((sum, o) => sum + parseFloat(o.total_price), 0);
+  // i contatori sono mantenuti dal server: nessun bisogno di scaricare tutti gli ordini
+  loadStats() {
+    this.flaskService.getOrderStats().subscribe({
+      next: (response) => {
+        const stats = response.data;
+        this.pendingCount = stats.pending;
+        this.preparingCount = stats.preparing;
+        this.readyCount = stats.ready;
+        this.totalToday = stats.today_orders;
+        this.totalRevenue = stats.today_revenue;
+      },
+      error: (err) => {
+        this.error = 'Errore caricamento statistiche';
+      }
+    });
   }
 }
@@ -16,6 +16,8 @@ export class OrdersComponent implements OnInit {
   error = '';
   selectedStatus = 'pending';
   expandedOrderId: number | null = null;
+  // cursore della pagina successiva (null quando la lista è completa)
+  nextCursor: string | null = null;
 
   constructor(private flaskService: FlaskServiceService) {}
 
@@ -28,6 +30,26 @@ export class OrdersComponent implements OnInit {
     this.flaskService.getOrdersByStatus(this.selectedStatus).subscribe({
       next: (response) => {
         this.orders = response.data;
+        this.nextCursor = response.next_cursor;
+        this.loading = false;
+      },
+      error: (err) => {
+        this.error = 'Errore caricamento ordini';
+        this.loading = false;
+      }
+    });
+  }
+
+  // il server risponde a pagine: aggiunge in fondo quella successiva
+  loadMoreOrders() {
+    if (!this.nextCursor || this.loading) {
+      return;
+    }
+    this.loading = true;
+    this.flaskService.getOrdersByStatus(this.selectedStatus, this.nextCursor).subscribe({
+      next: (response) => {
+        this.orders = this.orders.concat(response.data);
+        this.nextCursor = response.next_cursor;
         this.loading = false;
       },
       error: (err) => {
@@ -2,6 +2,11 @@ import { HttpClient } from '@angular/common/http';
 import { Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
 
+export interface OrderStreamEvent {
+  type: string;
+  order: any;
+}
+
 @Injectable({
   providedIn: 'root'
 })
@@ -20,8 +25,19 @@ export class FlaskServiceService {
     return this.http.get(`${this.apiUrl}/orders`);
   }
 
-  getOrdersByStatus(status: string): Observable<any> {
-    return this.http.get(`${this.apiUrl}/orders?status=${status}`);
+  getRecentOrders(limit: number): Observable<any> {
+    return this.http.get(`${this.apiUrl}/orders?limit=${limit}`);
+  }
+
+  // contatori calcolati dal server: ordini per stato, ordini e incasso di oggi
+  getOrderStats(): Observable<any> {
+    return this.http.get(`${this.apiUrl}/orders/stats`);
+  }
+
+  // una pagina di ordini (dal più recente); `before` è il `next_cursor` della pagina precedente
+  getOrdersByStatus(status: string, before?: string | null): Observable<any> {
+    const cursor = before ? `&before=${encodeURIComponent(before)}` : '';
+    return this.http.get(`${this.apiUrl}/orders?status=${status}${cursor}`);
   }
 
   getOrder(orderId: number): Observable<any> {
@@ -32,6 +48,21 @@ export class FlaskServiceService {
     return this.http.put(`${this.apiUrl}/orders/${orderId}/status`, { status });
   }
 
+  // Stream Server-Sent Events: il browser si riconnette da solo inviando Last-Event-ID
+  streamOrders(): Observable<OrderStreamEvent> {
+    return new Observable<OrderStreamEvent>(subscriber => {
+      const source = new EventSource(`${this.apiUrl}/orders/stream`);
+      const forward = (type: string) => (event: MessageEvent) =>
+        subscriber.next({ type, order: JSON.parse(event.data) });
+
+      source.addEventListener('order_created', forward('order_created'));
+      source.addEventListener('order_updated', forward('order_updated'));
+      source.addEventListener('reset', forward('reset'));
+
+      return () => source.close();
+    });
+  }
+
   // ============ CATEGORIE ============
 
   getAllCategories(): Observable<any> {
@@ -2,11 +2,24 @@
 Hamburgheria Damico Deg Deghi - Backend Flask
 API REST per gestire menu, ordini e comunicazione tra totem cliente e pannello staff
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
-from database_wrapper import DatabaseWrapper
-from datetime import datetime
+from database_wrapper import ACTIVE_ORDER_STATUSES, DatabaseWrapper, PoolTimeout
+from order_events import OrderEventBroker
+from order_queue import OrderQueue
+from catalog_io import FORMATS, detect_format, export_lines, parse_catalog
+from product_images import (IMAGE_MAIN_VARIANT, IMAGE_MAX_AGE, IMAGE_MAX_BYTES, IMAGE_NAME,
+                            ImageStore, image_variants)
+from metrics import registry as metrics
+from response_encoding import FastJSONProvider, compress, compressible, encode_static_payload, negotiate_encoding
+from datetime import datetime, timedelta, timezone
+import base64
+import csv
+import io
+import itertools
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Carica variabili d'ambiente
@@ -16,28 +29,210 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["*"]}})
 
+# Serializzazione JSON: 'fast' (orjson, Decimal e datetime nativi) o 'flask' (provider di default)
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'fast').lower()
+if JSON_PROVIDER == 'fast':
+    app.json = FastJSONProvider(app)
+
 # Inizializza Database
 db = DatabaseWrapper()
+db_init_lock = threading.Lock()
+# rotte che rispondono anche durante l'avvio (liveness e readiness probe)
+PROBE_ENDPOINTS = ('health', 'ready')
+
+# Eventi in tempo reale sugli ordini per il pannello staff
+order_events = OrderEventBroker()
+ORDER_STREAM_HEARTBEAT = float(os.getenv('ORDER_STREAM_HEARTBEAT', 15))
+
+# Modalità di esecuzione: 'wsgi' (Flask, default) o 'asgi' (Quart con driver asincroni)
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
+
+# Paginazione della lista ordini
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', 100))
+ORDERS_MAX_PAGE_SIZE = 500
+
+# Scrittura dei nuovi ordini: 'sync' (transazione nella richiesta, default) o 'queue'
+# (journal locale e scrittura nel database in background, vedi order_queue.py)
+ORDER_INGEST = os.getenv('ORDER_INGEST', 'sync').lower()
+# secondi di attesa massima per cambiare lo stato di un ordine ancora in coda
+ORDER_QUEUE_WAIT = float(os.getenv('ORDER_QUEUE_WAIT', 5))
+order_queue = OrderQueue(
+    db,
+    os.getenv('ORDER_QUEUE_PATH', 'order_queue.db'),
+    batch_size=int(os.getenv('ORDER_QUEUE_BATCH', 200))
+) if ORDER_INGEST == 'queue' else None
+
+# Immagini dei prodotti caricate dallo staff, in varianti pronte per totem e pannello
+image_store = ImageStore()
+
+# Vista in memoria degli ordini attivi per le schermate della cucina ('1' per attivarla):
+# vede solo le scritture di questo processo, quindi va attivata solo con un processo
+ACTIVE_ORDERS_VIEW = os.getenv('ACTIVE_ORDERS_VIEW', '0') == '1'
 
 
 # ==================== STARTUP ====================
 
+# categorie e prodotti d'esempio inseriti da seed_initial_data se mancano
+DEFAULT_CATEGORIES = [
+    {'name': 'Hamburger', 'description': 'Panini classici', 'icon': '🍔'},
+    {'name': 'Bevande', 'description': 'Bibite e altro', 'icon': '🥤'},
+    {'name': 'Contorni', 'description': 'Patatine, etc.', 'icon': '🍟'},
+    {'name': 'Panini speciali', 'description': 'Creazioni uniche', 'icon': '🥪'},
+    {'name': 'Dessert', 'description': 'Dolci e gelati', 'icon': '🍨'}
+]
+DEFAULT_PRODUCTS = [
+    {'name': 'Classic Burger', 'description': 'Carne, lattuga, pomodoro', 'price': 5.99, 'category': 'Hamburger'},
+    {'name': 'Cheese Burger', 'description': 'Con formaggio extra', 'price': 6.99, 'category': 'Hamburger'},
+    {'name': 'Coca Cola', 'description': 'Lattina 33cl', 'price': 2.50, 'category': 'Bevande'},
+    {'name': 'Patatine fritte', 'description': 'Porzione media', 'price': 3.00, 'category': 'Contorni'}
+]
+
+# impostato da bootstrap() quando il server può ricevere traffico (vedi /api/ready)
+app_ready = threading.Event()
+
+
+def seed_initial_data():
+    """Inserisce categorie e prodotti d'esempio se mancano (ogni gruppo con un solo commit)"""
+    existing = {c['name']: c['id'] for c in db.get_all_categories()}
+    missing = [{**cat, 'order_position': idx} for idx, cat in enumerate(DEFAULT_CATEGORIES, start=1)
+               if cat['name'] not in existing]
+    if missing:
+        db.add_categories(missing)
+        print(f"→ Aggiunte {len(missing)} categorie di default")
+        existing = {c['name']: c['id'] for c in db.get_all_categories()}
+    else:
+        print("→ Tutte le categorie di default sono già presenti, salto seed")
+
+    # riempie anche la cache del catalogo prima della prima richiesta
+    prods = db.get_all_products()
+    if not prods:
+        print("→ Aggiungo alcuni prodotti di esempio")
+        db.add_products([{**product, 'category_id': existing[product['category']]}
+                         for product in DEFAULT_PRODUCTS if product['category'] in existing])
+    else:
+        print(f"→ {len(prods)} prodotti già presenti, salto seed")
+
+
+def bootstrap():
+    """Fase di avvio, eseguita una sola volta prima di accettare traffico.
+
+    Connessione (con timeout DB_CONNECT_TIMEOUT prima del fallback su SQLite), schema,
+    dati d'esempio e contatori della dashboard: nessuna richiesta ne paga il costo.
+    """
+    with db_init_lock:
+        if app_ready.is_set():
+            return
+        started = time.perf_counter()
+        db.connect()
+        db.init_schema()
+        print("✓ Database inizializzato")
+        pending = db.pending_migrations()
+        if pending:
+            print(f"⚠ {len(pending)} migrazioni da applicare: eseguire 'python database_wrapper.py migrate'")
+        seed_initial_data()
+        if order_queue:
+            # ripristina e scrive gli ordini accettati prima dell'ultimo arresto
+            order_queue.start()
+        if ACTIVE_ORDERS_VIEW:
+            print(f"✓ {db.load_active_orders()} ordini attivi in memoria")
+        # contatori della dashboard pronti prima della prima richiesta
+        db.get_order_stats()
+        app_ready.set()
+        print(f"✓ Avvio completato in {time.perf_counter() - started:.2f}s")
+
+
+def start_bootstrap() -> threading.Thread:
+    """Esegue bootstrap() in un thread, per i server WSGI esterni (vedi wsgi.py).
+
+    Il server accetta subito le connessioni: le sonde rispondono (`/api/ready` con 503)
+    mentre le altre richieste aspettano la fine dell'avvio.
+    """
+    thread = threading.Thread(target=_bootstrap_in_background, name='bootstrap', daemon=True)
+    thread.start()
+    return thread
+
+
+def _bootstrap_in_background():
+    try:
+        bootstrap()
+    except Exception as e:
+        # la prossima richiesta (non una sonda) riprova l'avvio
+        print(f"✗ Errore avvio: {e}")
+
+
 @app.before_request
 def before_request():
-    """Connette al database per ogni richiesta"""
-    if not db.connection:
-        db.connect()
-        # Inizializza tabelle se non esistono
-        db.init_categories_table()
-        db.init_products_table()
-        db.init_orders_table()
-        db.init_order_items_table()
+    """Riserva una connessione del pool alla richiesta"""
+    g.request_started = time.perf_counter()
+    if not app_ready.is_set():
+        if request.endpoint in PROBE_ENDPOINTS:
+            # le sonde non aspettano l'avvio e non usano il database
+            return
+        # avvio in corso (wsgi.py) o mai partito: aspetta la fine o lo esegue
+        bootstrap()
+    db.begin_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Registra la durata della richiesta etichettata per rotta"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds',
+                        (request.method, route, str(response.status_code)),
+                        time.perf_counter() - started)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Comprime le risposte grandi con la codifica accettata dal client (br o gzip)"""
+    if not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 
 @app.teardown_appcontext
 def teardown_db(exception=None):
-    """Chiude la connessione al database"""
-    pass  # PyMySQL gestisce le connessioni automaticamente
+    """Restituisce al pool la connessione usata dalla richiesta"""
+    db.end_request()
+
+
+# ==================== MENU (CACHE) ====================
+
+def cached_list_response(key, load):
+    """Risponde con una lista del menu servita dalla cache, con ETag forte.
+
+    Il payload JSON viene serializzato una sola volta e riutilizzato finché una
+    modifica a categorie o prodotti non invalida la cache; se il client invia un
+    `If-None-Match` ancora valido riceve 304 senza corpo. Anche le varianti
+    compresse (br/gzip) vengono calcolate una volta sola.
+    """
+    def build():
+        rows = load()
+        return app.json.dumps({
+            'status': 'success',
+            'data': rows,
+            'count': len(rows)
+        }).encode('utf-8')
+
+    body, etag = db.cached_payload(key, build)
+    # variante compressa preparata una sola volta per ogni versione del menu
+    body, etag, encoding = encode_static_payload(body, etag, request.accept_encodings)
+    response = app.response_class(body, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # il client può tenere la risposta ma deve sempre rivalidarla con l'ETag
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # ==================== PRODOTTI ====================
@@ -46,12 +241,7 @@ def teardown_db(exception=None):
 def get_products():
     """Ritorna tutti i prodotti disponibili (per il totem cliente)"""
     try:
-        products = db.get_all_products()
-        return jsonify({
-            'status': 'success',
-            'data': products,
-            'count': len(products)
-        }), 200
+        return cached_list_response(('products',), db.get_all_products)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -60,12 +250,8 @@ def get_products():
 def get_products_by_category(category_id):
     """Ritorna i prodotti di una categoria specifica"""
     try:
-        products = db.get_products_by_category(category_id)
-        return jsonify({
-            'status': 'success',
-            'data': products,
-            'count': len(products)
-        }), 200
+        return cached_list_response(('products', category_id),
+                                    lambda: db.get_products_by_category(category_id))
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -76,12 +262,7 @@ def get_products_by_category(category_id):
 def get_categories():
     """Ritorna tutte le categorie disponibili"""
     try:
-        categories = db.get_all_categories()
-        return jsonify({
-            'status': 'success',
-            'data': categories,
-            'count': len(categories)
-        }), 200
+        return cached_list_response(('categories',), db.get_all_categories)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -277,41 +458,524 @@ def delete_product(product_id):
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/api/products/<int:product_id>/image', methods=['POST'])
+def upload_product_image(product_id):
+    """Carica l'immagine di un prodotto e ne salva le varianti ridimensionate (Solo staff)
+
+    L'immagine arriva come campo `image` di un form multipart oppure come corpo della
+    richiesta (Content-Type image/*); il prodotto punta poi alla variante per il totem.
+    """
+    try:
+        if request.content_length and request.content_length > IMAGE_MAX_BYTES + 64 * 1024:
+            return jsonify({'status': 'error',
+                            'message': f'Immagine troppo grande (massimo {IMAGE_MAX_BYTES} byte)'}), 413
+        product = db.get_product_by_id(product_id)
+        if not product:
+            return jsonify({'status': 'error', 'message': 'Prodotto non trovato'}), 404
+
+        upload = request.files.get('image')
+        data = (upload or request.stream).read(IMAGE_MAX_BYTES + 1)
+        if not data:
+            return jsonify({'status': 'error', 'message': 'Nessuna immagine fornita'}), 400
+        if len(data) > IMAGE_MAX_BYTES:
+            return jsonify({'status': 'error',
+                            'message': f'Immagine troppo grande (massimo {IMAGE_MAX_BYTES} byte)'}), 413
+
+        try:
+            urls = image_store.save(data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 503
+
+        image_url = urls[IMAGE_MAIN_VARIANT]
+        if product.get('image_url') != image_url and not db.update_product(product_id, image_url=image_url):
+            return jsonify({'status': 'error', 'message': 'Errore aggiornamento prodotto'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Immagine caricata con successo',
+            'data': {'image_url': image_url, 'images': image_variants(image_url)}
+        }), 201
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/images/<name>', methods=['GET'])
+def get_image(name):
+    """Serve una variante di un'immagine; il nome dipende dal contenuto, quindi è immutabile"""
+    if not IMAGE_NAME.match(name):
+        return jsonify({'status': 'error', 'message': 'Immagine non trovata'}), 404
+    # conditional: risponde 304 a If-None-Match/If-Modified-Since e 206 alle richieste Range
+    response = send_from_directory(os.path.abspath(image_store.path), name,
+                                   max_age=IMAGE_MAX_AGE, etag=name.rsplit('.', 1)[0], conditional=True)
+    response.cache_control.immutable = True
+    return response
+
+
+# ==================== CATALOGO ====================
+
+@app.route('/api/catalog/import', methods=['POST'])
+def import_catalog():
+    """Importa categorie e prodotti da CSV o NDJSON (Solo staff)
+
+    Formato da `?format=csv|ndjson` o dal Content-Type (colonne in catalog_io.py).
+    Le righe valide vengono scritte con una sola transazione; quelle non valide
+    sono riportate in `errors` con il numero di riga.
+    """
+    try:
+        fmt = detect_format(request.args.get('format'), request.content_type)
+        parsed = parse_catalog(request.stream, fmt)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    report = {'rows': parsed.rows, 'error_count': parsed.error_count, 'errors': parsed.errors}
+    if not parsed.categories:
+        return jsonify({'status': 'error', 'message': 'Nessuna riga valida', 'data': report}), 400
+    try:
+        counts = db.import_catalog(parsed.categories, parsed.products)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Import annullato: {e}', 'data': report}), 500
+    return jsonify({'status': 'success', 'data': {**counts, **report}}), 200
+
+
+@app.route('/api/catalog/export', methods=['GET'])
+def export_catalog():
+    """Esporta il menu completo in CSV (default) o NDJSON, reimportabile con /api/catalog/import"""
+    try:
+        fmt = detect_format(request.args.get('format', 'csv'), None)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        rows = db.export_catalog()
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return Response(export_lines(rows, fmt, app.json.dumps), mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'})
+
+
+# ==================== ANALISI ====================
+
+@app.route('/api/analytics/sales', methods=['GET'])
+def get_sales():
+    """Vendite per prodotto, categoria, ora o giorno (`group_by`, default product)
+
+    Lette dalle tabelle aggregate per ora aggiornate a ogni ordine: il costo non
+    dipende dal numero di ordini. `from`/`to` (data o data e ora ISO) sono
+    arrotondati all'ora; gli ordini annullati sono esclusi.
+    """
+    try:
+        date_from = parse_date_param(request.args.get('from'))
+        date_to = parse_date_param(request.args.get('to'), end=True)
+        sales = db.get_sales(request.args.get('group_by', 'product'), date_from, date_to)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify({'status': 'success', 'data': sales['rows'], 'totals': sales['totals']}), 200
+
+
 # ==================== ORDINI ====================
 
-@app.route('/api/orders', methods=['GET'])
-def get_orders():
-    """Ritorna tutti gli ordini (per il pannello staff)"""
+def attach_order_items(orders):
+    """Associa a ogni ordine i suoi item caricandoli con una sola query.
+
+    Gli ordini ancora nella coda di scrittura hanno già i propri item.
+    """
+    items_by_order = db.get_items_for_orders([order['id'] for order in orders if 'items' not in order])
+    return [order if 'items' in order else {**order, 'items': items_by_order.get(order['id'], [])}
+            for order in orders]
+
+
+def format_timestamp(value):
+    """Normalizza un timestamp del database (datetime MySQL o stringa SQLite)"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def encode_cursor(order):
+    """Crea il cursore opaco (created_at, id) di un ordine"""
+    raw = f"{format_timestamp(order['created_at'])}|{order['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decodifica un cursore; solleva ValueError se non è valido"""
     try:
-        status_filter = request.args.get('status', None)
-        
-        if status_filter:
-            orders = db.get_orders_by_status(status_filter)
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, order_id = raw.rsplit('|', 1)
+        datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
+        return created_at, int(order_id)
+    except Exception:
+        raise ValueError('Cursore non valido')
+
+
+def encode_since_token(position):
+    """Crea il token opaco (updated_at, id) da passare come `since` al poll successivo"""
+    updated_at, order_id = position
+    raw = f"since|{format_timestamp(updated_at)}|{order_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def parse_since(value):
+    """Converte il parametro `since` (token o data e ora ISO) nella posizione (updated_at, id)"""
+    try:
+        return parse_date_param(value), 0
+    except ValueError:
+        pass
+    try:
+        raw = base64.urlsafe_b64decode(value.encode('ascii')).decode('utf-8')
+        prefix, position = raw.split('|', 1)
+        if prefix != 'since':
+            raise ValueError
+        # i token senza id (versioni precedenti) ripartono dall'inizio di quel secondo
+        timestamp, _, order_id = position.partition('|')
+        datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+        return timestamp, int(order_id or 0)
+    except Exception:
+        raise ValueError('Parametro since non valido')
+
+
+def changes_page(orders, since, limit, db_now=None):
+    """Taglia una pagina di modifiche e ritorna (ordini, token successivo, altre modifiche?)
+
+    Il token è la posizione (updated_at, id) dell'ultima modifica restituita; se non
+    ci sono modifiche resta quello richiesto. I timestamp hanno la risoluzione del
+    secondo: finché il secondo dell'ultima modifica è ancora in corso (secondo l'ora
+    del database `db_now`) un ordine con id minore potrebbe ancora cambiare in quel
+    secondo, quindi il token riparte dall'inizio del secondo e quelle righe vengono
+    rinviate (il client le sostituisce per `id`) per al massimo un secondo.
+    """
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    if not orders:
+        return orders, encode_since_token(since), has_more
+    updated_at = format_timestamp(orders[-1]['updated_at'])
+    if db_now is None:
+        # solo ordini in coda: hanno l'ora UTC del server, come queue_order
+        db_now = datetime.now(timezone.utc)
+    if updated_at < format_timestamp(db_now):
+        position = (updated_at, orders[-1]['id'])
+    else:
+        position = (updated_at, 0)
+    return orders, encode_since_token(position), has_more
+
+
+def parse_date_param(value, end=False):
+    """Converte un parametro from/to (data o data e ora ISO) nel formato del database.
+
+    Una data senza ora usata come limite superiore include l'intera giornata.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Data non valida: {value}')
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# colonne dell'export CSV degli ordini: una riga per item (l'ordine si ripete)
+ORDER_EXPORT_FIELDS = ('order_id', 'order_number', 'status', 'total_price', 'created_at', 'updated_at',
+                       'item_id', 'product_id', 'product_name', 'category_id', 'quantity', 'price')
+# byte accumulati prima di inviare un pezzo dell'export (una scrittura sul socket per ordine costa)
+ORDER_EXPORT_CHUNK = 64 * 1024
+
+
+def export_order_lines(orders, fmt):
+    """Serializza gli ordini uno alla volta: NDJSON (un ordine con item per riga) o CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(ORDER_EXPORT_FIELDS)
+    for order in orders:
+        if fmt == 'ndjson':
+            buffer.write(app.json.dumps(order))
+            buffer.write('\n')
         else:
-            orders = db.get_all_orders()
+            head = [order['id'], order['order_number'], order['status'], order['total_price'],
+                    format_timestamp(order['created_at']), format_timestamp(order['updated_at'])]
+            # un ordine senza item occupa comunque una riga
+            for item in order['items'] or [None]:
+                tail = ([item['id'], item['product_id'], item['name'], item['category_id'],
+                         item['quantity'], item['price']] if item else [''] * 6)
+                writer.writerow(head + tail)
+        if buffer.tell() >= ORDER_EXPORT_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def publish_order_event(event_type, order_id):
+    """Invia agli abbonati dello stream l'ordine modificato con i suoi item"""
+    order = db.get_order_by_id(order_id)
+    if not order:
+        return
+    order['items'] = db.get_order_items(order_id)
+    order_events.publish(event_type, app.json.dumps(order))
+
+
+# ==================== CODA DI SCRITTURA ====================
+
+def queue_order(items, total_price):
+    """Accetta un ordine già prezzato nella coda di scrittura e ritorna (id, numero d'ordine).
+
+    Id e numero vengono dai blocchi riservati in memoria, quindi di norma non serve
+    alcuna query: la risposta aspetta solo la scrittura del journal locale.
+    """
+    # stesso formato e fuso di CURRENT_TIMESTAMP: UTC su SQLite e, per init_command, su MySQL
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    order_id = db.next_order_id()
+    order = {
+        'id': order_id,
+        'order_number': db.next_order_number(),
+        'total_price': float(total_price),
+        'status': 'pending',
+        'created_at': now,
+        'updated_at': now,
+        'items': [{
+            'id': None,
+            'order_id': order_id,
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'price': float(item['price']),
+            'name': item['name'],
+            'category_id': item['category_id']
+        } for item in items]
+    }
+    order_queue.enqueue(order)
+    db.order_stats.order_created(total_price)
+    order_events.publish('order_created', app.json.dumps(order))
+    return order_id, order['order_number']
+
+
+def queued_orders(status=None, date_from=None, date_to=None):
+    """Ordini ancora nella coda di scrittura che rispettano i filtri della lista"""
+    if not order_queue:
+        return []
+    return [order for order in order_queue.pending()
+            if (not status or order['status'] == status)
+            and (not date_from or order['created_at'] >= date_from)
+            and (not date_to or order['created_at'] < date_to)]
+
+
+def merge_queued_page(orders, queued, count, before=None, after=None):
+    """Aggiunge a una pagina del database (dal più recente) gli ordini in coda che vi rientrano.
+
+    `count` è il numero di righe chiesto al database; se un ordine è già stato
+    scritto vale la riga del database.
+    """
+    if not queued:
+        return orders
+
+    def key(order):
+        return format_timestamp(order['created_at']), order['id']
+
+    if before:
+        queued = [order for order in queued if key(order) < before]
+    if after:
+        queued = [order for order in queued if key(order) > after]
+    by_id = {order['id']: order for order in queued}
+    by_id.update((order['id'], order) for order in orders)
+    merged = sorted(by_id.values(), key=key, reverse=True)
+    # con `after` la pagina è quella più vicina al cursore, cioè in fondo
+    return merged[-count:] if after else merged[:count]
+
+
+def merge_queued_changes(orders, queued, since, count):
+    """Aggiunge alle modifiche dopo la posizione `since` (dalla meno recente) gli ordini in coda"""
+    def key(order):
+        return format_timestamp(order['updated_at']), order['id']
 
-        # Organizza gli ordini con i loro item
-        orders_with_items = []
-        for order in orders:
-            order_items = db.get_order_items(order['id'])
-            orders_with_items.append({
-                **order,
-                'items': order_items
-            })
+    queued = [order for order in queued if key(order) > since]
+    if not queued:
+        return orders
+
+    by_id = {order['id']: order for order in queued}
+    by_id.update((order['id'], order) for order in orders)
+    return sorted(by_id.values(), key=key)[:count]
+
+
+@app.route('/api/orders/stream', methods=['GET'])
+def stream_orders():
+    """Stream Server-Sent Events con le modifiche agli ordini (per il pannello staff)
+
+    Supporta la ripresa tramite l'header `Last-Event-ID` e invia un heartbeat
+    periodico; non tiene occupata alcuna connessione al database.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    seq, reset = order_events.resume_point(last_event_id)
+
+    def generate():
+        nonlocal seq, reset
+        yield b'retry: 3000\n\n'
+        while True:
+            if reset:
+                yield b'event: reset\ndata: {}\n\n'
+                reset = False
+            events = order_events.wait_for_events(seq, ORDER_STREAM_HEARTBEAT)
+            if not events:
+                yield b': heartbeat\n\n'
+                continue
+            if events[0].seq > seq + 1:
+                # il client è rimasto indietro oltre lo storico disponibile
+                reset = True
+                seq = events[-1].seq
+                continue
+            for event in events:
+                yield event.payload
+            seq = events[-1].seq
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/orders', methods=['GET'])
+def get_orders():
+    """Ritorna una pagina di ordini, dal più recente (per il pannello staff)
+
+    Parametri opzionali: `status`, `limit`, `before`/`after` (cursore ritornato
+    in `next_cursor`) e `from`/`to` (data o data e ora ISO).
+
+    Con `since` (token `next_since` del poll precedente o data e ora ISO) ritorna
+    invece solo gli ordini creati o modificati da quel momento, dal meno recente,
+    con il token per il poll successivo; in questo caso `status` non è ammesso.
+    """
+    try:
+        try:
+            limit = int(request.args.get('limit', ORDERS_PAGE_SIZE))
+            if limit < 1 or limit > ORDERS_MAX_PAGE_SIZE:
+                raise ValueError(f'limit deve essere tra 1 e {ORDERS_MAX_PAGE_SIZE}')
+            before = request.args.get('before')
+            after = request.args.get('after')
+            if before and after:
+                raise ValueError('Usare before oppure after, non entrambi')
+            since = request.args.get('since')
+            if since and (before or after):
+                raise ValueError('since non si combina con before/after')
+            if since and request.args.get('status'):
+                # un ordine che esce dallo stato filtrato non verrebbe mai segnalato
+                raise ValueError('since non si combina con status: filtrare lato client')
+            since = parse_since(since) if since else None
+            before = decode_cursor(before) if before else None
+            after = decode_cursor(after) if after else None
+            date_from = parse_date_param(request.args.get('from'))
+            date_to = parse_date_param(request.args.get('to'), end=True)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        if since:
+            orders, db_now = db.get_orders_changed_since(since, limit + 1)
+            orders = merge_queued_changes(orders, queued_orders(), since, limit + 1)
+            orders, next_since, has_more = changes_page(orders, since, limit, db_now)
+            orders_with_items = attach_order_items(orders)
+            return jsonify({
+                'status': 'success',
+                'data': orders_with_items,
+                'count': len(orders_with_items),
+                'next_since': next_since,
+                'has_more': has_more
+            }), 200
+
+        # una riga in più ci dice se esiste la pagina successiva
+        status = request.args.get('status', None)
+        orders = None
+        if status in ACTIVE_ORDER_STATUSES:
+            # None se la vista non è caricata: si legge dal database
+            orders = db.active_orders.page(status, limit + 1, before, after, date_from, date_to)
+        if orders is None:
+            orders = db.get_orders_page(
+                status=status,
+                limit=limit + 1,
+                before=before,
+                after=after,
+                date_from=date_from,
+                date_to=date_to
+            )
+        orders = merge_queued_page(
+            orders, queued_orders(status, date_from, date_to),
+            limit + 1, before, after)
+        has_more = len(orders) > limit
+        if has_more:
+            # la riga in eccesso è quella più lontana nella direzione di scorrimento
+            orders = orders[1:] if after else orders[:limit]
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(orders[0] if after else orders[-1])
+
+        orders_with_items = attach_order_items(orders)
 
         return jsonify({
             'status': 'success',
             'data': orders_with_items,
-            'count': len(orders_with_items)
+            'count': len(orders_with_items),
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/api/orders/stats', methods=['GET'])
+def get_order_stats():
+    """Contatori per la dashboard staff: ordini per stato, ordini e incasso di oggi
+
+    I contatori sono tenuti in memoria e aggiornati da ogni nuovo ordine o cambio di
+    stato e riletti dal database ogni `ORDER_STATS_TTL` secondi (per vedere anche gli
+    ordini degli altri processi) e a mezzanotte.
+    """
+    try:
+        return jsonify({'status': 'success', 'data': db.get_order_stats()}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders/export', methods=['GET'])
+def export_orders():
+    """Esporta gli ordini (archiviati compresi) con i loro item, in NDJSON (default) o CSV
+
+    Filtri opzionali `status` e `from`/`to` come nella lista. La risposta è generata
+    mentre viene letta dal database, quindi la memoria non cresce con il periodo.
+    Con troppi export già in corso risponde 503.
+    """
+    try:
+        fmt = detect_format(request.args.get('format', 'ndjson'), None)
+        date_from = parse_date_param(request.args.get('from'))
+        date_to = parse_date_param(request.args.get('to'), end=True)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        orders = db.stream_orders(request.args.get('status', None), date_from, date_to)
+        # la prima lettura avviene qui: un errore del database diventa ancora un 500
+        first = list(itertools.islice(orders, 1))
+    except PoolTimeout as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return Response(export_order_lines(itertools.chain(first, orders), fmt), mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=orders.{fmt}'})
+
+
 @app.route('/api/orders/<int:order_id>', methods=['GET'])
 def get_order(order_id):
     """Ritorna un ordine specifico con i suoi item"""
     try:
+        # un ordine ancora in coda non è nel database; una volta scritto esce dalla coda
+        queued = order_queue.get(order_id) if order_queue else None
+        if queued:
+            return jsonify({'status': 'success', 'data': queued}), 200
+
+        active = db.active_orders.get(order_id)
+        if active:
+            return jsonify({'status': 'success', 'data': active}), 200
+
         order = db.get_order_by_id(order_id)
         if not order:
             return jsonify({'status': 'error', 'message': 'Ordine non trovato'}), 404
@@ -334,30 +998,49 @@ def create_order():
         data = request.get_json()
 
         # Validazione
-        if not data or not all(k in data for k in ['items', 'total_price']):
+        if not data or 'items' not in data:
             return jsonify({
                 'status': 'error',
-                'message': 'Campi obbligatori: items, total_price'
+                'message': 'Campo obbligatorio: items'
             }), 400
 
-        # Genera numero ordine univoco
-        import random
-        order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}"
+        # Prezzi e totale calcolati dal listino, non presi dal client
+        try:
+            items, total_price = db.price_order_items(data['items'])
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        if order_queue:
+            # risposta immediata: l'ordine è al sicuro nel journal locale
+            order_id, order_number = queue_order(items, total_price)
+            return jsonify({
+                'status': 'success',
+                'message': 'Ordine creato con successo',
+                'order_id': order_id,
+                'order_number': order_number,
+                'total_price': float(total_price)
+            }), 201
+
+        # Numero ordine univoco e progressivo nella giornata
+        order_number = db.next_order_number()
 
         order_id = db.create_order(
             order_number=order_number,
-            items=data['items'],
-            total_price=float(data['total_price'])
+            items=[{**item, 'price': float(item['price'])} for item in items],
+            total_price=float(total_price)
         )
 
         if order_id == -1:
             return jsonify({'status': 'error', 'message': 'Errore creazione ordine'}), 500
 
+        publish_order_event('order_created', order_id)
+
         return jsonify({
             'status': 'success',
             'message': 'Ordine creato con successo',
             'order_id': order_id,
-            'order_number': order_number
+            'order_number': order_number,
+            'total_price': float(total_price)
         }), 201
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -372,11 +1055,22 @@ def update_order_status(order_id):
         if not data or 'status' not in data:
             return jsonify({'status': 'error', 'message': 'Campo obbligatorio: status'}), 400
 
+        if order_queue and not order_queue.wait_committed(order_id, ORDER_QUEUE_WAIT):
+            return jsonify({'status': 'error', 'message': 'Ordine ancora in coda di scrittura, riprovare'}), 503
+
         success = db.update_order_status(order_id, data['status'])
 
+        if success is None:
+            # l'ordine non è tra quelli vivi: nessuna modifica, nessun evento
+            if db.get_order_by_id(order_id):
+                return jsonify({'status': 'error', 'message': 'Ordine archiviato, non modificabile'}), 409
+            return jsonify({'status': 'error', 'message': 'Ordine non trovato'}), 404
+
         if not success:
             return jsonify({'status': 'error', 'message': 'Stato ordine non valido'}), 400
 
+        publish_order_event('order_updated', order_id)
+
         return jsonify({
             'status': 'success',
             'message': f"Ordine aggiornato a: {data['status']}"
@@ -385,6 +1079,30 @@ def update_order_status(order_id):
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/api/orders/active/check', methods=['GET'])
+def check_active_orders():
+    """Confronta la vista in memoria degli ordini attivi con il database"""
+    if not db.active_orders.loaded:
+        return jsonify({'status': 'error', 'message': 'Vista ordini attivi non caricata'}), 409
+    try:
+        report = db.check_active_orders()
+        return jsonify({'status': 'success', 'data': report}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders/active/rebuild', methods=['POST'])
+def rebuild_active_orders():
+    """Ricarica dal database la vista in memoria degli ordini attivi"""
+    if not ACTIVE_ORDERS_VIEW:
+        return jsonify({'status': 'error', 'message': 'Vista ordini attivi disattivata (ACTIVE_ORDERS_VIEW=0)'}), 409
+    try:
+        count = db.load_active_orders()
+        return jsonify({'status': 'success', 'message': f'{count} ordini attivi caricati'}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
 # ==================== SALUTE ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -392,10 +1110,25 @@ def health():
     """Endpoint per verificare lo stato del server"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'pool': db.pool_stats()
     }), 200
 
 
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 solo dopo che la fase di avvio è terminata"""
+    if not app_ready.is_set():
+        return jsonify({'status': 'starting'}), 503
+    return jsonify({'status': 'ready'}), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Metriche di latenza, errori e righe in formato testo Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 # ==================== ERRORI ====================
 
 @app.errorhandler(404)
@@ -416,60 +1149,20 @@ def internal_error(e):
 
 if __name__ == '__main__':
     try:
-        db.connect()
-        db.init_categories_table()
-        db.init_products_table()
-        db.init_orders_table()
-        db.init_order_items_table()
-        print("✓ Database inizializzato")
-
-        # inserisce categorie e prodotti d'esempio se il DB è vuoto
-        def seed_initial_data():
-            # list of default categories we want present in the system
-            defaults = [
-                {'name':'Hamburger', 'description':'Panini classici', 'icon':'🍔'},
-                {'name':'Bevande', 'description':'Bibite e altro', 'icon':'🥤'},
-                {'name':'Contorni', 'description':'Patatine, etc.', 'icon':'🍟'},
-                {'name':'Panini speciali', 'description':'Creazioni uniche', 'icon':'🥪'},
-                {'name':'Dessert', 'description':'Dolci e gelati', 'icon':'🍨'}
-            ]
-
-            existing = {c['name'] for c in db.get_all_categories()}
-            added = 0
-            for idx, cat in enumerate(defaults, start=1):
-                if cat['name'] not in existing:
-                    db.add_category(name=cat['name'], description=cat['description'], icon=cat['icon'], order_position=idx)
-                    added += 1
-            if added:
-                print(f"→ Aggiunte {added} categorie di default")
-            else:
-                print("→ Tutte le categorie di default sono già presenti, salto seed")
-
-            prods = db.get_all_products()
-            if not prods:
-                print("→ Aggiungo alcuni prodotti di esempio")
-                # recupera id categorie appena create
-                hamburgers = db.get_category_by_name('Hamburger')
-                drinks = db.get_category_by_name('Bevande')
-                sides = db.get_category_by_name('Contorni')
-                if hamburgers:
-                    db.add_product(name='Classic Burger', description='Carne, lattuga, pomodoro', price=5.99, category_id=hamburgers['id'])
-                    db.add_product(name='Cheese Burger', description='Con formaggio extra', price=6.99, category_id=hamburgers['id'])
-                if drinks:
-                    db.add_product(name='Coca Cola', description='Lattina 33cl', price=2.50, category_id=drinks['id'])
-                if sides:
-                    db.add_product(name='Patatine fritte', description='Porzione media', price=3.00, category_id=sides['id'])
-            else:
-                print(f"→ {len(prods)} prodotti già presenti, salto seed")
-
-        seed_initial_data()
-
-        app.run(
-            host='0.0.0.0',
-            port=os.getenv('FLASK_PORT', 5000),
-            debug=os.getenv('FLASK_ENV') == 'development'
-        )
+        if SERVER_MODE == 'asgi':
+            # l'avvio (bootstrap) viene eseguito da asgi_app prima di aprire la porta
+            import asgi_app
+            asgi_app.run(host='0.0.0.0', port=int(os.getenv('FLASK_PORT', 5000)))
+        else:
+            bootstrap()
+            app.run(
+                host='0.0.0.0',
+                port=os.getenv('FLASK_PORT', 5000),
+                debug=os.getenv('FLASK_ENV') == 'development'
+            )
     except Exception as e:
         print(f"✗ Errore avvio: {e}")
     finally:
+        if order_queue:
+            order_queue.stop()
         db.disconnect()
@@ -0,0 +1,621 @@
+"""
+Hamburgheria Damico Deg Deghi - Modalità ASGI del backend
+Stesse rotte `/api/*` di app.py servite da Quart con accesso asincrono al database
+
+Le richieste non occupano un thread durante le query (aiomysql/aiosqlite) e gli
+stream SSE del pannello staff restano aperti senza costi, quindi un solo processo
+regge migliaia di connessioni contemporanee. Le rotte che non hanno ancora una
+versione asincrona vengono servite dall'app Flask in un pool di thread, con la
+stessa cache del menu e lo stesso indice prezzi.
+
+Si attiva con SERVER_MODE=asgi (`python app.py`) oppure direttamente:
+    hypercorn asgi_app:application --bind 0.0.0.0:5000
+"""
+from quart import Quart, Response, g, request, jsonify
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from async_database_wrapper import AsyncDatabaseWrapper
+from database_wrapper import ACTIVE_ORDER_STATUSES
+from metrics import registry as metrics
+from response_encoding import FastJSONProvider, compress, compressible, encode_static_payload, negotiate_encoding
+from app import (app as flask_app, db as sync_db, app_ready, bootstrap, order_events,
+                 JSON_PROVIDER, ORDER_STREAM_HEARTBEAT, ORDERS_PAGE_SIZE, ORDERS_MAX_PAGE_SIZE,
+                 ORDER_QUEUE_WAIT, order_queue, queue_order, queued_orders, merge_queued_page,
+                 merge_queued_changes, encode_cursor, decode_cursor, parse_date_param, parse_since,
+                 changes_page)
+from datetime import datetime
+import asyncio
+import os
+import time
+
+# dimensione massima del corpo delle richieste inoltrate all'app Flask
+WSGI_MAX_BODY_SIZE = 16 * 1024 * 1024
+
+app = Quart(__name__)
+if JSON_PROVIDER == 'fast':
+    app.json = FastJSONProvider(app)
+
+# Database asincrono che condivide cache e indice prezzi con quello dell'app Flask
+db = AsyncDatabaseWrapper(shared=sync_db)
+
+
+# ==================== STARTUP ====================
+
+@app.before_serving
+async def startup():
+    """Esegue la fase di avvio (una volta, con il wrapper sincrono) e apre il pool asincrono"""
+    await asyncio.get_running_loop().run_in_executor(None, bootstrap)
+    await db.connect()
+    await db.get_order_stats()
+
+
+@app.after_serving
+async def shutdown():
+    if order_queue:
+        await asyncio.get_running_loop().run_in_executor(None, order_queue.stop)
+    await db.disconnect()
+    sync_db.disconnect()
+
+
+@app.before_request
+async def before_request():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def after_request(response):
+    """Comprime le risposte grandi, registra la durata della richiesta e aggiunge gli header CORS"""
+    if compressible(response):
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding:
+            response.set_data(compress(await response.get_data(), encoding))
+            response.headers['Content-Encoding'] = encoding
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds',
+                        (request.method, route, str(response.status_code)),
+                        time.perf_counter() - started)
+    if request.path.startswith('/api/'):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        if request.method == 'OPTIONS':
+            response.headers['Access-Control-Allow-Methods'] = response.headers.get('Allow', '')
+            requested = request.headers.get('Access-Control-Request-Headers')
+            if requested:
+                response.headers['Access-Control-Allow-Headers'] = requested
+    return response
+
+
+# ==================== MENU (CACHE) ====================
+
+async def cached_list_response(key, load):
+    """Risponde con una lista del menu servita dalla cache, con ETag forte"""
+    async def build():
+        rows = await load()
+        return app.json.dumps({
+            'status': 'success',
+            'data': rows,
+            'count': len(rows)
+        }).encode('utf-8')
+
+    body, etag = await db.cached_payload(key, build)
+    body, etag, encoding = encode_static_payload(body, etag, request.accept_encodings)
+    response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.no_cache = True
+    return await response.make_conditional(request)
+
+
+# ==================== PRODOTTI ====================
+
+@app.route('/api/products', methods=['GET'])
+async def get_products():
+    """Ritorna tutti i prodotti disponibili (per il totem cliente)"""
+    try:
+        return await cached_list_response(('products',), db.get_all_products)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/products/category/<int:category_id>', methods=['GET'])
+async def get_products_by_category(category_id):
+    """Ritorna i prodotti di una categoria specifica"""
+    try:
+        return await cached_list_response(('products', category_id),
+                                          lambda: db.get_products_by_category(category_id))
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/products/<int:product_id>', methods=['GET'])
+async def get_product(product_id):
+    """Ritorna un prodotto specifico per ID"""
+    try:
+        product = await db.get_product_by_id(product_id)
+        if not product:
+            return jsonify({'status': 'error', 'message': 'Prodotto non trovato'}), 404
+        return jsonify({'status': 'success', 'data': product}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/products', methods=['POST'])
+async def create_product():
+    """Crea un nuovo prodotto (Solo staff)"""
+    try:
+        data = await request.get_json()
+
+        if not data or not all(k in data for k in ['name', 'price', 'category_id']):
+            return jsonify({
+                'status': 'error',
+                'message': 'Campi obbligatori: name, price, category_id'
+            }), 400
+
+        product_id = await db.add_product(
+            name=data['name'],
+            description=data.get('description', ''),
+            price=float(data['price']),
+            category_id=int(data['category_id']),
+            image_url=data.get('image_url', None)
+        )
+
+        if product_id == -1:
+            return jsonify({'status': 'error', 'message': 'Errore creazione prodotto'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Prodotto creato con successo',
+            'product_id': product_id
+        }), 201
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/products/<int:product_id>', methods=['PUT'])
+async def update_product(product_id):
+    """Aggiorna un prodotto (Solo staff)"""
+    try:
+        data = await request.get_json()
+
+        if not data:
+            return jsonify({'status': 'error', 'message': 'Nessun dato fornito'}), 400
+
+        success = await db.update_product(
+            product_id=product_id,
+            name=data.get('name'),
+            description=data.get('description'),
+            price=data.get('price'),
+            category_id=int(data.get('category_id')) if data.get('category_id') else None,
+            image_url=data.get('image_url')
+        )
+
+        if not success:
+            return jsonify({'status': 'error', 'message': 'Errore aggiornamento prodotto'}), 500
+
+        return jsonify({'status': 'success', 'message': 'Prodotto aggiornato con successo'}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/products/<int:product_id>', methods=['DELETE'])
+async def delete_product(product_id):
+    """Elimina un prodotto (Solo staff)"""
+    try:
+        success = await db.delete_product(product_id)
+        if not success:
+            return jsonify({'status': 'error', 'message': 'Errore eliminazione prodotto'}), 500
+
+        return jsonify({'status': 'success', 'message': 'Prodotto eliminato con successo'}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# ==================== CATEGORIE ====================
+
+@app.route('/api/categories', methods=['GET'])
+async def get_categories():
+    """Ritorna tutte le categorie disponibili"""
+    try:
+        return await cached_list_response(('categories',), db.get_all_categories)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/categories/<int:category_id>', methods=['GET'])
+async def get_category(category_id):
+    """Ritorna una categoria per ID"""
+    try:
+        category = await db.get_category_by_id(category_id)
+        if not category:
+            return jsonify({'status': 'error', 'message': 'Categoria non trovata'}), 404
+        return jsonify({'status': 'success', 'data': category}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/categories', methods=['POST'])
+async def create_category():
+    """Crea una nuova categoria (Solo staff)"""
+    try:
+        data = await request.get_json()
+
+        if not data or 'name' not in data:
+            return jsonify({'status': 'error', 'message': 'Campo obbligatorio: name'}), 400
+
+        category_id = await db.add_category(
+            name=data['name'],
+            description=data.get('description', None),
+            icon=data.get('icon', None),
+            order_position=data.get('order_position', 0)
+        )
+
+        if category_id == -1:
+            return jsonify({'status': 'error', 'message': 'Errore creazione categoria'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Categoria creata con successo',
+            'category_id': category_id
+        }), 201
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/categories/<int:category_id>', methods=['PUT'])
+async def update_category(category_id):
+    """Aggiorna una categoria (Solo staff)"""
+    try:
+        data = await request.get_json()
+
+        if not data:
+            return jsonify({'status': 'error', 'message': 'Nessun dato fornito'}), 400
+
+        success = await db.update_category(
+            category_id=category_id,
+            name=data.get('name'),
+            description=data.get('description'),
+            icon=data.get('icon'),
+            order_position=data.get('order_position')
+        )
+
+        if not success:
+            return jsonify({'status': 'error', 'message': 'Errore aggiornamento categoria'}), 500
+
+        return jsonify({'status': 'success', 'message': 'Categoria aggiornata con successo'}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/categories/<int:category_id>', methods=['DELETE'])
+async def delete_category(category_id):
+    """Elimina una categoria (Solo staff)"""
+    try:
+        success = await db.delete_category(category_id)
+        if not success:
+            return jsonify({'status': 'error', 'message': 'Errore eliminazione categoria'}), 500
+
+        return jsonify({'status': 'success', 'message': 'Categoria eliminata con successo'}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# ==================== ORDINI ====================
+
+async def attach_order_items(orders):
+    """Associa a ogni ordine i suoi item caricandoli con una sola query (tranne a quelli in coda)"""
+    items_by_order = await db.get_items_for_orders([order['id'] for order in orders if 'items' not in order])
+    return [order if 'items' in order else {**order, 'items': items_by_order.get(order['id'], [])}
+            for order in orders]
+
+
+async def publish_order_event(event_type, order_id):
+    """Invia agli abbonati dello stream l'ordine modificato con i suoi item"""
+    order = await db.get_order_by_id(order_id)
+    if not order:
+        return
+    order['items'] = await db.get_order_items(order_id)
+    order_events.publish(event_type, app.json.dumps(order))
+
+
+@app.route('/api/orders/stream', methods=['GET'])
+async def stream_orders():
+    """Stream Server-Sent Events con le modifiche agli ordini (per il pannello staff)
+
+    Ogni abbonato è una coroutine in attesa sul broker: non occupa né un thread né
+    una connessione al database.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    seq, reset = order_events.resume_point(last_event_id)
+
+    async def generate():
+        nonlocal seq, reset
+        yield b'retry: 3000\n\n'
+        while True:
+            if reset:
+                yield b'event: reset\ndata: {}\n\n'
+                reset = False
+            events = await order_events.wait_for_events_async(seq, ORDER_STREAM_HEARTBEAT)
+            if not events:
+                yield b': heartbeat\n\n'
+                continue
+            if events[0].seq > seq + 1:
+                reset = True
+                seq = events[-1].seq
+                continue
+            for event in events:
+                yield event.payload
+            seq = events[-1].seq
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # lo stream non ha una durata massima
+    response.timeout = None
+    return response
+
+
+@app.route('/api/orders', methods=['GET'])
+async def get_orders():
+    """Ritorna una pagina di ordini (o le modifiche da `since`), come in app.py"""
+    try:
+        try:
+            limit = int(request.args.get('limit', ORDERS_PAGE_SIZE))
+            if limit < 1 or limit > ORDERS_MAX_PAGE_SIZE:
+                raise ValueError(f'limit deve essere tra 1 e {ORDERS_MAX_PAGE_SIZE}')
+            before = request.args.get('before')
+            after = request.args.get('after')
+            if before and after:
+                raise ValueError('Usare before oppure after, non entrambi')
+            since = request.args.get('since')
+            if since and (before or after):
+                raise ValueError('since non si combina con before/after')
+            if since and request.args.get('status'):
+                raise ValueError('since non si combina con status: filtrare lato client')
+            since = parse_since(since) if since else None
+            before = decode_cursor(before) if before else None
+            after = decode_cursor(after) if after else None
+            date_from = parse_date_param(request.args.get('from'))
+            date_to = parse_date_param(request.args.get('to'), end=True)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        if since:
+            orders, db_now = await db.get_orders_changed_since(since, limit + 1)
+            orders = merge_queued_changes(orders, queued_orders(), since, limit + 1)
+            orders, next_since, has_more = changes_page(orders, since, limit, db_now)
+            orders_with_items = await attach_order_items(orders)
+            return jsonify({
+                'status': 'success',
+                'data': orders_with_items,
+                'count': len(orders_with_items),
+                'next_since': next_since,
+                'has_more': has_more
+            }), 200
+
+        status = request.args.get('status', None)
+        orders = None
+        if status in ACTIVE_ORDER_STATUSES:
+            orders = db.active_orders.page(status, limit + 1, before, after, date_from, date_to)
+        if orders is None:
+            orders = await db.get_orders_page(
+                status=status,
+                limit=limit + 1,
+                before=before,
+                after=after,
+                date_from=date_from,
+                date_to=date_to
+            )
+        orders = merge_queued_page(
+            orders, queued_orders(status, date_from, date_to),
+            limit + 1, before, after)
+        has_more = len(orders) > limit
+        if has_more:
+            orders = orders[1:] if after else orders[:limit]
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(orders[0] if after else orders[-1])
+
+        orders_with_items = await attach_order_items(orders)
+
+        return jsonify({
+            'status': 'success',
+            'data': orders_with_items,
+            'count': len(orders_with_items),
+            'next_cursor': next_cursor
+        }), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders/stats', methods=['GET'])
+async def get_order_stats():
+    """Contatori per la dashboard staff, letti dalla memoria"""
+    try:
+        return jsonify({'status': 'success', 'data': await db.get_order_stats()}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders/<int:order_id>', methods=['GET'])
+async def get_order(order_id):
+    """Ritorna un ordine specifico con i suoi item"""
+    try:
+        queued = order_queue.get(order_id) if order_queue else None
+        if queued:
+            return jsonify({'status': 'success', 'data': queued}), 200
+
+        active = db.active_orders.get(order_id)
+        if active:
+            return jsonify({'status': 'success', 'data': active}), 200
+
+        order = await db.get_order_by_id(order_id)
+        if not order:
+            return jsonify({'status': 'error', 'message': 'Ordine non trovato'}), 404
+
+        order['items'] = await db.get_order_items(order_id)
+
+        return jsonify({'status': 'success', 'data': order}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders', methods=['POST'])
+async def create_order():
+    """Crea un nuovo ordine (dal totem cliente)"""
+    try:
+        data = await request.get_json()
+
+        if not data or 'items' not in data:
+            return jsonify({'status': 'error', 'message': 'Campo obbligatorio: items'}), 400
+
+        try:
+            items, total_price = await db.price_order_items(data['items'])
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        if order_queue:
+            # la scrittura del journal è bloccante: va in un thread, non nell'event loop
+            order_id, order_number = await asyncio.get_running_loop().run_in_executor(
+                None, queue_order, items, total_price)
+            return jsonify({
+                'status': 'success',
+                'message': 'Ordine creato con successo',
+                'order_id': order_id,
+                'order_number': order_number,
+                'total_price': float(total_price)
+            }), 201
+
+        # Numero ordine univoco e progressivo nella giornata
+        order_number = await db.next_order_number()
+
+        order_id = await db.create_order(
+            order_number=order_number,
+            items=[{**item, 'price': float(item['price'])} for item in items],
+            total_price=float(total_price)
+        )
+
+        if order_id == -1:
+            return jsonify({'status': 'error', 'message': 'Errore creazione ordine'}), 500
+
+        await publish_order_event('order_created', order_id)
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Ordine creato con successo',
+            'order_id': order_id,
+            'order_number': order_number,
+            'total_price': float(total_price)
+        }), 201
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/orders/<int:order_id>/status', methods=['PUT'])
+async def update_order_status(order_id):
+    """Aggiorna lo stato di un ordine (dal pannello staff)"""
+    try:
+        data = await request.get_json()
+
+        if not data or 'status' not in data:
+            return jsonify({'status': 'error', 'message': 'Campo obbligatorio: status'}), 400
+
+        if order_queue and not await asyncio.get_running_loop().run_in_executor(
+                None, order_queue.wait_committed, order_id, ORDER_QUEUE_WAIT):
+            return jsonify({'status': 'error', 'message': 'Ordine ancora in coda di scrittura, riprovare'}), 503
+
+        success = await db.update_order_status(order_id, data['status'])
+
+        if success is None:
+            # l'ordine non è tra quelli vivi: nessuna modifica, nessun evento
+            if await db.get_order_by_id(order_id):
+                return jsonify({'status': 'error', 'message': 'Ordine archiviato, non modificabile'}), 409
+            return jsonify({'status': 'error', 'message': 'Ordine non trovato'}), 404
+
+        if not success:
+            return jsonify({'status': 'error', 'message': 'Stato ordine non valido'}), 400
+
+        await publish_order_event('order_updated', order_id)
+
+        return jsonify({
+            'status': 'success',
+            'message': f"Ordine aggiornato a: {data['status']}"
+        }), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# ==================== SALUTE ====================
+
+@app.route('/api/ready', methods=['GET'])
+async def ready():
+    """Readiness probe: 200 solo dopo l'avvio e con il pool asincrono aperto"""
+    if not app_ready.is_set() or not db.pool:
+        return jsonify({'status': 'starting'}), 503
+    return jsonify({'status': 'ready'}), 200
+
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    """Endpoint per verificare lo stato del server"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'mode': 'asgi',
+        'pool': db.pool_stats()
+    }), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+async def get_metrics():
+    """Metriche di latenza, errori e righe in formato testo Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# ==================== ERRORI ====================
+
+@app.errorhandler(404)
+async def not_found(e):
+    return jsonify({'status': 'error', 'message': 'Endpoint non trovato'}), 404
+
+
+@app.errorhandler(500)
+async def internal_error(e):
+    return jsonify({'status': 'error', 'message': 'Errore interno del server'}), 500
+
+
+# ==================== DISPATCH ====================
+
+wsgi_fallback = AsyncioWSGIMiddleware(flask_app, max_body_size=WSGI_MAX_BODY_SIZE)
+
+
+async def application(scope, receive, send):
+    """Punto d'ingresso ASGI: rotte asincrone su Quart, le altre sull'app Flask"""
+    if scope['type'] == 'http':
+        try:
+            app.url_map.bind('').match(scope['path'], method=scope['method'])
+        except (NotFound, MethodNotAllowed):
+            await wsgi_fallback(scope, receive, send)
+            return
+        except Exception:
+            pass
+    await app(scope, receive, send)
+
+
+def run(host: str = '0.0.0.0', port: int = 5000) -> None:
+    """Avvia il server ASGI (Hypercorn) sulla porta indicata"""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    asyncio.run(serve(application, config))
+
+
+if __name__ == '__main__':
+    run(port=int(os.getenv('FLASK_PORT', 5000)))
@@ -0,0 +1,720 @@
+"""
+AsyncDatabaseWrapper - Versione asincrona di DatabaseWrapper per la modalità ASGI
+
+Espone gli stessi metodi di `DatabaseWrapper` usati dalle rotte, come coroutine, sopra
+driver non bloccanti: aiomysql per MySQL e aiosqlite per il fallback SQLite. Cache del
+menu, indice prezzi e metriche possono essere condivisi con un `DatabaseWrapper`
+sincrono, così le due modalità restano coerenti nello stesso processo.
+"""
+from typing import List, Dict, Tuple, Optional, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal
+import asyncio
+import hashlib
+import sys
+import time
+from dotenv import load_dotenv
+from database_wrapper import (DatabaseWrapper, CatalogCache, ProductIndex, OrderStats,
+                              ActiveOrders, OrderNumberBlocks, PoolTimeout, UnknownProduct, ORDER_NUMBER_BLOCK,
+                              ORDER_STATUSES, ORDER_STATS_QUERY, STATEMENT_CACHE_SIZE,
+                              SQLITE_CACHED_STATEMENTS, SQLITE_PRODUCTION_PRAGMAS, PRODUCT_INDEX_MIN_RELOAD,
+                              ORDER_ITEMS_QUERY, ORDERS_CHANGED_QUERY, orders_page_filters, orders_page_query,
+                              items_for_orders_query, create_order_steps, update_order_status_steps,
+                              order_created, order_status_changed, STEP_EXECUTE_MANY, STEP_INSERT,
+                              STEP_FETCH_ONE, STEP_FETCH_ALL)
+from metrics import registry as metrics_registry
+from product_images import with_image_variants
+
+load_dotenv()
+
+# operazioni fallite nel task corrente (l'equivalente asincrono del contatore per thread)
+_failures = ContextVar('db_failures', default=0)
+
+
+class AsyncSQLitePool:
+    """Pool limitato di connessioni aiosqlite.
+
+    Ogni connessione aiosqlite ha un proprio thread di lavoro: il pool ne limita il
+    numero e le riusa tra le coroutine, una alla volta.
+    """
+
+    def __init__(self, factory: Callable, size: int = 10, timeout: float = 30):
+        self._factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self._in_use = 0
+        self._created = 0
+        self._closed = False
+
+    async def acquire(self):
+        """Prende una connessione dal pool, creandola se non ce ne sono di inattive"""
+        if self._closed:
+            raise PoolTimeout("Pool di connessioni chiuso")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"Nessuna connessione libera dopo {self.timeout}s")
+        try:
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = await self._factory()
+                self._created += 1
+        except Exception:
+            self._slots.release()
+            raise
+        self._in_use += 1
+        return conn
+
+    async def release(self, conn, discard: bool = False) -> None:
+        """Restituisce una connessione al pool (o la chiude se `discard` è True)"""
+        self._in_use -= 1
+        self._slots.release()
+        if discard or self._closed:
+            await conn.close()
+        else:
+            self._idle.append(conn)
+
+    async def close(self) -> None:
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+    def stats(self) -> Dict:
+        return {
+            'size': self.size,
+            'in_use': self._in_use,
+            'idle': len(self._idle),
+            'created': self._created,
+        }
+
+
+class AsyncDatabaseWrapper:
+    def __init__(self, shared: DatabaseWrapper = None):
+        source = shared or DatabaseWrapper()
+        # stessa configurazione (variabili d'ambiente) del wrapper sincrono
+        self.host = source.host
+        self.user = source.user
+        self.password = source.password
+        self.database = source.database
+        self.port = source.port
+        self.connect_timeout = source.connect_timeout
+        self.ssl_ca = source.ssl_ca
+        self.ssl_cert = source.ssl_cert
+        self.ssl_key = source.ssl_key
+        self.pool_size = source.pool_size
+        self.pool_max_idle = source.pool_max_idle
+        self.pool_timeout = source.pool_timeout
+        self.sqlite_path = source.sqlite_path
+        self.sqlite_mode = source.sqlite_mode
+
+        self._shared = shared
+        self.use_sqlite = False
+        self.pool = None
+        # con un wrapper condiviso le scritture di una modalità invalidano anche l'altra
+        self.catalog_cache = shared.catalog_cache if shared else CatalogCache()
+        self.product_index = shared.product_index if shared else ProductIndex()
+        self.order_stats = shared.order_stats if shared else OrderStats()
+        self.order_numbers = shared.order_numbers if shared else OrderNumberBlocks()
+        self.active_orders = shared.active_orders if shared else ActiveOrders()
+        self._statements = {}
+        self._translated = {}
+        self.metrics = metrics_registry
+
+    async def connect(self) -> None:
+        """Crea il pool verso MySQL (aiomysql) o, in alternativa, verso SQLite (aiosqlite).
+
+        Se il wrapper sincrono condiviso è già passato a SQLite non si riprova MySQL,
+        evitando di attendere una seconda volta il timeout di connessione.
+        """
+        if not self.host or (self._shared is not None and self._shared.use_sqlite):
+            await self._connect_sqlite()
+            return
+
+        import aiomysql
+        import ssl
+
+        connect_args = {
+            'host': self.host,
+            'user': self.user,
+            'password': self.password,
+            'db': self.database,
+            'port': self.port,
+            'charset': 'utf8mb4',
+            'connect_timeout': self.connect_timeout,
+            'cursorclass': aiomysql.DictCursor,
+            'autocommit': True,
+            # stesso fuso del wrapper sincrono (vedi DatabaseWrapper.connect)
+            'init_command': "SET time_zone = '+00:00'"
+        }
+        if self.ssl_ca or self.ssl_cert:
+            context = ssl.create_default_context(cafile=self.ssl_ca)
+            if self.ssl_cert:
+                context.load_cert_chain(self.ssl_cert, self.ssl_key)
+            connect_args['ssl'] = context
+
+        try:
+            self.pool = await aiomysql.create_pool(
+                minsize=1,
+                maxsize=self.pool_size,
+                pool_recycle=int(self.pool_max_idle),
+                **connect_args
+            )
+            print("✓ Connesso a database MySQL (asincrono)")
+        except Exception as e:
+            print(f"✗ Errore connessione MySQL: {e}. utilizzo SQLite di fallback.")
+            await self._connect_sqlite()
+
+    async def _connect_sqlite(self) -> None:
+        import aiosqlite
+
+        async def factory():
+            conn = await aiosqlite.connect(self.sqlite_path,
+                                           cached_statements=SQLITE_CACHED_STATEMENTS)
+            conn.row_factory = aiosqlite.Row
+            if self.sqlite_mode == 'production':
+                # stesse impostazioni del wrapper sincrono: con WAL e busy_timeout le
+                # connessioni del pool possono scrivere senza errori di lock
+                for pragma in SQLITE_PRODUCTION_PRAGMAS:
+                    await conn.execute(pragma)
+            return conn
+
+        self.use_sqlite = True
+        self._statements.clear()
+        self._translated.clear()
+        self.pool = AsyncSQLitePool(factory, size=self.pool_size, timeout=self.pool_timeout)
+        print("✓ Connesso a database SQLite locale (asincrono)")
+
+    async def disconnect(self) -> None:
+        """Chiude il pool di connessioni"""
+        if self.pool is None:
+            return
+        if self.use_sqlite:
+            await self.pool.close()
+        else:
+            self.pool.close()
+            await self.pool.wait_closed()
+
+    def pool_stats(self) -> Dict:
+        """Ritorna le statistiche del pool di connessioni"""
+        if self.pool is None:
+            return {}
+        if self.use_sqlite:
+            return self.pool.stats()
+        return {
+            'size': self.pool.maxsize,
+            'in_use': self.pool.size - self.pool.freesize,
+            'idle': self.pool.freesize,
+        }
+
+    @asynccontextmanager
+    async def _connection(self):
+        """Fornisce una connessione del pool per la durata del blocco `async with`"""
+        if self.use_sqlite:
+            conn = await self.pool.acquire()
+            try:
+                yield conn
+            finally:
+                await self.pool.release(conn)
+        else:
+            try:
+                conn = await asyncio.wait_for(self.pool.acquire(), self.pool_timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeout(f"Nessuna connessione libera dopo {self.pool_timeout}s")
+            try:
+                yield conn
+            finally:
+                # aiomysql scarta da solo le connessioni chiuse o rimaste in transazione
+                self.pool.release(conn)
+
+    async def cached_payload(self, key, build: Callable) -> Tuple[bytes, str]:
+        """Ritorna (payload, etag) dalla cache del menu, costruendolo con `await build()` se manca"""
+        entry = self.catalog_cache.get(key)
+        if entry:
+            return entry
+        generation = self.catalog_cache.generation
+        failures = _failures.get()
+        body = await build()
+        if _failures.get() != failures:
+            return body, hashlib.sha256(body).hexdigest()[:32]
+        return self.catalog_cache.put(key, body, generation)
+
+    def _record_failure(self, operation: str = None, kind: str = None, started: float = None) -> None:
+        _failures.set(_failures.get() + 1)
+        if operation:
+            self.metrics.inc('db_query_errors_total', (operation, kind))
+            self.metrics.observe('db_query_duration_seconds', (operation, kind),
+                                 time.perf_counter() - started)
+
+    def _observe(self, operation: str, kind: str, started: float, rows: int = None) -> None:
+        self.metrics.observe('db_query_duration_seconds', (operation, kind),
+                             time.perf_counter() - started)
+        if rows:
+            self.metrics.inc('db_rows_total', (operation, kind), rows)
+
+    def _translate_query(self, query: str) -> str:
+        """Se stiamo usando SQLite converte i placeholder %s in ? (con memorizzazione)"""
+        if not self.use_sqlite:
+            return query
+        translated = self._translated.get(query)
+        if translated is None:
+            if len(self._translated) >= STATEMENT_CACHE_SIZE:
+                self._translated.clear()
+            translated = self._translated[query] = query.replace('%s', '?')
+        return translated
+
+    def _statement(self, key: Tuple, build: Callable[[], str]) -> str:
+        """Registro degli statement costruiti dinamicamente, come in `DatabaseWrapper`"""
+        query = self._statements.get(key)
+        if query is None:
+            query = self._translate_query(build())
+            if self.use_sqlite:
+                self._translated[query] = query
+            self._statements[key] = query
+        return query
+
+    async def execute_query(self, query: str, params: tuple = (), operation: str = None) -> List[Dict]:
+        """Esegue una query SELECT (cronometrata come in `DatabaseWrapper.execute_query`)"""
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        try:
+            async with self._connection() as conn:
+                cursor = await conn.cursor()
+                try:
+                    await cursor.execute(self._translate_query(query), params)
+                    rows = await cursor.fetchall()
+                finally:
+                    await cursor.close()
+            if self.use_sqlite:
+                result = [dict(r) for r in rows]
+            else:
+                result = list(rows)
+            self._observe(operation, 'query', started, len(result))
+            return result
+        except Exception as e:
+            self._record_failure(operation, 'query', started)
+            print(f"✗ Errore query: {e}")
+            return []
+
+    async def execute_insert(self, query: str, params: tuple = (), operation: str = None) -> int:
+        """Esegue una query INSERT e ritorna l'ID inserito"""
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        try:
+            async with self._connection() as conn:
+                cursor = await conn.cursor()
+                try:
+                    await cursor.execute(self._translate_query(query), params)
+                    await conn.commit()
+                    self._observe(operation, 'insert', started, cursor.rowcount)
+                    return cursor.lastrowid
+                except Exception:
+                    await self._rollback(conn)
+                    raise
+                finally:
+                    await cursor.close()
+        except Exception as e:
+            self._record_failure(operation, 'insert', started)
+            print(f"✗ Errore inserimento: {e}")
+            return -1
+
+    async def execute_update(self, query: str, params: tuple = (), operation: str = None) -> bool:
+        """Esegue una query UPDATE/DELETE"""
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        try:
+            async with self._connection() as conn:
+                cursor = await conn.cursor()
+                try:
+                    await cursor.execute(self._translate_query(query), params)
+                    await conn.commit()
+                    self._observe(operation, 'update', started, max(cursor.rowcount, 0))
+                    return True
+                except Exception:
+                    await self._rollback(conn)
+                    raise
+                finally:
+                    await cursor.close()
+        except Exception as e:
+            self._record_failure(operation, 'update', started)
+            print(f"✗ Errore aggiornamento: {e}")
+            return False
+
+    @asynccontextmanager
+    async def _transaction(self, operation: str):
+        """Esegue il blocco `async with` in un'unica transazione e fornisce il cursore"""
+        started = time.perf_counter()
+        try:
+            async with self._connection() as conn:
+                if self.use_sqlite:
+                    await conn.execute("BEGIN IMMEDIATE")
+                else:
+                    await conn.begin()
+                cursor = await conn.cursor()
+                try:
+                    yield cursor
+                    await conn.commit()
+                except Exception:
+                    await self._rollback(conn)
+                    raise
+                finally:
+                    await cursor.close()
+        except Exception:
+            self.metrics.inc('db_query_errors_total', (operation, 'transaction'))
+            self.metrics.observe('db_query_duration_seconds', (operation, 'transaction'),
+                                 time.perf_counter() - started)
+            raise
+        self._observe(operation, 'transaction', started)
+
+    async def _run_steps(self, cursor, steps):
+        """Esegue le query di un'operazione condivisa (vedi DatabaseWrapper._run_steps)"""
+        result = None
+        while True:
+            try:
+                kind, query, params = steps.send(result)
+            except StopIteration as done:
+                return done.value
+            result = None
+            if kind == STEP_EXECUTE_MANY:
+                await cursor.executemany(self._translate_query(query), params)
+                continue
+            await cursor.execute(self._translate_query(query), params)
+            if kind == STEP_INSERT:
+                result = cursor.lastrowid
+            elif kind == STEP_FETCH_ONE:
+                row = await cursor.fetchone()
+                result = dict(row) if row is not None else None
+            elif kind == STEP_FETCH_ALL:
+                result = [dict(row) for row in await cursor.fetchall()]
+
+    @staticmethod
+    async def _rollback(conn) -> None:
+        try:
+            await conn.rollback()
+        except Exception:
+            pass
+
+    # ==================== CATEGORIE ====================
+
+    async def add_category(self, name: str, description: str = None, icon: str = None,
+                           order_position: int = 0) -> int:
+        """Aggiunge una nuova categoria"""
+        query = """
+        INSERT INTO categories (name, description, icon, order_position)
+        VALUES (%s, %s, %s, %s)
+        """
+        category_id = await self.execute_insert(query, (name, description, icon, order_position))
+        self.catalog_cache.invalidate()
+        return category_id
+
+    async def update_category(self, category_id: int, name: str = None, description: str = None,
+                              icon: str = None, order_position: int = None) -> bool:
+        """Aggiorna una categoria"""
+        updates = []
+        params = []
+
+        if name:
+            updates.append("name = %s")
+            params.append(name)
+        if description is not None:
+            updates.append("description = %s")
+            params.append(description)
+        if icon is not None:
+            updates.append("icon = %s")
+            params.append(icon)
+        if order_position is not None:
+            updates.append("order_position = %s")
+            params.append(order_position)
+
+        if not updates:
+            return False
+
+        params.append(category_id)
+        query = self._statement(
+            ('update_category', *updates),
+            lambda: f"UPDATE categories SET {', '.join(updates)} WHERE id = %s")
+        success = await self.execute_update(query, tuple(params))
+        self.catalog_cache.invalidate()
+        return success
+
+    async def delete_category(self, category_id: int) -> bool:
+        """Elimina una categoria"""
+        query = "DELETE FROM categories WHERE id = %s"
+        success = await self.execute_update(query, (category_id,))
+        self.catalog_cache.invalidate()
+        return success
+
+    async def get_all_categories(self) -> List[Dict]:
+        """Ritorna tutte le categorie ordinate per posizione"""
+        query = "SELECT * FROM categories ORDER BY order_position, name"
+        return await self.execute_query(query)
+
+    async def get_category_by_id(self, category_id: int) -> Optional[Dict]:
+        """Ritorna una categoria per ID"""
+        query = "SELECT * FROM categories WHERE id = %s"
+        result = await self.execute_query(query, (category_id,))
+        return result[0] if result else None
+
+    # ==================== PRODOTTI ====================
+
+    async def get_all_products(self) -> List[Dict]:
+        """Ritorna tutti i prodotti con info categoria"""
+        query = """
+        SELECT p.*, c.name as category_name, c.icon
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.available = TRUE
+        ORDER BY c.order_position, c.name, p.name
+        """
+        return with_image_variants(await self.execute_query(query))
+
+    async def get_products_by_category(self, category_id: int) -> List[Dict]:
+        """Ritorna i prodotti di una categoria"""
+        query = """
+        SELECT p.*, c.name as category_name, c.icon
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.category_id = %s AND p.available = TRUE
+        ORDER BY p.name
+        """
+        return with_image_variants(await self.execute_query(query, (category_id,)))
+
+    async def get_product_by_id(self, product_id: int) -> Optional[Dict]:
+        """Ritorna un prodotto per ID con info categoria"""
+        query = """
+        SELECT p.*, c.name as category_name, c.icon
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.id = %s
+        """
+        result = with_image_variants(await self.execute_query(query, (product_id,)))
+        return result[0] if result else None
+
+    async def add_product(self, name: str, description: str, price: float,
+                          category_id: int, image_url: str = None) -> int:
+        """Aggiunge un nuovo prodotto"""
+        query = """
+        INSERT INTO products (name, description, price, category_id, image_url)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        product_id = await self.execute_insert(query, (name, description, price, category_id, image_url))
+        self.catalog_cache.invalidate()
+        if product_id != -1:
+            self.product_index.set(product_id, price=price, available=True,
+                                   name=name, category_id=category_id)
+        return product_id
+
+    async def update_product(self, product_id: int, name: str = None, description: str = None,
+                             price: float = None, category_id: int = None, image_url: str = None) -> bool:
+        """Aggiorna un prodotto"""
+        updates = []
+        params = []
+
+        if name:
+            updates.append("name = %s")
+            params.append(name)
+        if description is not None:
+            updates.append("description = %s")
+            params.append(description)
+        if price:
+            updates.append("price = %s")
+            params.append(price)
+        if category_id is not None:
+            updates.append("category_id = %s")
+            params.append(category_id)
+        if image_url is not None:
+            updates.append("image_url = %s")
+            params.append(image_url)
+
+        if not updates:
+            return False
+
+        params.append(product_id)
+        query = self._statement(
+            ('update_product', *updates),
+            lambda: f"UPDATE products SET {', '.join(updates)} WHERE id = %s")
+        success = await self.execute_update(query, tuple(params))
+        self.catalog_cache.invalidate()
+        if success:
+            self.product_index.set(product_id, price=price or None, name=name or None,
+                                   category_id=category_id)
+        return success
+
+    async def delete_product(self, product_id: int) -> bool:
+        """Elimina un prodotto (soft delete)"""
+        query = "UPDATE products SET available = FALSE WHERE id = %s"
+        success = await self.execute_update(query, (product_id,))
+        self.catalog_cache.invalidate()
+        if success:
+            self.product_index.set(product_id, available=False)
+        return success
+
+    async def load_product_index(self) -> None:
+        """Carica (o ricarica) l'indice prezzi/disponibilità con una sola query"""
+        failures = _failures.get()
+        rows = await self.execute_query("SELECT id, price, available, name, category_id FROM products")
+        if _failures.get() == failures:
+            self.product_index.load(rows)
+
+    async def price_order_items(self, items: List[Dict]) -> Tuple[List[Dict], Decimal]:
+        """Valida gli item di un ordine e ne calcola i prezzi dal listino in memoria"""
+        if not self.product_index.fresh:
+            await self.load_product_index()
+        try:
+            return self.product_index.price_items(items)
+        except UnknownProduct:
+            if self.product_index.loaded_since(PRODUCT_INDEX_MIN_RELOAD):
+                raise
+        await self.load_product_index()
+        return self.product_index.price_items(items)
+
+    # ==================== ORDINI ====================
+
+    async def get_orders_page(self, status: str = None, limit: int = 100,
+                              before: Tuple[str, int] = None, after: Tuple[str, int] = None,
+                              date_from: str = None, date_to: str = None) -> List[Dict]:
+        """Ritorna una pagina di ordini con paginazione keyset su (created_at, id)"""
+        conditions, params, direction = orders_page_filters(status, before, after, date_from, date_to)
+        query = self._statement(('get_orders_page', direction, *conditions),
+                                lambda: orders_page_query(conditions, direction))
+        params.append(limit)
+        rows = await self.execute_query(query, tuple(params))
+        if direction == 'ASC':
+            rows.reverse()
+        return rows
+
+    async def get_orders_changed_since(self, since: Tuple[str, int],
+                                       limit: int = 100) -> Tuple[List[Dict], object]:
+        """Ritorna gli ordini modificati dopo la posizione (updated_at, id) e l'ora del database"""
+        updated_at, order_id = since
+        rows = await self.execute_query(ORDERS_CHANGED_QUERY, (updated_at, updated_at, order_id, limit))
+        db_now = rows[0]['db_now'] if rows else None
+        for row in rows:
+            del row['db_now']
+        return rows, db_now
+
+    async def get_order_by_id(self, order_id: int) -> Optional[Dict]:
+        """Ritorna un ordine per ID, cercandolo anche tra quelli archiviati"""
+        query = "SELECT * FROM orders WHERE id = %s"
+        result = await self.execute_query(query, (order_id,))
+        if not result:
+            archive_query = "SELECT * FROM orders_archive WHERE id = %s"
+            result = await self.execute_query(archive_query, (order_id,))
+        return result[0] if result else None
+
+    async def get_order_items(self, order_id: int) -> List[Dict]:
+        """Ritorna gli item di un ordine (dall'archivio se l'ordine è stato archiviato)"""
+        items = await self.execute_query(ORDER_ITEMS_QUERY.format(table='order_items'), (order_id,))
+        if not items:
+            items = await self.execute_query(ORDER_ITEMS_QUERY.format(table='order_items_archive'),
+                                             (order_id,))
+        return items
+
+    async def get_items_for_orders(self, order_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Ritorna gli item di più ordini con una sola query, raggruppati per order_id"""
+        items_by_order = {order_id: [] for order_id in order_ids}
+        if not items_by_order:
+            return items_by_order
+
+        ids = list(items_by_order)
+        chunk_size = 500
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            query = self._statement(('items_for_orders', len(chunk)),
+                                    lambda: items_for_orders_query(len(chunk)))
+            for item in await self.execute_query(query, tuple(chunk)):
+                items_by_order[item['order_id']].append(item)
+        return items_by_order
+
+    async def reserve_order_numbers(self, day: str, count: int) -> int:
+        """Riserva `count` numeri d'ordine consecutivi per `day` e ritorna il primo"""
+        insert_query = ("INSERT OR IGNORE" if self.use_sqlite else "INSERT IGNORE") + \
+            " INTO order_sequences (day, next_value) VALUES (%s, 1)"
+        update_query = "UPDATE order_sequences SET next_value = next_value + %s WHERE day = %s"
+        select_query = "SELECT next_value FROM order_sequences WHERE day = %s"
+        async with self._transaction('reserve_order_numbers') as cursor:
+            await cursor.execute(self._translate_query(insert_query), (day,))
+            await cursor.execute(self._translate_query(update_query), (count, day))
+            await cursor.execute(self._translate_query(select_query), (day,))
+            next_value = dict(await cursor.fetchone())['next_value']
+        return next_value - count
+
+    async def next_order_number(self) -> str:
+        """Ritorna un numero d'ordine univoco e breve (ORD-AAAAMMGG-NNNN), crescente nel giorno"""
+        day = datetime.now().strftime('%Y%m%d')
+        number = self.order_numbers.take(day)
+        while number is None:
+            start = await self.reserve_order_numbers(day, ORDER_NUMBER_BLOCK)
+            self.order_numbers.add(day, start, start + ORDER_NUMBER_BLOCK)
+            number = self.order_numbers.take(day)
+        return f"ORD-{day}-{number:04d}"
+
+    async def create_order(self, order_number: str, items: List[Dict], total_price: float) -> int:
+        """Crea un nuovo ordine con i suoi item in un'unica transazione (-1 se fallisce)"""
+        order_id = None
+        try:
+            async with self._transaction('create_order') as cursor:
+                order_id = await self._run_steps(
+                    cursor, create_order_steps(self, order_number, items, total_price))
+        except Exception as e:
+            self._record_failure()
+            print(f"✗ Errore creazione ordine: {e}")
+            if order_id is not None:
+                self.active_orders.remove(order_id)
+            return -1
+        order_created(self, total_price)
+        return order_id
+
+    async def update_order_status(self, order_id: int, status: str) -> Optional[bool]:
+        """Aggiorna lo stato di un ordine e sposta l'ordine tra i contatori della dashboard.
+
+        Ritorna None se l'ordine non è tra quelli vivi (inesistente o archiviato).
+        """
+        if status not in ORDER_STATUSES:
+            return False
+        try:
+            async with self._transaction('update_order_status') as cursor:
+                previous = await self._run_steps(cursor, update_order_status_steps(self, order_id, status))
+        except Exception as e:
+            self._record_failure()
+            print(f"✗ Errore aggiornamento: {e}")
+            await self._reload_active_order(order_id)
+            return False
+        if previous is None:
+            return None
+        order_status_changed(self, previous, status)
+        return True
+
+    async def _reload_active_order(self, order_id: int) -> None:
+        """Riallinea un ordine della vista al database dopo una transazione annullata"""
+        if not self.active_orders.loaded:
+            return
+        failures = _failures.get()
+        order = await self.get_order_by_id(order_id)
+        items = await self.get_order_items(order_id)
+        if _failures.get() != failures:
+            self.active_orders.invalidate()
+            print(f"⚠ Vista ordini attivi disattivata: ordine {order_id} non riletto")
+        elif order is None:
+            self.active_orders.remove(order_id)
+        else:
+            self.active_orders.put({**order, 'items': items})
+
+    async def get_order_stats(self) -> Dict:
+        """Ritorna i contatori della dashboard, ricostruendoli con una query se mancano"""
+        snapshot = self.order_stats.snapshot()
+        if snapshot is not None:
+            return snapshot
+        generation = self.order_stats.generation
+        failures = _failures.get()
+        rows = await self.execute_query(ORDER_STATS_QUERY)
+        if _failures.get() != failures or not rows:
+            raise RuntimeError("Statistiche ordini non disponibili")
+        state, ttl = OrderStats.build(rows)
+        self.order_stats.load(state, ttl, generation)
+        return self.order_stats.snapshot(state)
@@ -0,0 +1,490 @@
+"""
+Benchmark HTTP dell'API Flask su un database SQLite temporaneo
+
+Avvia `app.app` in un processo separato su un database SQLite nuovo, popolato con
+dati realistici, e riproduce un mix di traffico totem/staff (letture del menu,
+nuovi ordini, cambi di stato, liste ordini della dashboard). Per ogni rotta
+riporta richieste al secondo, latenze p50/p95/p99 e byte ricevuti, oltre al tempo
+CPU del server per richiesta (Linux); i risultati possono essere salvati in JSON e
+confrontati tra due esecuzioni. Usa solo la libreria standard e funziona offline.
+
+Esempi:
+    python benchmark.py run --concurrency 16 --duration 20 --output before.json
+    python benchmark.py run --output after.json
+    python benchmark.py compare before.json after.json
+    # serializzazione e compressione su una sola rotta, contro il comportamento precedente
+    python benchmark.py run --route 'GET /api/orders' --env JSON_PROVIDER=flask \
+        --env RESPONSE_COMPRESSION=0 --output plain.json
+    python benchmark.py run --route 'GET /api/orders' --accept-encoding 'br, gzip' --output br.json
+    python benchmark.py statements    # micro-benchmark della preparazione degli statement
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# (peso, nome rotta) del mix di traffico: i totem leggono soprattutto il menu,
+# lo staff aggiorna gli stati e ricarica la lista ordini
+TRAFFIC_MIX = [
+    (35, 'GET /api/products'),
+    (15, 'GET /api/categories'),
+    (10, 'GET /api/products/category/<id>'),
+    (10, 'POST /api/orders'),
+    (10, 'PUT /api/orders/<id>/status'),
+    (15, 'GET /api/orders'),
+    (5, 'GET /api/orders/<id>'),
+]
+
+STATUSES = ['pending', 'preparing', 'ready', 'delivered', 'cancelled']
+
+
+# ==================== DATI DI PROVA ====================
+
+def seed_database(path, categories, products, orders, seed):
+    """Crea lo schema e inserisce categorie, prodotti e ordini di esempio"""
+    os.environ['DB_HOST'] = ''
+    os.environ['SQLITE_PATH'] = path
+    from database_wrapper import DatabaseWrapper
+
+    db = DatabaseWrapper()
+    db.connect()
+    db.migrate()
+    db.disconnect()
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO categories (name, description, icon, order_position) VALUES (?, ?, ?, ?)",
+        [(f"Categoria {i}", f"Descrizione {i}", '🍔', i) for i in range(1, categories + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO products (name, description, price, category_id) VALUES (?, ?, ?, ?)",
+        [(f"Prodotto {i}", "Descrizione prodotto di prova", round(rng.uniform(1.5, 12.0), 2),
+          rng.randint(1, categories)) for i in range(1, products + 1)]
+    )
+    prices = dict(conn.execute("SELECT id, price FROM products"))
+
+    start = datetime.now() - timedelta(days=90)
+    order_rows = []
+    item_rows = []
+    for order_id in range(1, orders + 1):
+        created_at = start + timedelta(seconds=order_id * 90 * 86400 // max(orders, 1))
+        lines = [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 6))]
+        total = sum(prices[product_id] * quantity for product_id, quantity in lines)
+        timestamp = created_at.strftime('%Y-%m-%d %H:%M:%S')
+        order_rows.append((order_id, f"SEED-{order_id:08d}", round(total, 2),
+                           rng.choice(STATUSES), timestamp, timestamp))
+        item_rows.extend((order_id, product_id, quantity, prices[product_id])
+                         for product_id, quantity in lines)
+    conn.executemany(
+        "INSERT INTO orders (id, order_number, total_price, status, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", order_rows)
+    conn.executemany(
+        "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+        item_rows)
+    conn.commit()
+    conn.close()
+    return prices
+
+
+# ==================== SERVER ====================
+
+def serve(port):
+    """Avvia l'app (usato dal processo figlio del benchmark)
+
+    Con `--env SERVER_MODE=asgi` viene servita la modalità asincrona (asgi_app.py).
+    """
+    if os.getenv('SERVER_MODE', 'wsgi').lower() == 'asgi':
+        import asgi_app
+        asgi_app.run(host='127.0.0.1', port=port)
+        return
+
+    from werkzeug.serving import make_server
+    import app as flask_app
+
+    flask_app.bootstrap()
+    server = make_server('127.0.0.1', port, flask_app.app, threaded=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, extra_env):
+    port = free_port()
+    env = dict(os.environ, DB_HOST='', SQLITE_PATH=db_path, PYTHONUNBUFFERED='1')
+    env.update(extra_env)
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--port', str(port)],
+        cwd=os.path.dirname(db_path), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            status, _, _ = request(port, 'GET', '/api/ready')
+            if status == 200:
+                return process, port
+            time.sleep(0.1)
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Il server di benchmark non si è avviato")
+
+
+# ==================== CLIENT ====================
+
+def request(port, method, path, body=None, headers=None):
+    """Esegue una richiesta HTTP e ritorna (status, byte ricevuti, header)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        all_headers = {'Content-Type': 'application/json'} if payload else {}
+        all_headers.update(headers or {})
+        conn.request(method, path, body=payload, headers=all_headers)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, len(data), dict(response.getheaders())
+    finally:
+        conn.close()
+
+
+def build_request(route, rng, prices, categories, max_order_id):
+    """Costruisce metodo, path e corpo di una richiesta per la rotta indicata"""
+    if route == 'GET /api/products':
+        return 'GET', '/api/products', None
+    if route == 'GET /api/categories':
+        return 'GET', '/api/categories', None
+    if route == 'GET /api/products/category/<id>':
+        return 'GET', f"/api/products/category/{rng.randint(1, categories)}", None
+    if route == 'POST /api/orders':
+        items = []
+        for product_id in rng.sample(sorted(prices), rng.randint(1, 6)):
+            items.append({'product_id': product_id, 'quantity': rng.randint(1, 3),
+                          'price': prices[product_id]})
+        total = round(sum(i['price'] * i['quantity'] for i in items), 2)
+        return 'POST', '/api/orders', {'items': items, 'total_price': total}
+    if route == 'PUT /api/orders/<id>/status':
+        order_id = rng.randint(1, max_order_id)
+        return 'PUT', f"/api/orders/{order_id}/status", {'status': rng.choice(STATUSES[:4])}
+    if route == 'GET /api/orders':
+        return 'GET', '/api/orders', None
+    if route == 'GET /api/orders/<id>':
+        return 'GET', f"/api/orders/{rng.randint(1, max_order_id)}", None
+    raise ValueError(route)
+
+
+def server_cpu_seconds(pid):
+    """Tempo CPU (utente + sistema) consumato finora dal processo server, None se non disponibile"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # i campi dopo il nome del comando (tra parentesi): utime e stime sono il 12° e il 13°
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def run_load(port, args, prices, stop_at, warmup_until, samples, lock):
+    """Ciclo di un client: sceglie rotte secondo il mix e registra le latenze"""
+    mix = [(weight, route) for weight, route in TRAFFIC_MIX if not args.route or route in args.route]
+    weights = [weight for weight, _ in mix]
+    routes = [route for _, route in mix]
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else None
+
+    def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + worker_id)
+        local = []
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            route = rng.choices(routes, weights)[0]
+            method, path, body = build_request(route, rng, prices, args.categories, args.orders)
+            started = time.perf_counter()
+            try:
+                status, size, _ = request(port, method, path, body, headers)
+            except OSError:
+                status, size = 0, 0
+            elapsed = time.perf_counter() - started
+            if now >= warmup_until:
+                local.append((route, elapsed, status, size))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# ==================== RISULTATI ====================
+
+def percentile(sorted_values, pct):
+    """Percentile nearest-rank di una lista già ordinata"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    """Aggrega i campioni in statistiche per rotta e totali (latenze in ms)"""
+    by_route = {}
+    for route, elapsed, status, size in samples:
+        by_route.setdefault(route, []).append((elapsed, status, size))
+
+    def stats(entries):
+        latencies = sorted(e[0] * 1000 for e in entries)
+        errors = sum(1 for e in entries if e[1] == 0 or e[1] >= 500)
+        return {
+            'requests': len(entries),
+            'errors': errors,
+            'rps': round(len(entries) / duration, 2),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'avg_bytes': round(sum(e[2] for e in entries) / len(entries), 1) if entries else 0,
+        }
+
+    return {
+        'routes': {route: stats(entries) for route, entries in sorted(by_route.items())},
+        'total': stats([(e, s, b) for _, e, s, b in samples]),
+    }
+
+
+def print_summary(result):
+    header = (f"{'rotta':36} {'req':>7} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'byte':>9}")
+    print(header)
+    print('-' * len(header))
+    rows = list(result['routes'].items()) + [('TOTALE', result['total'])]
+    for route, s in rows:
+        print(f"{route:36} {s['requests']:>7} {s['errors']:>5} {s['rps']:>9.1f} "
+              f"{s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['avg_bytes']:>9.0f}")
+    cpu = result.get('server_cpu')
+    if cpu:
+        print(f"CPU server: {cpu['seconds']:.2f}s, {cpu['ms_per_request']:.3f} ms per richiesta")
+
+
+def compare(baseline_path, candidate_path):
+    """Stampa la variazione percentuale tra due file di risultati"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    def delta(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+
+    header = f"{'rotta':36} {'req/s':>18} {'p50':>18} {'p99':>18} {'byte':>20}"
+    print(header)
+    print('-' * len(header))
+    routes = sorted(set(baseline['routes']) & set(candidate['routes']))
+    pairs = [(r, baseline['routes'][r], candidate['routes'][r]) for r in routes]
+    pairs.append(('TOTALE', baseline['total'], candidate['total']))
+    for route, old, new in pairs:
+        print(f"{route:36} "
+              f"{old['rps']:>8.1f}→{new['rps']:<8.1f} {delta(old['rps'], new['rps']):>7} "
+              f"{old['p50_ms']:>7.2f}→{new['p50_ms']:<7.2f}{delta(old['p50_ms'], new['p50_ms']):>7} "
+              f"{old['p99_ms']:>7.2f}→{new['p99_ms']:<7.2f}{delta(old['p99_ms'], new['p99_ms']):>7} "
+              f"{old['avg_bytes']:>8.0f}→{new['avg_bytes']:<8.0f}"
+              f"{delta(old['avg_bytes'], new['avg_bytes']):>7}")
+    old_cpu, new_cpu = baseline.get('server_cpu'), candidate.get('server_cpu')
+    if old_cpu and new_cpu:
+        print(f"CPU server per richiesta: {old_cpu['ms_per_request']:.3f}→"
+              f"{new_cpu['ms_per_request']:.3f} ms "
+              f"{delta(old_cpu['ms_per_request'], new_cpu['ms_per_request'])}")
+
+
+def micro_statements(args):
+    """Confronta il costo per chiamata della preparazione degli statement SQL.
+
+    Per ogni caso misura la versione senza cache (traduzione con str.replace e
+    f-string costruita a ogni chiamata) e quella con il registro degli statement.
+    """
+    import timeit
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        db_path = os.path.join(workdir, 'bench.db')
+        seed_database(db_path, 6, 60, 100, args.seed)
+        from database_wrapper import DatabaseWrapper
+        db = DatabaseWrapper()
+        db.connect()
+
+        read_query = """
+        SELECT p.*, c.name as category_name, c.icon
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.id = %s
+        """
+        updates = ["name = %s", "description = %s", "price = %s"]
+
+        def legacy_translate():
+            return read_query.replace('%s', '?')
+
+        def cached_translate():
+            return db._translate_query(read_query)
+
+        def legacy_update():
+            return f"UPDATE products SET {', '.join(updates)} WHERE id = %s".replace('%s', '?')
+
+        def cached_update():
+            return db._translate_query(db._statement(
+                ('update_product', *updates),
+                lambda: f"UPDATE products SET {', '.join(updates)} WHERE id = %s"))
+
+        class NoCache(dict):
+            def __setitem__(self, key, value):
+                pass
+
+        translated = db._translated
+
+        def legacy_read():
+            # stessa chiamata, ma la traduzione viene rifatta ogni volta come prima del registro
+            db._translated = NoCache()
+            try:
+                return db.execute_query(read_query, (1,), operation='bench')
+            finally:
+                db._translated = translated
+
+        def cached_read():
+            return db.execute_query(read_query, (1,), operation='bench')
+
+        cases = [
+            ('traduzione placeholder', legacy_translate, cached_translate),
+            ('UPDATE dinamico', legacy_update, cached_update),
+            ('lettura prodotto per id', legacy_read, cached_read),
+        ]
+        print(f"{'caso':28} {'senza cache':>14} {'con registro':>14} {'guadagno':>9}")
+        print('-' * 68)
+        for name, legacy, cached in cases:
+            number = args.number
+            legacy_time = min(timeit.repeat(legacy, number=number, repeat=5)) / number
+            cached_time = min(timeit.repeat(cached, number=number, repeat=5)) / number
+            print(f"{name:28} {legacy_time * 1e9:>11.0f} ns {cached_time * 1e9:>11.0f} ns "
+                  f"{legacy_time / cached_time:>8.2f}x")
+        db.disconnect()
+
+
+def run(args):
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    unknown = set(args.route) - {route for _, route in TRAFFIC_MIX}
+    if unknown:
+        raise SystemExit(f"✗ Rotte non presenti nel mix: {', '.join(sorted(unknown))}")
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        db_path = os.path.join(workdir, 'bench.db')
+        print(f"→ Popolo il database ({args.products} prodotti, {args.orders} ordini)...")
+        prices = seed_database(db_path, args.categories, args.products, args.orders, args.seed)
+
+        process, port = start_server(db_path, extra_env)
+        try:
+            print(f"→ {args.concurrency} client per {args.duration}s "
+                  f"(+{args.warmup}s di riscaldamento)")
+            samples = []
+            start = time.monotonic()
+            warmup_until = start + args.warmup
+            stop_at = warmup_until + args.duration
+            # CPU del server misurata solo nella finestra di misura (dopo il riscaldamento)
+            cpu_at_warmup = []
+            cpu_timer = threading.Timer(args.warmup,
+                                        lambda: cpu_at_warmup.append(server_cpu_seconds(process.pid)))
+            cpu_timer.start()
+            run_load(port, args, prices, stop_at, warmup_until, samples, threading.Lock())
+            cpu_timer.join()
+            cpu_at_stop = server_cpu_seconds(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+
+    result = summarize(samples, args.duration)
+    if cpu_at_warmup and cpu_at_warmup[0] is not None and cpu_at_stop is not None:
+        cpu_seconds = cpu_at_stop - cpu_at_warmup[0]
+        result['server_cpu'] = {
+            'seconds': round(cpu_seconds, 3),
+            'ms_per_request': round(cpu_seconds * 1000 / max(result['total']['requests'], 1), 4),
+        }
+    result['meta'] = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'categories': args.categories,
+        'products': args.products,
+        'orders': args.orders,
+        'env': extra_env,
+        'routes': args.route,
+        'accept_encoding': args.accept_encoding,
+    }
+    print_summary(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"✓ Risultati salvati in {args.output}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark HTTP dell'API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="esegue il benchmark")
+    run_parser.add_argument('--concurrency', type=int, default=8, help="client in parallelo")
+    run_parser.add_argument('--duration', type=float, default=10, help="secondi di misura")
+    run_parser.add_argument('--warmup', type=float, default=2, help="secondi di riscaldamento")
+    run_parser.add_argument('--categories', type=int, default=6)
+    run_parser.add_argument('--products', type=int, default=60)
+    run_parser.add_argument('--orders', type=int, default=5000, help="ordini già presenti")
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--env', action='append', default=[], metavar='CHIAVE=VALORE',
+                            help="variabile d'ambiente aggiuntiva per il server")
+    run_parser.add_argument('--route', action='append', default=[], metavar='ROTTA',
+                            help="limita il traffico a questa rotta del mix (ripetibile)")
+    run_parser.add_argument('--accept-encoding', default='',
+                            help="header Accept-Encoding inviato dai client (es. 'br, gzip')")
+    run_parser.add_argument('--output', help="file JSON in cui salvare i risultati")
+
+    compare_parser = commands.add_parser('compare', help="confronta due risultati")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    statements_parser = commands.add_parser('statements',
+                                            help="micro-benchmark del registro degli statement")
+    statements_parser.add_argument('--number', type=int, default=20000,
+                                   help="chiamate per misura")
+    statements_parser.add_argument('--seed', type=int, default=42)
+
+    serve_parser = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--port', type=int, required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args.baseline, args.candidate)
+    elif args.command == 'statements':
+        micro_statements(args)
+    else:
+        serve(args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
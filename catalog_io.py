@@ -0,0 +1,206 @@
+"""
+Catalog I/O - Import ed export del menu in CSV e NDJSON
+
+Ogni riga descrive un prodotto con la sua categoria, indicata per nome; una riga
+senza `name` descrive solo la categoria (così l'export conserva anche le categorie
+vuote). L'import legge il corpo della richiesta riga per riga e valida ogni riga:
+le righe valide vengono scritte tutte insieme da `DatabaseWrapper.import_catalog`,
+quelle non valide vengono riportate con il numero di riga e il motivo.
+
+Una colonna assente o vuota lascia invariato il campo di un prodotto o di una
+categoria già esistenti (per quelli nuovi vale il default); `price` è obbligatorio
+per ogni prodotto.
+"""
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, Optional
+import csv
+import io
+import json
+
+# colonne del CSV e chiavi degli oggetti NDJSON, nell'ordine dell'export
+CATALOG_FIELDS = ('category', 'category_description', 'category_icon', 'category_position',
+                  'name', 'description', 'price', 'image_url', 'available')
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# errori riportati nella risposta dell'import (il conteggio comprende tutti gli altri)
+MAX_REPORTED_ERRORS = 100
+
+TRUE_VALUES = {'1', 'true', 'yes', 'si', 'sì'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+# lunghezze massime delle colonne MySQL
+MAX_LENGTHS = {'category': 100, 'category_icon': 50, 'name': 100, 'image_url': 255}
+
+
+def detect_format(requested: Optional[str], content_type: Optional[str]) -> str:
+    """Formato da `?format=` o, in mancanza, dal Content-Type; ValueError se non supportato"""
+    if requested:
+        fmt = requested.lower()
+    else:
+        mimetype = (content_type or '').split(';')[0].strip().lower()
+        fmt = next((name for name, value in FORMATS.items() if value == mimetype), None)
+        if fmt is None and mimetype in ('application/ndjson', 'application/jsonl'):
+            fmt = 'ndjson'
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato non supportato: usare {' o '.join(FORMATS)}")
+    return fmt
+
+
+class CatalogImport:
+    """Righe valide di un import, unite per categoria e per prodotto, ed errori per riga.
+
+    Se la stessa categoria o lo stesso prodotto compaiono più volte, i campi delle
+    righe successive sostituiscono quelli delle precedenti.
+    """
+
+    def __init__(self):
+        self.categories = {}  # nome -> {'description', 'icon', 'order_position'}
+        self.products = {}  # (categoria, nome) -> campi del prodotto
+        self.rows = 0
+        self.errors = []
+        self.error_count = 0
+
+    def add(self, line: int, record) -> None:
+        self.rows += 1
+        try:
+            category, product = _clean(record)
+        except ValueError as e:
+            self.error(line, str(e))
+            return
+        current = self.categories.setdefault(category['name'], {})
+        current.update((key, value) for key, value in category.items()
+                       if key != 'name' and value is not None)
+        if product:
+            key = (category['name'], product['name'])
+            current = self.products.setdefault(key, {})
+            current.update((k, v) for k, v in product.items() if v is not None or k not in current)
+
+    def error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+
+def parse_catalog(stream, fmt: str) -> CatalogImport:
+    """Legge il corpo (file binario) riga per riga senza caricarlo tutto in memoria"""
+    result = CatalogImport()
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            missing = {'category', 'name'} - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"Intestazione CSV senza le colonne: {', '.join(sorted(missing))}")
+            for record in reader:
+                if None in record:
+                    result.rows += 1
+                    result.error(reader.line_num, "Più valori delle colonne dell'intestazione")
+                    continue
+                result.add(reader.line_num, record)
+        else:
+            for line, raw in enumerate(text, start=1):
+                if not raw.strip():
+                    continue
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    result.rows += 1
+                    result.error(line, "JSON non valido")
+                    continue
+                result.add(line, record)
+    except UnicodeDecodeError:
+        raise ValueError("Il file deve essere in UTF-8")
+    finally:
+        text.detach()
+    return result
+
+
+def _text(record: Dict, key: str) -> Optional[str]:
+    value = record.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    limit = MAX_LENGTHS.get(key)
+    if limit and len(value) > limit:
+        raise ValueError(f"{key} supera i {limit} caratteri")
+    return value
+
+
+def _clean(record) -> tuple:
+    """Valida una riga; ritorna (categoria, prodotto o None) o solleva ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError("Ogni riga deve essere un oggetto JSON")
+    category_name = _text(record, 'category')
+    if not category_name:
+        raise ValueError("category obbligatorio")
+
+    position = _text(record, 'category_position')
+    if position is not None:
+        try:
+            position = int(position)
+        except ValueError:
+            raise ValueError("category_position deve essere un intero")
+    category = {
+        'name': category_name,
+        'description': _text(record, 'category_description'),
+        'icon': _text(record, 'category_icon'),
+        'order_position': position,
+    }
+
+    name = _text(record, 'name')
+    if not name:
+        return category, None
+
+    price = _text(record, 'price')
+    if price is None:
+        raise ValueError("price obbligatorio per un prodotto")
+    try:
+        price = Decimal(price)
+    except InvalidOperation:
+        raise ValueError(f"Prezzo non valido: {price}")
+    if not price.is_finite() or price < 0:
+        raise ValueError(f"Prezzo non valido: {price}")
+
+    available = record.get('available')
+    if isinstance(available, str):
+        flag = available.strip().lower()
+        if flag in TRUE_VALUES:
+            available = True
+        elif flag in FALSE_VALUES:
+            available = False
+        elif not flag:
+            available = None
+        else:
+            raise ValueError(f"available non valido: {available}")
+    elif available is not None and not isinstance(available, bool):
+        raise ValueError(f"available non valido: {available}")
+
+    product = {
+        'name': name,
+        'description': _text(record, 'description'),
+        'price': float(price),
+        'image_url': _text(record, 'image_url'),
+        'available': available,
+    }
+    return category, product
+
+
+def export_lines(rows: Iterable[Dict], fmt: str, dumps: Callable[[Dict], str]) -> Iterator[str]:
+    """Serializza le righe di `DatabaseWrapper.export_catalog` una alla volta"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CATALOG_FIELDS)
+        for row in rows:
+            writer.writerow(['' if row.get(field) is None else row[field] for field in CATALOG_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+    for row in rows:
+        yield dumps({field: row.get(field) for field in CATALOG_FIELDS}) + '\n'
@@ -2,12 +2,965 @@
 DatabaseWrapper - Gestisce tutte le operazioni con il database MySQL
 """
 import pymysql
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Callable, Iterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+import hashlib
+import heapq
 import os
+import sys
+import threading
+import time
 from dotenv import load_dotenv
+from metrics import registry as metrics_registry
+from product_images import with_image_variants
 
 load_dotenv()
 
+# Migrazioni dello schema, applicate in ordine di versione da `DatabaseWrapper.migrate()`.
+# Ogni voce è (versione, descrizione, {dialetto: [statement, ...]}); le versioni già
+# applicate sono registrate nella tabella schema_migrations. Non modificare una
+# migrazione già rilasciata: aggiungerne una nuova in fondo.
+MIGRATIONS = [
+    (1, 'Indici per filtri per stato, liste ordini, item e menu', {
+        'mysql': [
+            "CREATE INDEX idx_orders_status_created ON orders (status, created_at)",
+            "CREATE INDEX idx_orders_created ON orders (created_at)",
+            "CREATE INDEX idx_order_items_order ON order_items (order_id)",
+            "CREATE INDEX idx_products_category_available ON products (category_id, available)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)",
+            "CREATE INDEX IF NOT EXISTS idx_products_category_available ON products (category_id, available)",
+        ],
+    }),
+    (2, 'updated_at sempre aggiornato e indicizzato per le modifiche agli ordini', {
+        # MySQL aggiorna già la colonna con ON UPDATE CURRENT_TIMESTAMP
+        'mysql': [
+            "CREATE INDEX idx_orders_updated ON orders (updated_at, id)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_orders_updated ON orders (updated_at, id)",
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_orders_updated_at
+            AFTER UPDATE ON orders FOR EACH ROW
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE orders SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+            """,
+        ],
+    }),
+    (3, 'Chiavi esterne su products e order_items anche in SQLite', {
+        # MySQL le dichiara già alla creazione delle tabelle
+        'mysql': [],
+        # SQLite non permette di aggiungere vincoli: le tabelle vengono ricostruite
+        'sqlite': [
+            """
+            CREATE TABLE products_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                description TEXT,
+                price REAL NOT NULL,
+                category_id INTEGER NOT NULL REFERENCES categories(id),
+                image_url TEXT,
+                available BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            INSERT INTO products_new (id, name, description, price, category_id, image_url, available, created_at)
+            SELECT id, name, description, price, category_id, image_url, available, created_at FROM products
+            """,
+            "DROP TABLE products",
+            "ALTER TABLE products_new RENAME TO products",
+            "CREATE INDEX IF NOT EXISTS idx_products_category_available ON products (category_id, available)",
+            """
+            CREATE TABLE order_items_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                quantity INTEGER NOT NULL,
+                price REAL NOT NULL
+            )
+            """,
+            """
+            INSERT INTO order_items_new (id, order_id, product_id, quantity, price)
+            SELECT id, order_id, product_id, quantity, price FROM order_items
+            """,
+            "DROP TABLE order_items",
+            "ALTER TABLE order_items_new RENAME TO order_items",
+            "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)",
+        ],
+    }),
+]
+
+# payload del menu tenuti in cache (lista prodotti, categorie e una voce per categoria)
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', 256))
+
+# secondi dopo i quali l'indice prezzi viene ricaricato (vede le modifiche di altri processi)
+PRODUCT_INDEX_TTL = float(os.getenv('PRODUCT_INDEX_TTL', 30))
+# intervallo minimo tra due ricaricamenti causati da un prodotto sconosciuto
+PRODUCT_INDEX_MIN_RELOAD = 1.0
+
+# numero massimo di traduzioni SQL memorizzate (le query dell'app sono poche decine)
+STATEMENT_CACHE_SIZE = 1024
+# statement preparati che ogni connessione SQLite tiene in cache
+SQLITE_CACHED_STATEMENTS = 256
+
+# stati validi di un ordine, nell'ordine in cui li attraversa
+ORDER_STATUSES = ['pending', 'preparing', 'ready', 'delivered', 'cancelled']
+# stati degli ordini ancora in lavorazione (quelli che interessano alla cucina)
+ACTIVE_ORDER_STATUSES = ('pending', 'preparing', 'ready')
+
+# numeri d'ordine riservati a ogni accesso alla tabella order_sequences
+ORDER_NUMBER_BLOCK = int(os.getenv('ORDER_NUMBER_BLOCK', 20))
+
+# riga di order_sequences con il contatore degli id riservati per la coda degli ordini
+ORDER_ID_SEQUENCE = 'order_id'
+
+# ricostruzione delle statistiche ordini: conteggi per stato e ordini/incasso della
+# giornata secondo l'orologio del database (la riga derivata c'è anche senza ordini);
+# gli ordini archiviati restano nei conteggi per stato
+ORDER_STATS_QUERY = """
+SELECT d.today, d.db_now, o.status,
+       COUNT(o.id) AS orders,
+       COALESCE(SUM(CASE WHEN o.created_at >= d.today THEN 1 ELSE 0 END), 0) AS today_orders,
+       COALESCE(SUM(CASE WHEN o.created_at >= d.today THEN o.total_price ELSE 0 END), 0) AS today_revenue
+FROM (SELECT CURRENT_DATE AS today, CURRENT_TIMESTAMP AS db_now) d
+LEFT JOIN (
+    SELECT id, status, created_at, total_price FROM orders
+    UNION ALL
+    SELECT id, status, created_at, total_price FROM orders_archive
+) o ON 1 = 1
+GROUP BY d.today, d.db_now, o.status
+"""
+
+# secondi dopo i quali i contatori della dashboard vengono riletti dal database, per
+# vedere anche gli ordini scritti da altri processi (0: una query a ogni lettura)
+ORDER_STATS_TTL = float(os.getenv('ORDER_STATS_TTL', 5))
+
+# stati finali: gli ordini in questi stati possono essere spostati nell'archivio
+CLOSED_ORDER_STATUSES = ('delivered', 'cancelled')
+# giorni dopo i quali un ordine chiuso viene archiviato (minimo 1: le statistiche di
+# oggi leggono solo la tabella orders)
+ORDER_ARCHIVE_DAYS = int(os.getenv('ORDER_ARCHIVE_DAYS', 7))
+# ordini spostati per transazione (SQLite accetta al massimo 999 placeholder)
+ORDER_ARCHIVE_BATCH = 500
+
+# colonne copiate nelle tabelle di archivio
+ORDER_COLUMNS = 'id, order_number, total_price, status, created_at, updated_at'
+ORDER_ITEM_COLUMNS = 'id, order_id, product_id, quantity, price'
+
+# giorni di storico ricalcolati per transazione da backfill_sales_rollups
+SALES_BACKFILL_WINDOW = 31
+# aggregazioni di get_sales: dimensione letta da sales_rollups, colonne, join, raggruppamento, ordinamento
+SALES_GROUPS = {
+    'product': ('product', "r.key_id AS product_id, p.name", "LEFT JOIN products p ON p.id = r.key_id",
+                "r.key_id, p.name", "revenue DESC"),
+    'category': ('category', "r.key_id AS category_id, c.name", "LEFT JOIN categories c ON c.id = r.key_id",
+                 "r.key_id, c.name", "revenue DESC"),
+    'hour': ('hour', "r.hour", "", "r.hour", "r.hour"),
+    'day': ('hour', "DATE(r.hour) AS day", "", "DATE(r.hour)", "day"),
+}
+
+
+def sales_rollup_query(sqlite: bool, orders_table: str, items_table: str, where: str) -> str:
+    """Statement che somma in sales_rollups le vendite degli ordini scelti da `where`.
+
+    Un'unica INSERT ... SELECT aggrega nel database, con GROUP BY, per ora, per
+    categoria e per prodotto; le righe già presenti vengono incrementate. Ogni SELECT
+    prende come parametri il segno (1 aggiunge, -1 toglie, tre volte) e poi quelli di
+    `where`. La categoria è quella attuale del prodotto.
+    """
+    if sqlite:
+        hour = "strftime('%Y-%m-%d %H:00:00', o.created_at)"
+        conflict = """ON CONFLICT (dimension, hour, key_id) DO UPDATE SET
+            orders = orders + excluded.orders, quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue"""
+    else:
+        hour = "DATE_FORMAT(o.created_at, '%%Y-%%m-%%d %%H:00:00')"
+        conflict = """ON DUPLICATE KEY UPDATE
+            orders = orders + d_orders, quantity = quantity + d_quantity, revenue = revenue + d_revenue"""
+    selects = [f"""
+        SELECT {hour} AS hour, '{dimension}' AS dimension, {key} AS key_id,
+               %s * COUNT(DISTINCT o.id) AS d_orders, %s * SUM(oi.quantity) AS d_quantity,
+               %s * SUM(oi.quantity * oi.price) AS d_revenue
+        FROM {orders_table} o
+        JOIN {items_table} oi ON oi.order_id = o.id
+        JOIN products p ON p.id = oi.product_id
+        WHERE {where}
+        GROUP BY {hour}{group}"""
+        for dimension, key, group in (('hour', '0', ''),
+                                      ('category', 'p.category_id', ', p.category_id'),
+                                      ('product', 'oi.product_id', ', oi.product_id'))]
+    # WHERE 1 = 1: in SQLite evita che ON CONFLICT venga letto come parte della join
+    return f"""
+    INSERT INTO sales_rollups (hour, dimension, key_id, orders, quantity, revenue)
+    SELECT hour, dimension, key_id, d_orders, d_quantity, d_revenue
+    FROM ({' UNION ALL '.join(selects)}) d
+    WHERE 1 = 1
+    {conflict}
+    """
+
+# ordini per pagina dell'export su SQLite senza WAL (vedi stream_orders)
+ORDER_EXPORT_PAGE = 500
+# secondi che MySQL aspetta un client lento durante un export prima di chiudere la connessione
+ORDER_EXPORT_WRITE_TIMEOUT = 600
+# export in corso contemporaneamente (ognuno apre due connessioni proprie, fuori dal pool)
+ORDER_EXPORT_MAX_CONCURRENT = int(os.getenv('ORDER_EXPORT_MAX_CONCURRENT', 2))
+
+# impostazioni delle connessioni SQLite in modalità production (SQLITE_MODE=production):
+# WAL fa sì che le letture non vengano bloccate dai commit, synchronous=NORMAL in WAL
+# resta sicuro in caso di crash dell'applicazione e fa un fsync solo ai checkpoint
+SQLITE_PRODUCTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16384",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# errori MySQL che indicano un passo già applicato (tabella/colonna/indice esistente):
+# permettono di riprendere una migrazione interrotta a metà, visto che in MySQL il DDL
+# non è transazionale
+MYSQL_ALREADY_APPLIED_ERRORS = {1050, 1060, 1061}
+
+
+class PoolTimeout(Exception):
+    """Nessuna connessione libera nel pool entro il timeout richiesto"""
+
+
+class ConnectionPool:
+    """Pool di connessioni limitato e thread-safe.
+
+    Ogni connessione viene usata da un solo thread alla volta: chi ne ha bisogno la
+    prende con `acquire()` e la restituisce con `release()`. Le connessioni rimaste
+    inattive più di `max_idle` secondi vengono chiuse, quelle riutilizzate vengono
+    validate con `ping` (pre-ping) prima di essere consegnate.
+    """
+
+    def __init__(self, factory: Callable, ping: Callable = None, size: int = 10,
+                 max_idle: float = 300, timeout: float = 30):
+        self._factory = factory
+        self._ping = ping
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+
+        self._idle = deque()  # coppie (connessione, istante di rilascio)
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._closed = False
+
+    def acquire(self):
+        """Prende una connessione dal pool, creandola se c'è ancora spazio"""
+        deadline = time.monotonic() + self.timeout
+        conn = None
+        released_at = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Pool di connessioni chiuso")
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"Nessuna connessione libera dopo {self.timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+
+        # validazione e creazione avvengono fuori dal lock per non bloccare gli altri thread
+        try:
+            if conn is not None and time.monotonic() - released_at > self.max_idle:
+                self._close(conn)
+                conn = None
+            if conn is not None and self._ping and not self._is_alive(conn):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._factory()
+                with self._cond:
+                    self._created += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard: bool = False) -> None:
+        """Restituisce una connessione al pool (o la chiude se `discard` è True)"""
+        expired = []
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                expired.append(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            # le connessioni più vecchie stanno in fondo alla coda: le scartiamo da lì
+            limit = time.monotonic() - self.max_idle
+            while self._idle and self._idle[0][1] < limit:
+                expired.append(self._idle.popleft()[0])
+            self._cond.notify()
+        for old in expired:
+            self._close(old)
+
+    def close(self) -> None:
+        """Chiude le connessioni inattive; quelle in uso verranno chiuse al rilascio"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict:
+        """Statistiche del pool (connessioni in uso, inattive, thread in attesa, create)"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'created': self._created,
+            }
+
+    def _is_alive(self, conn) -> bool:
+        try:
+            self._ping(conn)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class CatalogCache:
+    """Cache in memoria dei payload del menu già serializzati in JSON.
+
+    Ogni voce contiene il corpo della risposta (bytes) e il suo ETag. Le scritture su
+    categorie e prodotti chiamano `invalidate()`; il contatore di generazione evita di
+    salvare un payload costruito prima di un'invalidazione avvenuta nel frattempo.
+    Le chiavi dipendono anche dall'URL (id di categoria), quindi il numero di voci è
+    limitato: oltre `max_entries` vengono scartate le meno usate.
+    """
+
+    def __init__(self, max_entries: int = CATALOG_CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body: bytes, generation: int) -> Tuple[bytes, str]:
+        entry = (body, hashlib.sha256(body).hexdigest()[:32])
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+class OrderConflict(Exception):
+    """Id di un ordine in coda già usato nel database da un ordine diverso"""
+
+
+class UnknownProduct(ValueError):
+    """Prodotto di un ordine assente dall'indice in memoria"""
+
+
+def _integer(value) -> int:
+    """Intero da un valore JSON (int, float senza decimali o stringa di cifre)"""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    raise ValueError(value)
+
+
+class ProductIndex:
+    """Indice in memoria dei prodotti (id -> (prezzo, disponibile, nome, categoria)).
+
+    Viene caricato con una sola query al primo utilizzo e tenuto aggiornato dai
+    metodi che modificano i prodotti, così il prezzo di un ordine (e il nome dei
+    suoi item) si ricava senza query aggiuntive. Le modifiche fatte da altri
+    processi (o direttamente nel database) non passano di qui: l'indice viene
+    quindi ricaricato dopo `PRODUCT_INDEX_TTL` secondi e quando un ordine contiene
+    un prodotto sconosciuto.
+    """
+
+    def __init__(self, ttl: float = PRODUCT_INDEX_TTL):
+        self._products = None
+        self._loaded_at = 0.0
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._products is not None
+
+    @property
+    def fresh(self) -> bool:
+        """True se l'indice è caricato e non ancora scaduto"""
+        return self._products is not None and time.monotonic() - self._loaded_at < self._ttl
+
+    def loaded_since(self, seconds: float) -> bool:
+        """True se l'ultimo caricamento risale a meno di `seconds` secondi fa"""
+        return self._products is not None and time.monotonic() - self._loaded_at < seconds
+
+    def load(self, rows: List[Dict]) -> None:
+        products = {row['id']: (Decimal(str(row['price'])), bool(row['available']),
+                                row.get('name'), row.get('category_id')) for row in rows}
+        with self._lock:
+            self._products = products
+            self._loaded_at = time.monotonic()
+
+    def get(self, product_id: int) -> Optional[Tuple[Decimal, bool, str, int]]:
+        products = self._products
+        return products.get(product_id) if products is not None else None
+
+    def set(self, product_id: int, price=None, available: bool = None,
+            name: str = None, category_id: int = None) -> None:
+        with self._lock:
+            if self._products is None:
+                return
+            current = self._products.get(product_id)
+            if current is None:
+                if price is None:
+                    # prodotto non ancora indicizzato: senza prezzo non c'è nulla da aggiungere
+                    return
+                current = (None, True, None, None)
+            self._products[product_id] = (
+                Decimal(str(price)) if price is not None else current[0],
+                available if available is not None else current[1],
+                name if name is not None else current[2],
+                category_id if category_id is not None else current[3]
+            )
+
+    def price_items(self, items: List[Dict]) -> Tuple[List[Dict], Decimal]:
+        """Ritorna gli item (con prezzo di listino e nome) e il totale (ValueError se non validi)"""
+        if not isinstance(items, list) or not items:
+            raise ValueError("L'ordine deve contenere almeno un prodotto")
+        priced = []
+        total = Decimal('0')
+        for item in items:
+            try:
+                product_id = _integer(item['product_id'])
+                quantity = _integer(item['quantity'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Ogni prodotto richiede product_id e quantity interi")
+            if quantity < 1:
+                raise ValueError(f"Quantità non valida per il prodotto {product_id}")
+            entry = self.get(product_id)
+            if entry is None:
+                raise UnknownProduct(f"Prodotto {product_id} inesistente")
+            price, available, name, category_id = entry
+            if not available:
+                raise ValueError(f"Prodotto {product_id} non disponibile")
+            priced.append({'product_id': product_id, 'quantity': quantity, 'price': price,
+                           'name': name, 'category_id': category_id})
+            total += price * quantity
+        return priced, total
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._products = None
+
+
+class OrderStats:
+    """Contatori in memoria per la dashboard: ordini per stato, ordini e incasso di oggi.
+
+    Vengono ricostruiti con una sola query aggregata (`ORDER_STATS_QUERY`) e poi
+    aggiornati da `create_order` e `update_order_status`, così leggerli non costa
+    nessuna query. Le scritture di altri processi (altri worker Gunicorn, modifiche
+    dirette al database) non passano di qui: per questo i contatori scadono dopo
+    `ORDER_STATS_TTL` secondi, e comunque a mezzanotte secondo l'orologio del
+    database, e vengono ricostruiti. Come in `CatalogCache`, il
+    contatore di generazione scarta una ricostruzione a cui è sfuggita una scrittura
+    avvenuta nel frattempo. L'incasso esclude gli ordini annullati.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._expires = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @staticmethod
+    def build(rows: List[Dict]) -> Tuple[Dict, float]:
+        """Converte il risultato della query nello stato dei contatori e nella sua durata"""
+        state = {
+            'date': str(rows[0]['today']),
+            'orders': {status: 0 for status in ORDER_STATUSES},
+            'today_orders': {status: 0 for status in ORDER_STATUSES},
+            'today_revenue': {status: Decimal('0') for status in ORDER_STATUSES},
+        }
+        for row in rows:
+            status = row['status']
+            if status is None:
+                continue
+            state['orders'][status] = row['orders']
+            state['today_orders'][status] = int(row['today_orders'])
+            state['today_revenue'][status] = Decimal(str(row['today_revenue']))
+        db_now = datetime.fromisoformat(str(rows[0]['db_now']))
+        midnight = datetime.combine(db_now.date() + timedelta(days=1), datetime.min.time())
+        return state, min(ORDER_STATS_TTL, (midnight - db_now).total_seconds())
+
+    def load(self, state: Dict, ttl: float, generation: int) -> None:
+        with self._lock:
+            if generation == self._generation:
+                self._state = state
+                self._expires = time.monotonic() + ttl
+
+    def snapshot(self, state: Dict = None) -> Optional[Dict]:
+        """Ritorna i contatori correnti (None se vanno ricostruiti)"""
+        with self._lock:
+            if state is None:
+                if self._state is None or time.monotonic() >= self._expires:
+                    return None
+                state = self._state
+            return {
+                'date': state['date'],
+                **{status: state['orders'][status] for status in ORDER_STATUSES},
+                'today_orders': sum(state['today_orders'].values()),
+                'today_revenue': float(sum(value for status, value in state['today_revenue'].items()
+                                           if status != 'cancelled')),
+            }
+
+    def order_created(self, total_price) -> None:
+        with self._lock:
+            self._generation += 1
+            if self._state is None:
+                return
+            self._state['orders']['pending'] += 1
+            self._state['today_orders']['pending'] += 1
+            self._state['today_revenue']['pending'] += Decimal(str(total_price))
+
+    def status_changed(self, old_status: str, new_status: str, total_price, created_at) -> None:
+        with self._lock:
+            self._generation += 1
+            if self._state is None or old_status == new_status:
+                return
+            self._state['orders'][old_status] -= 1
+            self._state['orders'][new_status] += 1
+            if str(created_at)[:10] >= self._state['date']:
+                price = Decimal(str(total_price))
+                self._state['today_orders'][old_status] -= 1
+                self._state['today_orders'][new_status] += 1
+                self._state['today_revenue'][old_status] -= price
+                self._state['today_revenue'][new_status] += price
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._state = None
+
+
+def timestamp_key(value) -> str:
+    """Timestamp del database (datetime MySQL o stringa SQLite) come stringa confrontabile"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+class ActiveOrders:
+    """Vista materializzata in memoria degli ordini attivi con i loro item.
+
+    Contiene tutti gli ordini in `ACTIVE_ORDER_STATUSES`, indicizzati per id e per
+    stato, così le schermate della cucina (liste per stato e dettaglio) non
+    interrogano il database. Viene caricata una volta all'avvio e aggiornata dai
+    metodi che scrivono gli ordini dentro la loro transazione, prima del commit:
+    il lock sulla riga (o il lock di scrittura di SQLite) è ancora preso, quindi due
+    modifiche concorrenti allo stesso ordine arrivano alla vista nello stesso ordine
+    in cui arrivano al database. Finché non è caricata tutte le operazioni sono
+    no-op e le letture vanno al database. Come per OrderStats, il contatore di
+    generazione evita di installare un caricamento superato da una scrittura
+    avvenuta nel frattempo; `touch()` dopo il commit scarta anche un caricamento
+    che ha letto il database tra la modifica alla vista e il commit.
+    """
+
+    def __init__(self):
+        self._orders = None  # id -> ordine con item
+        self._by_status = {}  # stato -> id degli ordini
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._orders is not None
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def load(self, orders: List[Dict], generation: int) -> bool:
+        by_id = {order['id']: order for order in orders}
+        by_status = {status: set() for status in ACTIVE_ORDER_STATUSES}
+        for order in orders:
+            by_status[order['status']].add(order['id'])
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._orders = by_id
+            self._by_status = by_status
+        return True
+
+    def get(self, order_id: int) -> Optional[Dict]:
+        with self._lock:
+            order = self._orders.get(order_id) if self._orders is not None else None
+            return _copy_order(order) if order else None
+
+    def put(self, order: Dict) -> None:
+        """Inserisce o sostituisce un ordine letto dal database (con i suoi item)"""
+        with self._lock:
+            self._generation += 1
+            if self._orders is None:
+                return
+            self._discard(order['id'])
+            if order['status'] in ACTIVE_ORDER_STATUSES:
+                self._orders[order['id']] = order
+                self._by_status[order['status']].add(order['id'])
+
+    def update_status(self, order_id: int, status: str, updated_at) -> bool:
+        """Aggiorna lo stato (o rimuove l'ordine se non è più attivo); False se l'ordine manca"""
+        with self._lock:
+            self._generation += 1
+            if self._orders is None:
+                return True
+            order = self._discard(order_id)
+            if status not in ACTIVE_ORDER_STATUSES:
+                return True
+            if order is None:
+                return False
+            self._orders[order_id] = {**order, 'status': status, 'updated_at': updated_at}
+            self._by_status[status].add(order_id)
+            return True
+
+    def remove(self, order_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            if self._orders is not None:
+                self._discard(order_id)
+
+    def touch(self) -> None:
+        """Da chiamare dopo il commit di una scrittura già riportata nella vista"""
+        with self._lock:
+            self._generation += 1
+
+    def invalidate(self) -> None:
+        """Scarta la vista: le letture tornano al database finché non viene ricaricata"""
+        with self._lock:
+            self._generation += 1
+            self._orders = None
+            self._by_status = {}
+
+    def _discard(self, order_id: int) -> Optional[Dict]:
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._by_status[order['status']].discard(order_id)
+        return order
+
+    def page(self, status: str, limit: int, before: Tuple[str, int] = None, after: Tuple[str, int] = None,
+             date_from: str = None, date_to: str = None) -> Optional[List[Dict]]:
+        """Stessa pagina di `DatabaseWrapper.get_orders_page` per uno stato attivo (None se non caricata)"""
+        with self._lock:
+            if self._orders is None:
+                return None
+            orders = [self._orders[order_id] for order_id in self._by_status[status]]
+
+        def key(order):
+            return timestamp_key(order['created_at']), order['id']
+
+        if date_from:
+            orders = [order for order in orders if key(order)[0] >= date_from]
+        if date_to:
+            orders = [order for order in orders if key(order)[0] < date_to]
+        if before:
+            orders = [order for order in orders if key(order) < before]
+        if after:
+            orders = [order for order in orders if key(order) > after]
+        orders.sort(key=key, reverse=True)
+        # con `after` la pagina è quella più vicina al cursore, cioè in fondo
+        orders = orders[-limit:] if after else orders[:limit]
+        return [_copy_order(order) for order in orders]
+
+    def snapshot(self) -> Optional[Dict[int, Dict]]:
+        with self._lock:
+            if self._orders is None:
+                return None
+            return {order_id: _copy_order(order) for order_id, order in self._orders.items()}
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items()}
+
+
+def _sales_row(row: Dict) -> Dict:
+    """Riga di vendite con valori numerici normalizzati e scontrino medio"""
+    orders = int(row['orders'] or 0)
+    revenue = Decimal(str(row['revenue'] or 0)).quantize(Decimal('0.01'))
+    average = (revenue / orders).quantize(Decimal('0.01')) if orders else Decimal('0.00')
+    return {**row, 'orders': orders, 'quantity': int(row['quantity'] or 0),
+            'revenue': revenue, 'average_ticket': average}
+
+
+def _copy_order(order: Dict) -> Dict:
+    # le rotte possono modificare l'ordine ritornato: la vista non deve risentirne
+    return {**order, 'items': [dict(item) for item in order['items']]}
+
+
+class OrderNumberBlocks:
+    """Blocchi di numeri d'ordine già riservati nel database, per giornata.
+
+    Ogni processo riserva dalla tabella order_sequences un blocco di numeri
+    consecutivi e li assegna dalla memoria; solo quando il blocco finisce serve un
+    altro accesso al database. I numeri sono crescenti nella giornata per ogni
+    processo; con più processi si intercalano e quelli non usati alla chiusura
+    restano come buchi, ma non ci sono mai duplicati.
+    """
+
+    def __init__(self):
+        self._day = None
+        self._blocks = deque()  # intervalli [inizio, fine) ancora da assegnare
+        self._lock = threading.Lock()
+
+    def take(self, day: str) -> Optional[int]:
+        """Ritorna il prossimo numero riservato per `day` (None se serve un nuovo blocco)"""
+        with self._lock:
+            if day != self._day:
+                self._day = day
+                self._blocks.clear()
+            while self._blocks:
+                start, end = self._blocks[0]
+                if start < end:
+                    self._blocks[0] = (start + 1, end)
+                    return start
+                self._blocks.popleft()
+            return None
+
+    def add(self, day: str, start: int, end: int) -> None:
+        with self._lock:
+            if day != self._day:
+                self._day = day
+                self._blocks.clear()
+            self._blocks.append((start, end))
+
+
+# ==================== OPERAZIONI CONDIVISE ====================
+# Query e logica delle scritture sugli ordini, scritte una volta sola per i due
+# wrapper (sincrono e asincrono, vedi async_database_wrapper.py). Le funzioni
+# `*_steps` sono generatori: producono le query da eseguire nella transazione in
+# corso come (tipo, query, parametri) e ricevono il risultato di ognuna; ogni
+# wrapper le esegue con il proprio cursore (`_run_steps`), con o senza await.
+
+STEP_EXECUTE = 'execute'
+STEP_EXECUTE_MANY = 'executemany'
+STEP_INSERT = 'insert'        # ritorna l'id generato
+STEP_FETCH_ONE = 'fetchone'   # ritorna la riga (dict) o None
+STEP_FETCH_ALL = 'fetchall'   # ritorna la lista di righe (dict)
+
+ORDER_ITEMS_QUERY = """
+SELECT oi.*, p.name, p.category_id
+FROM {table} oi
+JOIN products p ON oi.product_id = p.id
+WHERE oi.order_id = %s
+ORDER BY oi.id
+"""
+
+# ordini modificati dopo la posizione (updated_at, id), con l'ora del database
+ORDERS_CHANGED_QUERY = """
+SELECT o.*, CURRENT_TIMESTAMP AS db_now
+FROM orders o
+WHERE o.updated_at >= %s AND (o.updated_at > %s OR o.id > %s)
+ORDER BY o.updated_at, o.id
+LIMIT %s
+"""
+
+
+def orders_page_filters(status: str = None, before: Tuple[str, int] = None,
+                        after: Tuple[str, int] = None, date_from: str = None,
+                        date_to: str = None) -> Tuple[List[str], List, str]:
+    """Condizioni, parametri e direzione di una pagina di ordini (vedi get_orders_page)"""
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if date_from:
+        conditions.append("created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("created_at < %s")
+        params.append(date_to)
+
+    direction = 'DESC'
+    if before:
+        conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params.extend([before[0], before[0], before[1]])
+    elif after:
+        direction = 'ASC'
+        conditions.append("(created_at > %s OR (created_at = %s AND id > %s))")
+        params.extend([after[0], after[0], after[1]])
+    return conditions, params, direction
+
+
+def orders_page_query(conditions: List[str], direction: str) -> str:
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+    SELECT * FROM orders
+    {where}
+    ORDER BY created_at {direction}, id {direction}
+    LIMIT %s
+    """
+
+
+def items_for_orders_query(count: int) -> str:
+    """Item (con nome e categoria del prodotto) di `count` ordini, raggruppati per ordine"""
+    return f"""
+    SELECT oi.*, p.name, p.category_id
+    FROM order_items oi
+    JOIN products p ON oi.product_id = p.id
+    WHERE oi.order_id IN ({', '.join(['%s'] * count)})
+    ORDER BY oi.order_id, oi.id
+    """
+
+
+def apply_sales_steps(db, order_ids: List[int], sign: int):
+    """Aggiunge (sign=1) o toglie (sign=-1) gli ordini dalle vendite aggregate"""
+    query = db._statement(
+        ('apply_sales', len(order_ids)),
+        lambda: sales_rollup_query(db.use_sqlite, 'orders', 'order_items',
+                                   f"o.id IN ({', '.join(['%s'] * len(order_ids))})"))
+    yield STEP_EXECUTE, query, (sign, sign, sign, *order_ids) * 3
+
+
+def fetch_orders_steps(db, order_ids: List[int]):
+    """Rilegge ordini e item nella transazione in corso (stessi campi delle letture normali)"""
+    order_query = db._statement(
+        ('fetch_orders', len(order_ids)),
+        lambda: f"SELECT * FROM orders WHERE id IN ({', '.join(['%s'] * len(order_ids))})")
+    item_query = db._statement(('items_for_orders', len(order_ids)),
+                               lambda: items_for_orders_query(len(order_ids)))
+    orders = yield STEP_FETCH_ALL, order_query, tuple(order_ids)
+    items_by_order = {order['id']: [] for order in orders}
+    for item in (yield STEP_FETCH_ALL, item_query, tuple(order_ids)):
+        items_by_order[item['order_id']].append(item)
+    return [{**order, 'items': items_by_order[order['id']]} for order in orders]
+
+
+def create_order_steps(db, order_number: str, items: List[Dict], total_price):
+    """Scrive un nuovo ordine con i suoi item e lo aggiunge alle vendite; ritorna l'id.
+
+    La vista degli ordini attivi viene aggiornata prima del commit, con il lock di
+    scrittura ancora preso (vedi ActiveOrders): se la transazione fallisce dopo,
+    il chiamante toglie l'ordine dalla vista.
+    """
+    order_query = """
+    INSERT INTO orders (order_number, total_price, status)
+    VALUES (%s, %s, 'pending')
+    """
+    item_query = """
+    INSERT INTO order_items (order_id, product_id, quantity, price)
+    VALUES (%s, %s, %s, %s)
+    """
+    order_id = yield STEP_INSERT, order_query, (order_number, total_price)
+    item_rows = [(order_id, item['product_id'], item['quantity'], item['price']) for item in items]
+    if item_rows:
+        yield STEP_EXECUTE_MANY, item_query, item_rows
+    yield from apply_sales_steps(db, [order_id], 1)
+    if db.active_orders.loaded:
+        for order in (yield from fetch_orders_steps(db, [order_id])):
+            db.active_orders.put(order)
+    return order_id
+
+
+def update_order_status_steps(db, order_id: int, status: str):
+    """Cambia lo stato di un ordine vivo; ritorna lo stato precedente (None se l'ordine non c'è).
+
+    Lo stato precedente viene letto bloccando la riga su MySQL. Un ordine annullato
+    esce dalle vendite e uno ripristinato ci rientra; un ordine che torna attivo
+    (es. da `delivered` a `ready`) viene riletto con i suoi item per la vista.
+    """
+    select_query = "SELECT status, total_price, created_at FROM orders WHERE id = %s"
+    if not db.use_sqlite:
+        select_query += " FOR UPDATE"
+    update_query = "UPDATE orders SET status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
+    updated_query = "SELECT updated_at FROM orders WHERE id = %s"
+
+    previous = yield STEP_FETCH_ONE, select_query, (order_id,)
+    if previous is None:
+        return None
+    yield STEP_EXECUTE, update_query, (status, order_id)
+    was_cancelled = previous['status'] == 'cancelled'
+    if was_cancelled != (status == 'cancelled'):
+        yield from apply_sales_steps(db, [order_id], 1 if was_cancelled else -1)
+    if db.active_orders.loaded:
+        updated = yield STEP_FETCH_ONE, updated_query, (order_id,)
+        if not db.active_orders.update_status(order_id, status, updated['updated_at']):
+            for order in (yield from fetch_orders_steps(db, [order_id])):
+                db.active_orders.put(order)
+    return previous
+
+
+def order_created(db, total_price) -> None:
+    """Aggiornamenti in memoria dopo il commit di un nuovo ordine"""
+    db.active_orders.touch()
+    db.order_stats.order_created(total_price)
+
+
+def order_status_changed(db, previous: Dict, status: str) -> None:
+    """Aggiornamenti in memoria dopo il commit di un cambio di stato"""
+    db.active_orders.touch()
+    db.order_stats.status_changed(previous['status'], status,
+                                  previous['total_price'], previous['created_at'])
+
 
 class DatabaseWrapper:
     def __init__(self):
@@ -16,17 +969,56 @@ class DatabaseWrapper:
         self.password = os.getenv('DB_PASSWORD')
         self.database = os.getenv('DB_NAME')
         self.port = int(os.getenv('DB_PORT', 3306))
+        # secondi di attesa massima per la connessione a MySQL prima del fallback su SQLite
+        self.connect_timeout = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
         # optional SSL files for Aiven connections
         self.ssl_ca = os.getenv('DB_SSL_CA')
         self.ssl_cert = os.getenv('DB_SSL_CERT')
         self.ssl_key = os.getenv('DB_SSL_KEY')
 
+        # configurazione del pool di connessioni
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 10))
+        self.pool_max_idle = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 30))
+        self.pool_pre_ping = os.getenv('DB_POOL_PRE_PING', '1') != '0'
+
+        # file del database SQLite usato in assenza di MySQL
+        self.sqlite_path = os.getenv('SQLITE_PATH', 'local.db')
+        # 'default' (compatibile con le versioni precedenti) o 'production' (vedi _connect_sqlite)
+        self.sqlite_mode = os.getenv('SQLITE_MODE', 'default').lower()
+
         # internal flag if we fell back to sqlite (used for local testing when remote is unreachable)
         self.use_sqlite = False
-        self.connection = None
+        self.pool = None
+        # unica connessione di scrittura di SQLite in modalità production (altrimenti None)
+        self.write_pool = None
+        # crea le connessioni dedicate degli export (None su SQLite senza WAL, vedi stream_orders)
+        self._export_factory = None
+        self._export_slots = threading.BoundedSemaphore(ORDER_EXPORT_MAX_CONCURRENT)
+        # connessione associata alla richiesta HTTP del thread corrente (vedi begin_request)
+        self._local = threading.local()
+        # payload del menu già serializzati, invalidati da ogni modifica a categorie/prodotti
+        self.catalog_cache = CatalogCache()
+        # prezzi e disponibilità dei prodotti per validare gli ordini senza query
+        self.product_index = ProductIndex()
+        # contatori della dashboard, aggiornati dalle scritture sugli ordini
+        self.order_stats = OrderStats()
+        # numeri d'ordine riservati in blocchi dalla tabella order_sequences
+        self.order_numbers = OrderNumberBlocks()
+        # id degli ordini riservati in blocchi (solo con la coda di scrittura, vedi order_queue.py)
+        self.order_ids = OrderNumberBlocks()
+        # ordini attivi con i loro item, per le schermate della cucina (vedi load_active_orders)
+        self.active_orders = ActiveOrders()
+        # statement dinamici già costruiti e traduzioni dei placeholder per SQLite
+        self._statements = {}
+        self._translated = {}
+        # tempi, errori e righe di ogni operazione sul database
+        self.metrics = metrics_registry
+        self.metrics.add_collector(self._pool_gauges)
+        self.metrics.add_collector(self._active_order_gauges)
 
     def connect(self) -> None:
-        """Stabilisce la connessione al database MySQL o (in alternativa) a un file SQLite.
+        """Crea il pool di connessioni verso MySQL o (in alternativa) verso un file SQLite.
 
         Se le variabili d'ambiente per l'SSL sono impostate, vengono passate a PyMySQL in un
         dizionario `ssl` (richiesto da Aiven). Se la connessione MySQL fallisce (ad esempio
@@ -38,114 +1030,462 @@ class DatabaseWrapper:
             self._connect_sqlite()
             return
 
-        try:
-            connect_args = {
-                'host': self.host,
-                'user': self.user,
-                'password': self.password,
-                'database': self.database,
-                'port': self.port,
-                'charset': 'utf8mb4',
-                'cursorclass': pymysql.cursors.DictCursor
-            }
+        connect_args = {
+            'host': self.host,
+            'user': self.user,
+            'password': self.password,
+            'database': self.database,
+            'port': self.port,
+            'charset': 'utf8mb4',
+            'connect_timeout': self.connect_timeout,
+            'cursorclass': pymysql.cursors.DictCursor,
+            # ogni statement è una transazione a sé: evita che una connessione del pool
+            # resti ferma su uno snapshot vecchio; le transazioni esplicite usano begin()
+            'autocommit': True,
+            # CURRENT_TIMESTAMP in UTC come su SQLite e come i timestamp della coda ordini
+            'init_command': "SET time_zone = '+00:00'"
+        }
 
-            # Aiven MySQL richiede certificati SSL, possiamo passarli se forniti
-            ssl_options = {}
-            if self.ssl_ca:
-                ssl_options['ca'] = self.ssl_ca
-            if self.ssl_cert:
-                ssl_options['cert'] = self.ssl_cert
-            if self.ssl_key:
-                ssl_options['key'] = self.ssl_key
-            if ssl_options:
-                connect_args['ssl'] = ssl_options
-
-            self.connection = pymysql.connect(**connect_args)
+        # Aiven MySQL richiede certificati SSL, possiamo passarli se forniti
+        ssl_options = {}
+        if self.ssl_ca:
+            ssl_options['ca'] = self.ssl_ca
+        if self.ssl_cert:
+            ssl_options['cert'] = self.ssl_cert
+        if self.ssl_key:
+            ssl_options['key'] = self.ssl_key
+        if ssl_options:
+            connect_args['ssl'] = ssl_options
+
+        pool = self._create_pool(
+            factory=lambda: pymysql.connect(**connect_args),
+            ping=lambda conn: conn.ping(reconnect=False)
+        )
+        try:
+            # apriamo subito una connessione per capire se MySQL è raggiungibile; PyMySQL
+            # applica connect_timeout solo al TCP, quindi anche handshake e autenticazione
+            # della prova sono limitati (le connessioni del pool restano senza read_timeout)
+            pymysql.connect(**connect_args, read_timeout=self.connect_timeout,
+                            write_timeout=self.connect_timeout).close()
+            self.pool = pool
+            self._export_factory = lambda: pymysql.connect(**connect_args)
             print("✓ Connesso a database MySQL")
         except Exception as e:
             # fallback a sqlite per non bloccare l'applicazione durante lo sviluppo
+            pool.close()
             print(f"✗ Errore connessione MySQL: {e}. utilizzo SQLite di fallback.")
             self._connect_sqlite()
 
     def _connect_sqlite(self) -> None:
-        """Configura una connessione SQLite locale semplice (utilizzata in assenza di MySQL)."""
+        """Configura un pool di connessioni SQLite locali (utilizzato in assenza di MySQL).
+
+        In modalità production (SQLITE_MODE=production), pensata per usare SQLite come
+        database vero su un singolo server in negozio, il file è in WAL con le
+        impostazioni di `SQLITE_PRODUCTION_PRAGMAS` e chiavi esterne attive; le letture
+        usano connessioni in sola lettura (una per richiesta/thread, dal pool) e tutte
+        le scritture passano da un'unica connessione, così non si contendono il lock.
+        """
         import sqlite3
+
+        production = self.sqlite_mode == 'production'
+
+        def factory(read_only: bool = False):
+            # le connessioni passano da un thread all'altro tramite il pool, mai in contemporanea
+            conn = sqlite3.connect(self.sqlite_path, check_same_thread=False,
+                                   cached_statements=SQLITE_CACHED_STATEMENTS)
+            conn.row_factory = sqlite3.Row
+            if production:
+                for pragma in SQLITE_PRODUCTION_PRAGMAS:
+                    conn.execute(pragma)
+                if read_only:
+                    conn.execute("PRAGMA query_only = ON")
+            return conn
+
         self.use_sqlite = True
-        self.connection = sqlite3.connect('local.db')
-        self.connection.row_factory = sqlite3.Row
-        print("✓ Connesso a database SQLite locale")
+        # gli statement già registrati erano tradotti per MySQL
+        self._statements.clear()
+        self._translated.clear()
+        ping = lambda conn: conn.execute('SELECT 1')
+        if production:
+            self.write_pool = ConnectionPool(factory=factory, ping=None, size=1,
+                                             max_idle=float('inf'), timeout=self.pool_timeout)
+            self.pool = self._create_pool(factory=lambda: factory(read_only=True), ping=ping)
+            self._export_factory = lambda: factory(read_only=True)
+            print("✓ Connesso a database SQLite locale (modalità production, WAL)")
+        else:
+            self.pool = self._create_pool(factory=factory, ping=ping)
+            print("✓ Connesso a database SQLite locale")
+
+    def _create_pool(self, factory: Callable, ping: Callable) -> ConnectionPool:
+        return ConnectionPool(
+            factory=factory,
+            ping=ping if self.pool_pre_ping else None,
+            size=self.pool_size,
+            max_idle=self.pool_max_idle,
+            timeout=self.pool_timeout
+        )
 
     def disconnect(self) -> None:
-        """Chiude la connessione al database"""
-        if self.connection:
-            self.connection.close()
+        """Chiude il pool di connessioni"""
+        if self.pool:
+            self.pool.close()
+        if self.write_pool:
+            self.write_pool.close()
+
+    def pool_stats(self) -> Dict:
+        """Ritorna le statistiche del pool di connessioni"""
+        return self.pool.stats() if self.pool else {}
+
+    def _pool_gauges(self):
+        for key, value in self.pool_stats().items():
+            yield ('db_pool_connections', "Stato del pool di connessioni", {'state': key}, value)
+
+    def _active_order_gauges(self):
+        if self.active_orders.loaded:
+            for status, count in self.active_orders.counts().items():
+                yield ('active_orders', "Ordini attivi nella vista in memoria", {'status': status}, count)
+
+    def begin_request(self) -> None:
+        """Associa al thread corrente la connessione della richiesta HTTP.
+
+        La connessione viene presa dal pool al primo utilizzo e tenuta fino a
+        `end_request()`, così tutte le query di una richiesta usano lo stesso socket.
+        """
+        self._local.request_bound = True
+
+    def end_request(self) -> None:
+        """Restituisce al pool la connessione della richiesta corrente"""
+        conn = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        self._local.request_bound = False
+        if conn is not None:
+            self.pool.release(conn)
+
+    @contextmanager
+    def _connection(self, write: bool = False):
+        """Fornisce una connessione del pool per la durata del blocco `with`
+
+        Con `write=True` e SQLite in modalità production viene usata l'unica
+        connessione di scrittura, restituita subito dopo il blocco.
+        """
+        if write and self.write_pool is not None:
+            conn = self.write_pool.acquire()
+            try:
+                yield conn
+            finally:
+                self.write_pool.release(conn)
+            return
+
+        conn = getattr(self._local, 'connection', None)
+        bound = conn is not None
+        if not bound:
+            conn = self.pool.acquire()
+            if getattr(self._local, 'request_bound', False):
+                self._local.connection = conn
+                bound = True
+        try:
+            yield conn
+        except Exception as e:
+            if self._is_disconnect(e):
+                # connessione non più utilizzabile: non la rimettiamo nel pool
+                if bound:
+                    self._local.connection = None
+                self.pool.release(conn, discard=True)
+                conn = None
+            raise
+        finally:
+            if conn is not None and not bound:
+                self.pool.release(conn)
+
+    def cached_payload(self, key, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """Ritorna (payload, etag) dalla cache del menu, costruendolo con `build` se manca.
+
+        Se durante la costruzione una query fallisce il risultato non viene salvato,
+        così un errore temporaneo del database non resta in cache come menu vuoto.
+        """
+        entry = self.catalog_cache.get(key)
+        if entry:
+            return entry
+        generation = self.catalog_cache.generation
+        failures = self._failure_count()
+        body = build()
+        if self._failure_count() != failures:
+            return body, hashlib.sha256(body).hexdigest()[:32]
+        return self.catalog_cache.put(key, body, generation)
+
+    def _failure_count(self) -> int:
+        return getattr(self._local, 'failures', 0)
+
+    def _record_failure(self, operation: str = None, kind: str = None, started: float = None) -> None:
+        self._local.failures = self._failure_count() + 1
+        if operation:
+            self.metrics.inc('db_query_errors_total', (operation, kind))
+            self.metrics.observe('db_query_duration_seconds', (operation, kind),
+                                 time.perf_counter() - started)
+
+    def _is_disconnect(self, error: Exception) -> bool:
+        return not self.use_sqlite and isinstance(
+            error, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
 
     def _translate_query(self, query: str) -> str:
-        """Se stiamo usando SQLite converte i placeholder %s in ?"""
-        if self.use_sqlite:
+        """Se stiamo usando SQLite converte i placeholder %s in ?
+
+        Le traduzioni vengono memorizzate: le query sono quasi sempre le stesse
+        costanti (o statement del registro, vedi `_statement`), quindi dopo la prima
+        chiamata basta una ricerca nel dizionario.
+        """
+        if not self.use_sqlite:
+            return query
+        translated = self._translated.get(query)
+        if translated is None:
+            if len(self._translated) >= STATEMENT_CACHE_SIZE:
+                self._translated.clear()
             # MySQL uses %s, sqlite uses ?
-            return query.replace('%s', '?')
+            translated = self._translated[query] = query.replace('%s', '?')
+        return translated
+
+    def _statement(self, key: Tuple, build: Callable[[], str]) -> str:
+        """Registro degli statement costruiti dinamicamente (es. UPDATE su un insieme di colonne).
+
+        `key` identifica lo statement logico (nome e colonne coinvolte): il testo SQL
+        viene costruito e tradotto per il dialetto corrente una sola volta e poi
+        riutilizzato, così il driver SQLite ritrova anche il proprio statement preparato.
+        """
+        query = self._statements.get(key)
+        if query is None:
+            query = self._translate_query(build())
+            if self.use_sqlite:
+                # lo statement è già tradotto: execute_* lo ritrova così com'è
+                self._translated[query] = query
+            self._statements[key] = query
         return query
 
-    def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
-        """Esegue una query SELECT"""
+    def execute_query(self, query: str, params: tuple = (), operation: str = None) -> List[Dict]:
+        """Esegue una query SELECT.
+
+        Ogni chiamata viene cronometrata ed etichettata con `operation` (di default il
+        nome del metodo chiamante, es. `get_all_products`).
+        """
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
         try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(self._translate_query(query), params)
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
             if self.use_sqlite:
-                cursor = self.connection.cursor()
-                sqlite_query = self._translate_query(query)
-                cursor.execute(sqlite_query, params)
-                rows = cursor.fetchall()
                 # sqlite3 returns Row objects, convert to dicts
                 result = [dict(r) for r in rows]
-                return result
             else:
-                with self.connection.cursor() as cursor:
-                    cursor.execute(query, params)
-                    return cursor.fetchall()
+                result = list(rows)
+            self._observe(operation, 'query', started, len(result))
+            return result
         except Exception as e:
+            self._record_failure(operation, 'query', started)
             print(f"✗ Errore query: {e}")
             return []
 
-    def execute_insert(self, query: str, params: tuple = ()) -> int:
+    def execute_insert(self, query: str, params: tuple = (), operation: str = None) -> int:
         """Esegue una query INSERT e ritorna l'ID inserito"""
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
         try:
-            if self.use_sqlite:
-                cursor = self.connection.cursor()
-                sqlite_query = self._translate_query(query)
-                cursor.execute(sqlite_query, params)
-                self.connection.commit()
-                return cursor.lastrowid
-            else:
-                with self.connection.cursor() as cursor:
-                    cursor.execute(query, params)
-                    self.connection.commit()
+            with self._connection(write=True) as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(self._translate_query(query), params)
+                    conn.commit()
+                    self._observe(operation, 'insert', started, cursor.rowcount)
                     return cursor.lastrowid
+                except Exception:
+                    self._rollback(conn)
+                    raise
+                finally:
+                    cursor.close()
         except Exception as e:
-            if not self.use_sqlite:
-                self.connection.rollback()
+            self._record_failure(operation, 'insert', started)
             print(f"✗ Errore inserimento: {e}")
             return -1
 
-    def execute_update(self, query: str, params: tuple = ()) -> bool:
+    def execute_update(self, query: str, params: tuple = (), operation: str = None) -> bool:
         """Esegue una query UPDATE/DELETE"""
+        operation = operation or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
         try:
-            if self.use_sqlite:
-                cursor = self.connection.cursor()
-                sqlite_query = self._translate_query(query)
-                cursor.execute(sqlite_query, params)
-                self.connection.commit()
-                return True
-            else:
-                with self.connection.cursor() as cursor:
-                    cursor.execute(query, params)
-                    self.connection.commit()
+            with self._connection(write=True) as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(self._translate_query(query), params)
+                    conn.commit()
+                    self._observe(operation, 'update', started, max(cursor.rowcount, 0))
                     return True
+                except Exception:
+                    self._rollback(conn)
+                    raise
+                finally:
+                    cursor.close()
         except Exception as e:
-            if not self.use_sqlite:
-                self.connection.rollback()
+            self._record_failure(operation, 'update', started)
             print(f"✗ Errore aggiornamento: {e}")
             return False
 
+    @contextmanager
+    def _transaction(self, operation: str, relax_foreign_keys: bool = False):
+        """Esegue il blocco `with` in un'unica transazione e fornisce il cursore.
+
+        Commit alla fine del blocco, rollback di tutto se viene sollevata un'eccezione
+        (che viene poi propagata al chiamante). La durata dell'intera transazione viene
+        registrata con l'etichetta `operation`. Su SQLite la transazione prende subito
+        il lock di scrittura e include anche il DDL; `relax_foreign_keys` sospende il
+        controllo delle chiavi esterne (serve a ricostruire le tabelle nelle migrazioni).
+        """
+        started = time.perf_counter()
+        try:
+            with self._connection(write=True) as conn:
+                if self.use_sqlite:
+                    if relax_foreign_keys:
+                        # il pragma non ha effetto dentro una transazione: va eseguito prima
+                        conn.execute("PRAGMA foreign_keys = OFF")
+                    conn.execute("BEGIN IMMEDIATE")
+                else:
+                    # le connessioni MySQL sono in autocommit: apriamo la transazione esplicitamente
+                    conn.begin()
+                cursor = conn.cursor()
+                try:
+                    yield cursor
+                    conn.commit()
+                except Exception:
+                    self._rollback(conn)
+                    raise
+                finally:
+                    cursor.close()
+                    if self.use_sqlite and relax_foreign_keys and self.sqlite_mode == 'production':
+                        conn.execute("PRAGMA foreign_keys = ON")
+        except Exception:
+            self.metrics.inc('db_query_errors_total', (operation, 'transaction'))
+            self.metrics.observe('db_query_duration_seconds', (operation, 'transaction'),
+                                 time.perf_counter() - started)
+            raise
+        self._observe(operation, 'transaction', started)
+
+    def _observe(self, operation: str, kind: str, started: float, rows: int = None) -> None:
+        self.metrics.observe('db_query_duration_seconds', (operation, kind),
+                             time.perf_counter() - started)
+        if rows:
+            self.metrics.inc('db_rows_total', (operation, kind), rows)
+
+    def _run_steps(self, cursor, steps):
+        """Esegue con il cursore della transazione le query di un'operazione condivisa.
+
+        `steps` è uno dei generatori `*_steps` del modulo: ogni query prodotta viene
+        eseguita e il suo risultato rimandato al generatore; ritorna il suo risultato.
+        """
+        result = None
+        while True:
+            try:
+                kind, query, params = steps.send(result)
+            except StopIteration as done:
+                return done.value
+            result = None
+            if kind == STEP_EXECUTE_MANY:
+                cursor.executemany(self._translate_query(query), params)
+                continue
+            cursor.execute(self._translate_query(query), params)
+            if kind == STEP_INSERT:
+                result = cursor.lastrowid
+            elif kind == STEP_FETCH_ONE:
+                row = cursor.fetchone()
+                result = dict(row) if row is not None else None
+            elif kind == STEP_FETCH_ALL:
+                result = [dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _rollback(conn) -> None:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+    # ==================== SCHEMA E MIGRAZIONI ====================
+
+    def init_schema(self) -> None:
+        """Crea le tabelle di base (se non esistono) e la tabella delle migrazioni"""
+        self.init_categories_table()
+        self.init_products_table()
+        self.init_orders_table()
+        self.init_order_items_table()
+        self.init_order_sequences_table()
+        self.init_archive_tables()
+        self.init_sales_rollups_table()
+        if self.use_sqlite:
+            query = """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        else:
+            query = """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        self.execute_update(query)
+
+    def get_schema_version(self) -> int:
+        """Ritorna l'ultima versione di migrazione applicata (0 se nessuna)"""
+        result = self.execute_query("SELECT MAX(version) AS version FROM schema_migrations")
+        return (result[0]['version'] or 0) if result else 0
+
+    def migrate(self, target: int = None) -> List[int]:
+        """Applica in ordine le migrazioni mancanti fino a `target` (default: tutte).
+
+        Su SQLite ogni migrazione è atomica; su MySQL il DDL fa commit implicito, quindi
+        i passi già eseguiti di una migrazione interrotta vengono riconosciuti e saltati.
+        Solleva un'eccezione alla prima migrazione che fallisce. Ritorna le versioni
+        applicate.
+        """
+        self.init_schema()
+        current = self.get_schema_version()
+        dialect = 'sqlite' if self.use_sqlite else 'mysql'
+        applied = []
+        for version, description, steps in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+            with self._transaction('migrate', relax_foreign_keys=True) as cursor:
+                for statement in steps[dialect]:
+                    try:
+                        cursor.execute(statement)
+                    except pymysql.err.MySQLError as e:
+                        if e.args and e.args[0] in MYSQL_ALREADY_APPLIED_ERRORS:
+                            continue
+                        raise
+                cursor.execute(
+                    self._translate_query(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)"),
+                    (version, description)
+                )
+            applied.append(version)
+            print(f"✓ Migrazione {version} applicata: {description}")
+        if applied and self.use_sqlite:
+            # righe orfane già presenti: restano, ma vanno segnalate
+            violations = self.execute_query("PRAGMA foreign_key_check")
+            if violations:
+                print(f"⚠ {len(violations)} righe violano le chiavi esterne (PRAGMA foreign_key_check)")
+        return applied
+
+    def pending_migrations(self) -> List[Tuple[int, str]]:
+        """Ritorna le migrazioni non ancora applicate"""
+        current = self.get_schema_version()
+        return [(version, description) for version, description, _ in MIGRATIONS
+                if version > current]
+
     # ==================== CATEGORIE ====================
     
     def init_categories_table(self) -> None:
@@ -180,7 +1520,24 @@ class DatabaseWrapper:
         INSERT INTO categories (name, description, icon, order_position)
         VALUES (%s, %s, %s, %s)
         """
-        return self.execute_insert(query, (name, description, icon, order_position))
+        category_id = self.execute_insert(query, (name, description, icon, order_position))
+        self.catalog_cache.invalidate()
+        return category_id
+
+    def add_categories(self, categories: List[Dict]) -> int:
+        """Aggiunge più categorie con un solo `executemany` e un solo commit; ritorna quante"""
+        query = """
+        INSERT INTO categories (name, description, icon, order_position)
+        VALUES (%s, %s, %s, %s)
+        """
+        rows = [(c['name'], c.get('description'), c.get('icon'), c.get('order_position', 0))
+                for c in categories]
+        if not rows:
+            return 0
+        with self._transaction('add_categories') as cursor:
+            cursor.executemany(self._translate_query(query), rows)
+        self.catalog_cache.invalidate()
+        return len(rows)
 
     def update_category(self, category_id: int, name: str = None, description: str = None, 
                        icon: str = None, order_position: int = None) -> bool:
@@ -205,13 +1562,19 @@ class DatabaseWrapper:
             return False
 
         params.append(category_id)
-        query = f"UPDATE categories SET {', '.join(updates)} WHERE id = %s"
-        return self.execute_update(query, tuple(params))
+        query = self._statement(
+            ('update_category', *updates),
+            lambda: f"UPDATE categories SET {', '.join(updates)} WHERE id = %s")
+        success = self.execute_update(query, tuple(params))
+        self.catalog_cache.invalidate()
+        return success
 
     def delete_category(self, category_id: int) -> bool:
         """Elimina una categoria"""
         query = "DELETE FROM categories WHERE id = %s"
-        return self.execute_update(query, (category_id,))
+        success = self.execute_update(query, (category_id,))
+        self.catalog_cache.invalidate()
+        return success
 
     def get_all_categories(self) -> List[Dict]:
         """Ritorna tutte le categorie ordinate per posizione"""
@@ -241,13 +1604,13 @@ class DatabaseWrapper:
                 name TEXT NOT NULL,
                 description TEXT,
                 price REAL NOT NULL,
-                category_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL REFERENCES categories(id),
                 image_url TEXT,
                 available BOOLEAN DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """
-            # note: sqlite enforces foreign keys only if PRAGMA foreign_keys=ON; omit for simplicity
+            # note: sqlite enforces foreign keys only if PRAGMA foreign_keys=ON (SQLITE_MODE=production)
         else:
             query = """
             CREATE TABLE IF NOT EXISTS products (
@@ -273,7 +1636,7 @@ class DatabaseWrapper:
         WHERE p.available = TRUE 
         ORDER BY c.order_position, c.name, p.name
         """
-        return self.execute_query(query)
+        return with_image_variants(self.execute_query(query))
 
     def get_products_by_category(self, category_id: int) -> List[Dict]:
         """Ritorna i prodotti di una categoria"""
@@ -284,7 +1647,7 @@ class DatabaseWrapper:
         WHERE p.category_id = %s AND p.available = TRUE 
         ORDER BY p.name
         """
-        return self.execute_query(query, (category_id,))
+        return with_image_variants(self.execute_query(query, (category_id,)))
 
     def get_product_by_id(self, product_id: int) -> Optional[Dict]:
         """Ritorna un prodotto per ID con info categoria"""
@@ -294,7 +1657,7 @@ class DatabaseWrapper:
         LEFT JOIN categories c ON p.category_id = c.id
         WHERE p.id = %s
         """
-        result = self.execute_query(query, (product_id,))
+        result = with_image_variants(self.execute_query(query, (product_id,)))
         return result[0] if result else None
 
     def add_product(self, name: str, description: str, price: float, 
@@ -304,7 +1667,29 @@ class DatabaseWrapper:
         INSERT INTO products (name, description, price, category_id, image_url)
         VALUES (%s, %s, %s, %s, %s)
         """
-        return self.execute_insert(query, (name, description, price, category_id, image_url))
+        product_id = self.execute_insert(query, (name, description, price, category_id, image_url))
+        self.catalog_cache.invalidate()
+        if product_id != -1:
+            self.product_index.set(product_id, price=price, available=True,
+                                   name=name, category_id=category_id)
+        return product_id
+
+    def add_products(self, products: List[Dict]) -> int:
+        """Aggiunge più prodotti con un solo `executemany` e un solo commit; ritorna quanti"""
+        query = """
+        INSERT INTO products (name, description, price, category_id, image_url)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        rows = [(p['name'], p.get('description', ''), p['price'], p['category_id'], p.get('image_url'))
+                for p in products]
+        if not rows:
+            return 0
+        with self._transaction('add_products') as cursor:
+            cursor.executemany(self._translate_query(query), rows)
+        self.catalog_cache.invalidate()
+        # gli id assegnati non sono noti: l'indice verrà ricaricato al primo ordine
+        self.product_index.invalidate()
+        return len(rows)
 
     def update_product(self, product_id: int, name: str = None, description: str = None,
                       price: float = None, category_id: int = None, image_url: str = None) -> bool:
@@ -332,13 +1717,148 @@ class DatabaseWrapper:
             return False
 
         params.append(product_id)
-        query = f"UPDATE products SET {', '.join(updates)} WHERE id = %s"
-        return self.execute_update(query, tuple(params))
+        query = self._statement(
+            ('update_product', *updates),
+            lambda: f"UPDATE products SET {', '.join(updates)} WHERE id = %s")
+        success = self.execute_update(query, tuple(params))
+        self.catalog_cache.invalidate()
+        if success:
+            self.product_index.set(product_id, price=price or None, name=name or None,
+                                   category_id=category_id)
+        return success
 
     def delete_product(self, product_id: int) -> bool:
         """Elimina un prodotto (soft delete)"""
         query = "UPDATE products SET available = FALSE WHERE id = %s"
-        return self.execute_update(query, (product_id,))
+        success = self.execute_update(query, (product_id,))
+        self.catalog_cache.invalidate()
+        if success:
+            self.product_index.set(product_id, available=False)
+        return success
+
+    def import_catalog(self, categories: Dict[str, Dict], products: Dict[Tuple[str, str], Dict]) -> Dict[str, int]:
+        """Upsert del menu con una sola transazione (vedi catalog_io.py).
+
+        Le categorie sono riconosciute per nome, i prodotti per categoria e nome; i
+        campi a None restano invariati. Inserimenti e aggiornamenti usano un
+        `executemany` per tipo e cache del menu e indice dei prodotti vengono
+        invalidati una volta sola alla fine. Ritorna i conteggi di creati e
+        aggiornati; eventuali errori vengono propagati e nulla viene scritto.
+        """
+        category_insert = """
+        INSERT INTO categories (name, description, icon, order_position)
+        VALUES (%s, %s, %s, %s)
+        """
+        category_update = """
+        UPDATE categories
+        SET description = COALESCE(%s, description), icon = COALESCE(%s, icon),
+            order_position = COALESCE(%s, order_position)
+        WHERE id = %s
+        """
+        product_insert = """
+        INSERT INTO products (name, description, price, category_id, image_url, available)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """
+        product_update = """
+        UPDATE products
+        SET description = COALESCE(%s, description), price = %s,
+            image_url = COALESCE(%s, image_url), available = COALESCE(%s, available)
+        WHERE id = %s
+        """
+        category_query = "SELECT id, name FROM categories"
+        product_query = "SELECT id, name, category_id FROM products ORDER BY id"
+
+        with self._transaction('import_catalog') as cursor:
+            cursor.execute(category_query)
+            category_ids = {row['name']: row['id'] for row in map(dict, cursor.fetchall())}
+            new_categories = [(name, attrs.get('description'), attrs.get('icon'), attrs.get('order_position') or 0)
+                              for name, attrs in categories.items() if name not in category_ids]
+            changed_categories = [(attrs.get('description'), attrs.get('icon'), attrs.get('order_position'),
+                                   category_ids[name])
+                                  for name, attrs in categories.items()
+                                  if name in category_ids and any(value is not None for value in attrs.values())]
+            if new_categories:
+                cursor.executemany(self._translate_query(category_insert), new_categories)
+                cursor.execute(category_query)
+                category_ids = {row['name']: row['id'] for row in map(dict, cursor.fetchall())}
+            if changed_categories:
+                cursor.executemany(self._translate_query(category_update), changed_categories)
+
+            # con nomi duplicati (possibili nelle versioni precedenti) vale il prodotto più vecchio
+            product_ids = {}
+            cursor.execute(product_query)
+            for row in map(dict, cursor.fetchall()):
+                product_ids.setdefault((row['category_id'], row['name']), row['id'])
+            new_products = []
+            changed_products = []
+            for (category, name), product in products.items():
+                category_id = category_ids[category]
+                product_id = product_ids.get((category_id, name))
+                if product_id is None:
+                    available = True if product.get('available') is None else product['available']
+                    new_products.append((name, product.get('description') or '', product['price'],
+                                         category_id, product.get('image_url'), available))
+                else:
+                    changed_products.append((product.get('description'), product['price'],
+                                             product.get('image_url'), product.get('available'), product_id))
+            if new_products:
+                cursor.executemany(self._translate_query(product_insert), new_products)
+            if changed_products:
+                cursor.executemany(self._translate_query(product_update), changed_products)
+        self.catalog_cache.invalidate()
+        self.product_index.invalidate()
+        return {
+            'categories_created': len(new_categories),
+            'categories_updated': len(changed_categories),
+            'products_created': len(new_products),
+            'products_updated': len(changed_products),
+        }
+
+    def export_catalog(self) -> List[Dict]:
+        """Righe del menu completo (prodotti non disponibili compresi) per catalog_io.export_lines"""
+        query = """
+        SELECT c.name AS category, c.description AS category_description, c.icon AS category_icon,
+               c.order_position AS category_position, p.name, p.description, p.price,
+               p.image_url, p.available
+        FROM categories c
+        LEFT JOIN products p ON p.category_id = c.id
+        ORDER BY c.order_position, c.id, p.id
+        """
+        failures = self._failure_count()
+        rows = self.execute_query(query)
+        if self._failure_count() != failures:
+            raise RuntimeError("Menu non disponibile")
+        for row in rows:
+            if row['available'] is not None:
+                row['available'] = bool(row['available'])
+        return rows
+
+    def load_product_index(self) -> None:
+        """Carica (o ricarica) l'indice prezzi/disponibilità con una sola query"""
+        failures = self._failure_count()
+        rows = self.execute_query("SELECT id, price, available, name, category_id FROM products")
+        if self._failure_count() == failures:
+            self.product_index.load(rows)
+
+    def price_order_items(self, items: List[Dict]) -> Tuple[List[Dict], Decimal]:
+        """Valida gli item di un ordine e ne calcola i prezzi lato server.
+
+        Usa l'indice in memoria dei prodotti (nessuna query se caricato da meno di
+        `PRODUCT_INDEX_TTL` secondi): il prezzo inviato dal client viene ignorato.
+        Un prodotto sconosciuto fa ricaricare l'indice una volta, perché potrebbe
+        essere stato aggiunto da un altro processo. Ritorna gli item con il prezzo di
+        listino e il totale; solleva ValueError per prodotti inesistenti o non più
+        disponibili e per quantità non valide.
+        """
+        if not self.product_index.fresh:
+            self.load_product_index()
+        try:
+            return self.product_index.price_items(items)
+        except UnknownProduct:
+            if self.product_index.loaded_since(PRODUCT_INDEX_MIN_RELOAD):
+                raise
+        self.load_product_index()
+        return self.product_index.price_items(items)
 
     # ==================== ORDINI ====================
 
@@ -374,8 +1894,8 @@ class DatabaseWrapper:
             query = """
             CREATE TABLE IF NOT EXISTS order_items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
+                order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+                product_id INTEGER NOT NULL REFERENCES products(id),
                 quantity INTEGER NOT NULL,
                 price REAL NOT NULL
             )
@@ -394,6 +1914,195 @@ class DatabaseWrapper:
             """
         self.execute_update(query)
 
+    def init_order_sequences_table(self) -> None:
+        """Crea la tabella dei contatori giornalieri dei numeri d'ordine.
+
+        La riga `ORDER_ID_SEQUENCE` contiene invece il prossimo id d'ordine riservabile.
+        """
+        if self.use_sqlite:
+            query = """
+            CREATE TABLE IF NOT EXISTS order_sequences (
+                day TEXT PRIMARY KEY,
+                next_value INTEGER NOT NULL
+            )
+            """
+        else:
+            query = """
+            CREATE TABLE IF NOT EXISTS order_sequences (
+                day CHAR(8) PRIMARY KEY,
+                next_value INT NOT NULL
+            )
+            """
+        self.execute_update(query)
+
+    def init_archive_tables(self) -> None:
+        """Crea le tabelle di archivio degli ordini chiusi (vedi archive_orders).
+
+        Stesse colonne di orders e order_items, senza autoincremento né chiavi
+        esterne: le righe arrivano con il loro id e non vengono più modificate.
+        """
+        if self.use_sqlite:
+            queries = [
+                """
+                CREATE TABLE IF NOT EXISTS orders_archive (
+                    id INTEGER PRIMARY KEY,
+                    order_number TEXT NOT NULL,
+                    total_price REAL NOT NULL,
+                    status TEXT,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS order_items_archive (
+                    id INTEGER PRIMARY KEY,
+                    order_id INTEGER NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    price REAL NOT NULL
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive (created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_order_items_archive_order ON order_items_archive (order_id)",
+            ]
+        else:
+            queries = [
+                """
+                CREATE TABLE IF NOT EXISTS orders_archive (
+                    id INT PRIMARY KEY,
+                    order_number VARCHAR(50) NOT NULL,
+                    total_price DECIMAL(10, 2) NOT NULL,
+                    status VARCHAR(50),
+                    created_at TIMESTAMP NULL DEFAULT NULL,
+                    updated_at TIMESTAMP NULL DEFAULT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_orders_archive_created (created_at)
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS order_items_archive (
+                    id INT PRIMARY KEY,
+                    order_id INT NOT NULL,
+                    product_id INT NOT NULL,
+                    quantity INT NOT NULL,
+                    price DECIMAL(10, 2) NOT NULL,
+                    INDEX idx_order_items_archive_order (order_id)
+                )
+                """,
+            ]
+        for query in queries:
+            self.execute_update(query)
+
+    def init_sales_rollups_table(self) -> None:
+        """Crea la tabella delle vendite aggregate per ora (vedi sales_rollup_query).
+
+        Ogni riga somma ordini, quantità e incasso di un'ora per una dimensione:
+        `hour` (totale dell'ora, key_id 0), `category` o `product` (key_id è l'id).
+        Gli ordini annullati non vengono contati.
+        """
+        if self.use_sqlite:
+            query = """
+            CREATE TABLE IF NOT EXISTS sales_rollups (
+                dimension TEXT NOT NULL,
+                hour TIMESTAMP NOT NULL,
+                key_id INTEGER NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, hour, key_id)
+            )
+            """
+        else:
+            query = """
+            CREATE TABLE IF NOT EXISTS sales_rollups (
+                dimension VARCHAR(10) NOT NULL,
+                hour DATETIME NOT NULL,
+                key_id INT NOT NULL,
+                orders INT NOT NULL DEFAULT 0,
+                quantity INT NOT NULL DEFAULT 0,
+                revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, hour, key_id)
+            )
+            """
+        self.execute_update(query)
+
+    def reserve_order_numbers(self, day: str, count: int) -> int:
+        """Riserva `count` numeri consecutivi per `day` e ritorna il primo.
+
+        L'UPDATE blocca la riga del giorno (su SQLite l'intero database) fino al
+        commit, quindi processi diversi ricevono sempre blocchi disgiunti.
+        """
+        insert_query = ("INSERT OR IGNORE" if self.use_sqlite else "INSERT IGNORE") + \
+            " INTO order_sequences (day, next_value) VALUES (%s, 1)"
+        update_query = "UPDATE order_sequences SET next_value = next_value + %s WHERE day = %s"
+        select_query = "SELECT next_value FROM order_sequences WHERE day = %s"
+        with self._transaction('reserve_order_numbers') as cursor:
+            cursor.execute(self._translate_query(insert_query), (day,))
+            cursor.execute(self._translate_query(update_query), (count, day))
+            cursor.execute(self._translate_query(select_query), (day,))
+            next_value = dict(cursor.fetchone())['next_value']
+        return next_value - count
+
+    def next_order_number(self) -> str:
+        """Ritorna un numero d'ordine univoco e breve (ORD-AAAAMMGG-NNNN), crescente nel giorno"""
+        day = datetime.now().strftime('%Y%m%d')
+        number = self.order_numbers.take(day)
+        while number is None:
+            start = self.reserve_order_numbers(day, ORDER_NUMBER_BLOCK)
+            self.order_numbers.add(day, start, start + ORDER_NUMBER_BLOCK)
+            number = self.order_numbers.take(day)
+        return f"ORD-{day}-{number:04d}"
+
+    def reserve_order_ids(self, count: int) -> int:
+        """Riserva `count` id d'ordine consecutivi e ritorna il primo.
+
+        Il contatore parte oltre l'id più alto già usato (anche tra gli ordini
+        archiviati), e nella stessa transazione l'AUTO_INCREMENT di `orders` viene
+        spinto oltre il blocco riservato: un ordine creato direttamente
+        (`create_order`) prima che la coda scriva i suoi non può ricevere lo stesso id.
+        Per spostare il contatore si inserisce e si cancella una riga segnaposto con
+        l'ultimo id del blocco: sia InnoDB sia SQLite (sqlite_sequence) non fanno mai
+        tornare indietro il contatore, quindi funziona anche con prenotazioni
+        concorrenti, e a differenza di `ALTER TABLE ... AUTO_INCREMENT` non chiude la
+        transazione su MySQL.
+        """
+        insert_query = ("INSERT OR IGNORE" if self.use_sqlite else "INSERT IGNORE") + \
+            " INTO order_sequences (day, next_value) VALUES (%s, 1)"
+        greatest = 'MAX' if self.use_sqlite else 'GREATEST'
+        update_query = f"""
+        UPDATE order_sequences
+        SET next_value = {greatest}(
+            next_value,
+            (SELECT COALESCE(MAX(id), 0) + 1 FROM orders),
+            (SELECT COALESCE(MAX(id), 0) + 1 FROM orders_archive)) + %s
+        WHERE day = %s
+        """
+        select_query = "SELECT next_value FROM order_sequences WHERE day = %s"
+        placeholder_query = """
+        INSERT INTO orders (id, order_number, total_price, status)
+        VALUES (%s, %s, 0, 'cancelled')
+        """
+        delete_query = "DELETE FROM orders WHERE id = %s"
+        with self._transaction('reserve_order_ids') as cursor:
+            cursor.execute(self._translate_query(insert_query), (ORDER_ID_SEQUENCE,))
+            cursor.execute(self._translate_query(update_query), (count, ORDER_ID_SEQUENCE))
+            cursor.execute(self._translate_query(select_query), (ORDER_ID_SEQUENCE,))
+            next_value = dict(cursor.fetchone())['next_value']
+            last = next_value - 1
+            cursor.execute(self._translate_query(placeholder_query), (last, f"RESERVED-{last}"))
+            cursor.execute(self._translate_query(delete_query), (last,))
+        return next_value - count
+
+    def next_order_id(self) -> int:
+        """Ritorna un id d'ordine riservato, da usare prima che l'ordine sia nel database"""
+        order_id = self.order_ids.take(ORDER_ID_SEQUENCE)
+        while order_id is None:
+            start = self.reserve_order_ids(ORDER_NUMBER_BLOCK)
+            self.order_ids.add(ORDER_ID_SEQUENCE, start, start + ORDER_NUMBER_BLOCK)
+            order_id = self.order_ids.take(ORDER_ID_SEQUENCE)
+        return order_id
+
     def get_all_orders(self) -> List[Dict]:
         """Ritorna tutti gli ordini"""
         query = """
@@ -411,56 +2120,631 @@ class DatabaseWrapper:
         """
         return self.execute_query(query, (status,))
 
+    def get_orders_page(self, status: str = None, limit: int = 100,
+                        before: Tuple[str, int] = None, after: Tuple[str, int] = None,
+                        date_from: str = None, date_to: str = None) -> List[Dict]:
+        """Ritorna una pagina di ordini con paginazione keyset su (created_at, id).
+
+        `before` ritorna gli ordini più vecchi del cursore, `after` quelli più recenti;
+        `date_from` è incluso e `date_to` escluso. Filtri, ordinamento e limite vengono
+        eseguiti dal database, quindi il costo non cresce con lo storico degli ordini.
+        Il risultato è sempre in ordine dal più recente al più vecchio.
+        """
+        conditions, params, direction = orders_page_filters(status, before, after, date_from, date_to)
+        query = self._statement(('get_orders_page', direction, *conditions),
+                                lambda: orders_page_query(conditions, direction))
+        params.append(limit)
+        rows = self.execute_query(query, tuple(params))
+        if direction == 'ASC':
+            rows.reverse()
+        return rows
+
+    def get_orders_changed_since(self, since: Tuple[str, int], limit: int = 100) -> Tuple[List[Dict], object]:
+        """Ritorna gli ordini modificati dopo la posizione `since` e l'ora del database.
+
+        `since` è la coppia (updated_at, id) dell'ultima modifica già vista: gli ordini
+        seguono in ordine (updated_at, id), con l'indice (updated_at, id) della
+        migrazione 2. L'ora del database (None se non ci sono righe) serve a capire
+        se il secondo dell'ultima modifica è ancora aperto (vedi `changes_page`).
+        """
+        updated_at, order_id = since
+        rows = self.execute_query(ORDERS_CHANGED_QUERY, (updated_at, updated_at, order_id, limit))
+        db_now = rows[0]['db_now'] if rows else None
+        for row in rows:
+            del row['db_now']
+        return rows, db_now
+
     def get_order_by_id(self, order_id: int) -> Optional[Dict]:
-        """Ritorna un ordine per ID"""
+        """Ritorna un ordine per ID, cercandolo anche tra quelli archiviati"""
         query = "SELECT * FROM orders WHERE id = %s"
         result = self.execute_query(query, (order_id,))
+        if not result:
+            archive_query = "SELECT * FROM orders_archive WHERE id = %s"
+            result = self.execute_query(archive_query, (order_id,))
         return result[0] if result else None
 
     def get_order_items(self, order_id: int) -> List[Dict]:
-        """Ritorna gli item di un ordine"""
-        query = """
-        SELECT oi.*, p.name, p.category 
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        WHERE oi.order_id = %s
+        """Ritorna gli item di un ordine (dall'archivio se l'ordine è stato archiviato)"""
+        items = self.execute_query(ORDER_ITEMS_QUERY.format(table='order_items'), (order_id,))
+        if not items:
+            items = self.execute_query(ORDER_ITEMS_QUERY.format(table='order_items_archive'), (order_id,))
+        return items
+
+    def get_items_for_orders(self, order_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Ritorna gli item di più ordini con una sola query, raggruppati per order_id.
+
+        Evita il problema N+1 nelle liste di ordini: invece di una query per ordine
+        viene eseguita una singola `WHERE order_id IN (...)` e il raggruppamento
+        avviene in Python. Gli ordini senza item compaiono con una lista vuota.
         """
-        return self.execute_query(query, (order_id,))
+        items_by_order = {order_id: [] for order_id in order_ids}
+        if not items_by_order:
+            return items_by_order
+
+        ids = list(items_by_order)
+        # limitiamo il numero di placeholder per query (SQLite ne accetta al massimo 999)
+        chunk_size = 500
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            query = self._statement(('items_for_orders', len(chunk)),
+                                    lambda: items_for_orders_query(len(chunk)))
+            for item in self.execute_query(query, tuple(chunk)):
+                items_by_order[item['order_id']].append(item)
+        return items_by_order
 
     def create_order(self, order_number: str, items: List[Dict], total_price: float) -> int:
-        """Crea un nuovo ordine con i suoi item"""
-        # Inserisci ordine
-        order_query = """
-        INSERT INTO orders (order_number, total_price, status)
-        VALUES (%s, %s, 'pending')
-        """
-        order_id = self.execute_insert(order_query, (order_number, total_price))
+        """Crea un nuovo ordine con i suoi item in un'unica transazione.
 
-        if order_id == -1:
+        L'ordine e tutti gli item vengono scritti con un solo commit (gli item con un
+        unico `executemany`); se una qualsiasi scrittura fallisce non resta nulla nel
+        database e viene ritornato -1.
+        """
+        order_id = None
+        try:
+            with self._transaction('create_order') as cursor:
+                order_id = self._run_steps(cursor, create_order_steps(self, order_number, items, total_price))
+        except Exception as e:
+            self._record_failure()
+            print(f"✗ Errore creazione ordine: {e}")
+            if order_id is not None:
+                # commit fallito: l'ordine era già nella vista
+                self.active_orders.remove(order_id)
             return -1
+        order_created(self, total_price)
+        return order_id
+
+    def create_orders_batch(self, orders: List[Dict]) -> List[int]:
+        """Scrive più ordini già accettati (con id, numero e timestamp assegnati) con un solo commit.
 
-        # Inserisci gli item
+        Usato dalla coda di scrittura: ordini e item vanno nel database con due
+        `executemany` nella stessa transazione. Gli ordini già presenti con lo stesso
+        numero (scritti prima di un riavvio che non ha fatto in tempo a svuotare la
+        coda) vengono saltati, quindi riprovare un blocco non crea duplicati; un id
+        già usato da un ordine con un altro numero solleva OrderConflict. Ritorna gli
+        id inseriti; eventuali errori vengono propagati. I contatori della dashboard
+        non vengono toccati: la coda li aggiorna già quando accetta l'ordine.
+        """
+        if not orders:
+            return []
+        ids = [order['id'] for order in orders]
+        select_query = self._statement(
+            ('create_orders_batch', len(ids)),
+            lambda: f"SELECT id, order_number FROM orders WHERE id IN ({', '.join(['%s'] * len(ids))})")
+        order_query = """
+        INSERT INTO orders (id, order_number, total_price, status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """
         item_query = """
         INSERT INTO order_items (order_id, product_id, quantity, price)
         VALUES (%s, %s, %s, %s)
         """
-        
-        for item in items:
-            self.execute_insert(item_query, 
-                              (order_id, item['product_id'], item['quantity'], item['price']))
+        new_orders = []
+        try:
+            with self._transaction('create_orders_batch') as cursor:
+                cursor.execute(self._translate_query(select_query), tuple(ids))
+                existing = {row['id']: row['order_number'] for row in map(dict, cursor.fetchall())}
+                for order in orders:
+                    if order['id'] in existing and existing[order['id']] != order['order_number']:
+                        # lo stesso id è stato dato a un altro ordine: non è un ordine già scritto
+                        raise OrderConflict(f"Id {order['id']} già usato dall'ordine "
+                                            f"{existing[order['id']]}, non da {order['order_number']}")
+                new_orders = [order for order in orders if order['id'] not in existing]
+                if new_orders:
+                    cursor.executemany(self._translate_query(order_query), [
+                        (order['id'], order['order_number'], order['total_price'], order['status'],
+                         order['created_at'], order['updated_at']) for order in new_orders])
+                    cursor.executemany(self._translate_query(item_query), [
+                        (order['id'], item['product_id'], item['quantity'], item['price'])
+                        for order in new_orders for item in order['items']])
+                    sold = [order['id'] for order in new_orders if order['status'] != 'cancelled']
+                    if sold:
+                        self._apply_sales(cursor, sold, 1)
+                    if self.active_orders.loaded:
+                        for order in self._fetch_orders(cursor, [order['id'] for order in new_orders]):
+                            self.active_orders.put(order)
+        except Exception:
+            # rollback: gli ordini del blocco non sono nel database
+            for order in new_orders:
+                self.active_orders.remove(order['id'])
+            raise
+        self.active_orders.touch()
+        return [order['id'] for order in new_orders]
 
-        return order_id
+    def update_order_status(self, order_id: int, status: str) -> Optional[bool]:
+        """Aggiorna lo stato di un ordine.
 
-    def update_order_status(self, order_id: int, status: str) -> bool:
-        """Aggiorna lo stato di un ordine"""
-        valid_statuses = ['pending', 'preparing', 'ready', 'delivered', 'cancelled']
-        if status not in valid_statuses:
+        Lo stato precedente viene letto nella stessa transazione (bloccando la riga su
+        MySQL) per spostare l'ordine tra i contatori della dashboard. Ritorna None se
+        l'ordine non è tra quelli vivi (inesistente o archiviato): nulla viene scritto.
+        """
+        if status not in ORDER_STATUSES:
+            return False
+        try:
+            with self._transaction('update_order_status') as cursor:
+                previous = self._run_steps(cursor, update_order_status_steps(self, order_id, status))
+        except Exception as e:
+            self._record_failure()
+            print(f"✗ Errore aggiornamento: {e}")
+            self._reload_active_order(order_id)
             return False
+        if previous is None:
+            return None
+        order_status_changed(self, previous, status)
+        return True
 
-        query = "UPDATE orders SET status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
-        return self.execute_update(query, (status, order_id))
+    def _reload_active_order(self, order_id: int) -> None:
+        """Riallinea un ordine della vista al database dopo una transazione annullata"""
+        if not self.active_orders.loaded:
+            return
+        failures = self._failure_count()
+        order = self.get_order_by_id(order_id)
+        items = self.get_order_items(order_id)
+        if self._failure_count() != failures:
+            # stato dell'ordine sconosciuto: le letture tornano al database fino al prossimo rebuild
+            self.active_orders.invalidate()
+            print(f"⚠ Vista ordini attivi disattivata: ordine {order_id} non riletto")
+        elif order is None:
+            self.active_orders.remove(order_id)
+        else:
+            self.active_orders.put({**order, 'items': items})
+
+    def get_order_stats(self) -> Dict:
+        """Ritorna i contatori della dashboard, ricostruendoli con una query se mancano"""
+        snapshot = self.order_stats.snapshot()
+        if snapshot is not None:
+            return snapshot
+        generation = self.order_stats.generation
+        failures = self._failure_count()
+        rows = self.execute_query(ORDER_STATS_QUERY)
+        if self._failure_count() != failures or not rows:
+            raise RuntimeError("Statistiche ordini non disponibili")
+        state, ttl = OrderStats.build(rows)
+        self.order_stats.load(state, ttl, generation)
+        return self.order_stats.snapshot(state)
 
     def delete_order(self, order_id: int) -> bool:
-        """Elimina un ordine e i suoi item"""
+        """Elimina un ordine e i suoi item, togliendolo dalle vendite aggregate"""
+        select_query = "SELECT status FROM orders WHERE id = %s"
+        if not self.use_sqlite:
+            select_query += " FOR UPDATE"
         query = "DELETE FROM orders WHERE id = %s"
-        return self.execute_update(query, (order_id,))
+        try:
+            with self._transaction('delete_order') as cursor:
+                cursor.execute(self._translate_query(select_query), (order_id,))
+                row = cursor.fetchone()
+                if row is not None and dict(row)['status'] != 'cancelled':
+                    self._apply_sales(cursor, [order_id], -1)
+                cursor.execute(self._translate_query(query), (order_id,))
+                self.active_orders.remove(order_id)
+        except Exception as e:
+            self._record_failure()
+            print(f"✗ Errore eliminazione: {e}")
+            self._reload_active_order(order_id)
+            return False
+        self.active_orders.touch()
+        return True
+
+    # ==================== ARCHIVIO ED EXPORT ====================
+
+    def archive_orders(self, days: int = ORDER_ARCHIVE_DAYS, batch_size: int = ORDER_ARCHIVE_BATCH,
+                       pause: float = 0.0) -> int:
+        """Sposta nell'archivio gli ordini chiusi creati da più di `days` giorni.
+
+        Ogni blocco di al massimo `batch_size` ordini (con i loro item) viene copiato
+        in orders_archive/order_items_archive e cancellato dalle tabelle vive in una
+        sola transazione, così le tabelle lette dal pannello staff restano piccole
+        senza lunghi lock. `pause` sono i secondi di attesa tra un blocco e l'altro.
+        Il limite di età segue l'orologio del database. Ritorna il numero di ordini
+        archiviati; eventuali errori vengono propagati (i blocchi già spostati restano).
+        """
+        if days < 1:
+            raise ValueError("days deve essere almeno 1")
+        batch_size = max(1, min(batch_size, ORDER_ARCHIVE_BATCH))
+        db_now = self.execute_query("SELECT CURRENT_TIMESTAMP AS db_now")[0]['db_now']
+        cutoff = datetime.fromisoformat(str(db_now)) - timedelta(days=days)
+        cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+        statuses = ', '.join(['%s'] * len(CLOSED_ORDER_STATUSES))
+        select_query = f"""
+        SELECT id FROM orders
+        WHERE status IN ({statuses}) AND created_at < %s
+        ORDER BY id
+        LIMIT %s
+        """
+        if not self.use_sqlite:
+            select_query += " FOR UPDATE"
+        archived = 0
+        while True:
+            with self._transaction('archive_orders') as cursor:
+                cursor.execute(self._translate_query(select_query),
+                               (*CLOSED_ORDER_STATUSES, cutoff, batch_size))
+                ids = tuple(dict(row)['id'] for row in cursor.fetchall())
+                if not ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(ids))
+                for query in (
+                    f"INSERT INTO orders_archive ({ORDER_COLUMNS}) "
+                    f"SELECT {ORDER_COLUMNS} FROM orders WHERE id IN ({placeholders})",
+                    f"INSERT INTO order_items_archive ({ORDER_ITEM_COLUMNS}) "
+                    f"SELECT {ORDER_ITEM_COLUMNS} FROM order_items WHERE order_id IN ({placeholders})",
+                    # senza contare su ON DELETE CASCADE (in SQLite le chiavi esterne possono essere spente)
+                    f"DELETE FROM order_items WHERE order_id IN ({placeholders})",
+                    f"DELETE FROM orders WHERE id IN ({placeholders})",
+                ):
+                    cursor.execute(self._translate_query(query), ids)
+            archived += len(ids)
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return archived
+
+    def stream_orders(self, status: str = None, date_from: str = None,
+                      date_to: str = None) -> Iterator[Dict]:
+        """Genera gli ordini con i loro item, dal meno recente, a memoria costante.
+
+        Ordini e item arrivano da un'unica join ordinata letta riga per riga (su MySQL
+        con un cursore lato server, `SSDictCursor`); ogni ordine viene emesso appena
+        letto il suo ultimo item. Gli ordini archiviati sono letti allo stesso modo e
+        uniti in ordine di (created_at, id). Stessi filtri di `get_orders_page`.
+
+        Al massimo `ORDER_EXPORT_MAX_CONCURRENT` export alla volta: oltre, la prima
+        lettura solleva PoolTimeout invece di aspettare.
+        """
+        if not self._export_slots.acquire(blocking=False):
+            raise PoolTimeout(f"Già {ORDER_EXPORT_MAX_CONCURRENT} export in corso, riprovare più tardi")
+        try:
+            yield from self._merge_order_streams(status, date_from, date_to)
+        finally:
+            self._export_slots.release()
+
+    def _merge_order_streams(self, status: str, date_from: str, date_to: str) -> Iterator[Dict]:
+        conditions = []
+        params = []
+        if status:
+            conditions.append("status = %s")
+            params.append(status)
+        if date_from:
+            conditions.append("created_at >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("created_at < %s")
+            params.append(date_to)
+        streams = [self._stream_order_table(tables, conditions, params)
+                   for tables in (('orders', 'order_items'), ('orders_archive', 'order_items_archive'))]
+        return heapq.merge(*streams, key=lambda order: (timestamp_key(order['created_at']), order['id']))
+
+    def _stream_order_table(self, tables: Tuple[str, str], conditions: List[str],
+                            params: List) -> Iterator[Dict]:
+        """Ordini (con item) di una coppia di tabelle ordini/item, raggruppati dalla join.
+
+        Il generatore viene consumato dopo la fine della richiesta e tiene la sua
+        connessione per tutto il download: è una connessione dedicata, aperta fuori
+        dal pool e chiusa alla fine (vedi `_iterate`), così un client lento non toglie
+        connessioni alle altre richieste. Su SQLite senza WAL una lettura lunga bloccherebbe i commit: la query viene
+        ripetuta a pagine di `ORDER_EXPORT_PAGE` ordini (keyset su created_at, id),
+        ognuna letta per intero prima di restituire la connessione.
+        """
+        orders_table, items_table = tables
+        paged = self.use_sqlite and self.write_pool is None
+        operation = 'stream_orders'
+        last = None
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if last:
+                page_conditions.append("(created_at > %s OR (created_at = %s AND id > %s))")
+                page_params.extend([last[0], last[0], last[1]])
+            if paged:
+                page_params.append(ORDER_EXPORT_PAGE)
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            query = self._statement(
+                (operation, orders_table, paged, *page_conditions),
+                lambda: f"""
+            SELECT o.id, o.order_number, o.total_price, o.status, o.created_at, o.updated_at,
+                   oi.id AS item_id, oi.product_id, oi.quantity, oi.price AS item_price,
+                   p.name AS product_name, p.category_id
+            FROM (SELECT {ORDER_COLUMNS} FROM {orders_table} {where}
+                  {'ORDER BY created_at, id LIMIT %s' if paged else ''}) o
+            LEFT JOIN {items_table} oi ON oi.order_id = o.id
+            LEFT JOIN products p ON p.id = oi.product_id
+            ORDER BY o.created_at, o.id, oi.id
+            """)
+
+            started = time.perf_counter()
+            rows = self._fetch_all(query, page_params) if paged else self._iterate(query, page_params)
+            order = None
+            count = 0
+            for row in rows:
+                if order is None or row['id'] != order['id']:
+                    if order is not None:
+                        yield order
+                    count += 1
+                    order = {key: row[key] for key in
+                             ('id', 'order_number', 'total_price', 'status', 'created_at', 'updated_at')}
+                    order['items'] = []
+                if row['item_id'] is not None:
+                    order['items'].append({
+                        'id': row['item_id'], 'order_id': row['id'], 'product_id': row['product_id'],
+                        'quantity': row['quantity'], 'price': row['item_price'],
+                        'name': row['product_name'], 'category_id': row['category_id'],
+                    })
+            if order is not None:
+                yield order
+            self._observe(operation, 'query', started, count)
+            if not paged or count < ORDER_EXPORT_PAGE:
+                return
+            last = (order['created_at'], order['id'])
+
+    def _fetch_all(self, query: str, params: List) -> List[Dict]:
+        conn = self.pool.acquire()
+        try:
+            rows = conn.execute(self._translate_query(query), tuple(params)).fetchall()
+        except Exception:
+            self.pool.release(conn, discard=True)
+            raise
+        self.pool.release(conn)
+        return [dict(row) for row in rows]
+
+    def _iterate(self, query: str, params: List) -> Iterator[Dict]:
+        """Righe di una query lette una alla volta su una connessione dedicata all'export.
+
+        La connessione viene sempre chiusa alla fine invece di tornare nel pool: il
+        `net_write_timeout` allungato resta legato a lei, e su MySQL chiudere solo il
+        cursore a export interrotto leggerebbe tutte le righe rimaste.
+        """
+        conn = self._export_factory()
+        try:
+            if self.use_sqlite:
+                cursor = conn.cursor()
+            else:
+                with conn.cursor() as setup:
+                    setup.execute("SET SESSION net_write_timeout = %s", (ORDER_EXPORT_WRITE_TIMEOUT,))
+                cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute(self._translate_query(query), tuple(params))
+            for row in cursor:
+                yield dict(row)
+        finally:
+            ConnectionPool._close(conn)
+
+    # ==================== VENDITE ====================
+
+    def _apply_sales(self, cursor, order_ids: List[int], sign: int) -> None:
+        """Aggiunge (sign=1) o toglie (sign=-1) gli ordini dalle vendite, nella transazione in corso"""
+        self._run_steps(cursor, apply_sales_steps(self, order_ids, sign))
+
+    def backfill_sales_rollups(self, window_days: int = SALES_BACKFILL_WINDOW) -> int:
+        """Ricalcola sales_rollups da tutto lo storico, ordini archiviati compresi.
+
+        Lo storico viene diviso in finestre di `window_days` giorni; ogni finestra è
+        una transazione che cancella le proprie righe e le riscrive con un INSERT ...
+        SELECT aggregato per tabella (nessun ciclo per ordine in Python). Il backfill
+        può girare con il server attivo: una finestra già ricalcolata riceve gli
+        aggiornamenti incrementali, una non ancora ricalcolata verrà riscritta dai
+        dati di origine. Ritorna il numero di finestre ricalcolate.
+        """
+        if window_days < 1:
+            raise ValueError("window_days deve essere almeno 1")
+        bounds = self.execute_query("""
+        SELECT MIN(first_order) AS first_order, MAX(db_now) AS db_now
+        FROM (SELECT MIN(created_at) AS first_order, CURRENT_TIMESTAMP AS db_now FROM orders
+              UNION ALL
+              SELECT MIN(created_at), CURRENT_TIMESTAMP FROM orders_archive) b
+        """, operation='backfill_sales_rollups')
+        if not bounds:
+            raise RuntimeError("Storico ordini non disponibile")
+        first_order, db_now = bounds[0]['first_order'], bounds[0]['db_now']
+        if first_order is None:
+            with self._transaction('backfill_sales_rollups') as cursor:
+                cursor.execute("DELETE FROM sales_rollups")
+            return 0
+
+        start = datetime.fromisoformat(str(first_order)[:10])
+        end = datetime.fromisoformat(str(db_now)[:10]) + timedelta(days=1)
+        where = "o.status <> 'cancelled' AND o.created_at >= %s AND o.created_at < %s"
+        inserts = [self._statement(('backfill_sales', tables),
+                                   lambda: sales_rollup_query(self.use_sqlite, *tables, where))
+                   for tables in (('orders', 'order_items'), ('orders_archive', 'order_items_archive'))]
+        delete_query = "DELETE FROM sales_rollups WHERE hour >= %s AND hour < %s"
+
+        with self._transaction('backfill_sales_rollups') as cursor:
+            # righe rimaste fuori dallo storico attuale (es. ordini eliminati)
+            cursor.execute(self._translate_query("DELETE FROM sales_rollups WHERE hour < %s OR hour >= %s"),
+                           (timestamp_key(start), timestamp_key(end)))
+        windows = 0
+        while start < end:
+            window_end = min(start + timedelta(days=window_days), end)
+            bounds = (timestamp_key(start), timestamp_key(window_end))
+            with self._transaction('backfill_sales_rollups') as cursor:
+                cursor.execute(self._translate_query(delete_query), bounds)
+                for query in inserts:
+                    cursor.execute(query, (1, 1, 1, *bounds) * 3)
+            windows += 1
+            start = window_end
+        return windows
+
+    def get_sales(self, group_by: str, date_from: str = None, date_to: str = None) -> Dict:
+        """Vendite aggregate da sales_rollups per prodotto, categoria, ora o giorno.
+
+        `date_from` è incluso e `date_to` escluso, entrambi arrotondati all'ora (la
+        granularità delle righe). Ritorna le righe (con ordini, quantità, incasso e
+        scontrino medio, cioè incasso diviso ordini) e i totali del periodo.
+        """
+        if group_by not in SALES_GROUPS:
+            raise ValueError(f"group_by deve essere uno tra: {', '.join(SALES_GROUPS)}")
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("r.hour >= %s")
+            params.append(date_from[:13] + ':00:00')
+        if date_to:
+            conditions.append("r.hour < %s")
+            params.append(date_to[:13] + ':00:00')
+        dimension, select, join, group, order = SALES_GROUPS[group_by]
+        totals = "SUM(r.orders) AS orders, SUM(r.quantity) AS quantity, SUM(r.revenue) AS revenue"
+        where = ' AND '.join(["r.dimension = %s", *conditions])
+        query = self._statement(
+            ('get_sales', group_by, *conditions),
+            lambda: f"""
+        SELECT {select}, {totals}
+        FROM sales_rollups r
+        {join}
+        WHERE {where}
+        GROUP BY {group}
+        HAVING SUM(r.orders) > 0
+        ORDER BY {order}
+        """)
+        total_query = self._statement(
+            ('get_sales_totals', *conditions),
+            lambda: f"SELECT {totals} FROM sales_rollups r WHERE {where}")
+
+        failures = self._failure_count()
+        rows = self.execute_query(query, (dimension, *params))
+        summary = self.execute_query(total_query, ('hour', *params))
+        if self._failure_count() != failures:
+            raise RuntimeError("Vendite non disponibili")
+        return {'rows': [_sales_row(row) for row in rows], 'totals': _sales_row(summary[0])}
+
+    # ==================== ORDINI ATTIVI ====================
+
+    def _fetch_orders(self, cursor, order_ids: List[int]) -> List[Dict]:
+        """Rilegge ordini e item nella transazione in corso (stessi campi delle letture normali)"""
+        return self._run_steps(cursor, fetch_orders_steps(self, order_ids))
+
+    def _query_active_orders(self) -> Optional[List[Dict]]:
+        """Ordini attivi con i loro item dal database; None se una query fallisce"""
+        failures = self._failure_count()
+        query = self._statement(
+            ('active_orders',),
+            lambda: f"""
+        SELECT * FROM orders
+        WHERE status IN ({', '.join(['%s'] * len(ACTIVE_ORDER_STATUSES))})
+        """)
+        orders = self.execute_query(query, ACTIVE_ORDER_STATUSES, operation='load_active_orders')
+        items = self.get_items_for_orders([order['id'] for order in orders])
+        if self._failure_count() != failures:
+            return None
+        return [{**order, 'items': items[order['id']]} for order in orders]
+
+    def load_active_orders(self, attempts: int = 3) -> int:
+        """Carica (o ricostruisce) la vista in memoria degli ordini attivi.
+
+        Se durante la lettura un ordine viene scritto il caricamento viene scartato
+        e ripetuto (al massimo `attempts` volte). Ritorna il numero di ordini caricati;
+        solleva RuntimeError se la vista non è stata installata.
+        """
+        for _ in range(attempts):
+            generation = self.active_orders.generation
+            orders = self._query_active_orders()
+            if orders is None:
+                raise RuntimeError("Ordini attivi non disponibili")
+            if self.active_orders.load(orders, generation):
+                return len(orders)
+        raise RuntimeError("Ordini attivi modificati durante il caricamento, riprovare")
+
+    def check_active_orders(self) -> Dict:
+        """Confronta la vista in memoria con il database.
+
+        Ritorna gli id mancanti nella vista, quelli presenti solo nella vista e quelli
+        con stato, totale, `updated_at` o item diversi. Una scrittura concorrente può
+        dare una differenza momentanea: in quel caso basta ripetere il controllo.
+        """
+        view = self.active_orders.snapshot()
+        if view is None:
+            raise RuntimeError("Vista degli ordini attivi non caricata")
+        orders = self._query_active_orders()
+        if orders is None:
+            raise RuntimeError("Ordini attivi non disponibili")
+
+        def fingerprint(order):
+            return (order['status'], timestamp_key(order['updated_at']), Decimal(str(order['total_price'])),
+                    [(item['product_id'], item['quantity'], Decimal(str(item['price'])))
+                     for item in order['items']])
+
+        stored = {order['id']: order for order in orders}
+        missing = sorted(set(stored) - set(view))
+        unexpected = sorted(set(view) - set(stored))
+        mismatched = sorted(order_id for order_id in set(stored) & set(view)
+                            if fingerprint(stored[order_id]) != fingerprint(view[order_id]))
+        return {
+            'checked': len(stored),
+            'missing': missing,
+            'unexpected': unexpected,
+            'mismatched': mismatched,
+            'consistent': not (missing or unexpected or mismatched),
+        }
+
+
+def main(argv: List[str] = None) -> int:
+    """Riga di comando per le operazioni sul database da eseguire al deploy"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gestione dello schema e manutenzione del database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help="applica le migrazioni mancanti")
+    migrate_parser.add_argument('--to', type=int, default=None, help="versione di arrivo")
+    commands.add_parser('status', help="mostra la versione dello schema")
+    archive_parser = commands.add_parser('archive', help="sposta nell'archivio gli ordini chiusi")
+    archive_parser.add_argument('--days', type=int, default=ORDER_ARCHIVE_DAYS,
+                                help="età minima in giorni degli ordini da archiviare")
+    archive_parser.add_argument('--batch', type=int, default=ORDER_ARCHIVE_BATCH,
+                                help="ordini spostati per transazione")
+    archive_parser.add_argument('--pause', type=float, default=0.0,
+                                help="secondi di attesa tra due blocchi")
+    backfill_parser = commands.add_parser('backfill-sales', help="ricalcola le vendite aggregate dallo storico")
+    backfill_parser.add_argument('--window-days', type=int, default=SALES_BACKFILL_WINDOW,
+                                 help="giorni di storico ricalcolati per transazione")
+    args = parser.parse_args(argv)
+
+    db = DatabaseWrapper()
+    db.connect()
+    try:
+        if args.command == 'migrate':
+            applied = db.migrate(target=args.to)
+            if not applied:
+                print("→ Schema già aggiornato")
+        elif args.command == 'archive':
+            db.init_schema()
+            archived = db.archive_orders(args.days, args.batch, args.pause)
+            print(f"✓ {archived} ordini archiviati")
+        elif args.command == 'backfill-sales':
+            db.init_schema()
+            started = time.perf_counter()
+            windows = db.backfill_sales_rollups(args.window_days)
+            print(f"✓ Vendite ricalcolate ({windows} finestre) in {time.perf_counter() - started:.2f}s")
+        else:
+            db.init_schema()
+            print(f"Versione schema: {db.get_schema_version()}")
+            for version, description in db.pending_migrations():
+                print(f"  da applicare: {version} - {description}")
+        return 0
+    except Exception as e:
+        print(f"✗ Errore {args.command}: {e}")
+        return 1
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
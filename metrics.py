@@ -0,0 +1,126 @@
+"""
+Metrics - Istogrammi e contatori in memoria esposti in formato testo Prometheus
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+import threading
+
+# limiti superiori (in secondi) dei bucket degli istogrammi di latenza
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """Raccoglie le metriche dell'applicazione.
+
+    Registrare un valore costa un lock e una ricerca binaria sui bucket; il testo
+    per Prometheus viene costruito solo quando qualcuno legge `/api/metrics`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # nome -> (help, label, bucket, {valori label: [conteggi, somma]})
+        self._counters = {}    # nome -> (help, label, {valori label: totale})
+        self._collectors = []  # funzioni che producono gauge al momento della lettura
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...],
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self._histograms.setdefault(name, (help_text, labels, buckets, {}))
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...]) -> None:
+        self._counters.setdefault(name, (help_text, labels, {}))
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict, float]]]) -> None:
+        """Registra una funzione che ritorna gauge (nome, help, label, valore) da leggere on demand"""
+        self._collectors.append(collector)
+
+    def observe(self, name: str, label_values: Tuple, value: float) -> None:
+        _, _, buckets, series = self._histograms[name]
+        index = bisect_left(buckets, value)
+        with self._lock:
+            entry = series.get(label_values)
+            if entry is None:
+                entry = series[label_values] = [[0] * (len(buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def inc(self, name: str, label_values: Tuple, amount: float = 1) -> None:
+        series = self._counters[name][2]
+        with self._lock:
+            series[label_values] = series.get(label_values, 0) + amount
+
+    def render(self) -> str:
+        """Ritorna tutte le metriche nel formato di esposizione testuale di Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            histograms = [(name, help_text, labels, buckets,
+                           {k: ([*v[0]], v[1]) for k, v in series.items()})
+                          for name, (help_text, labels, buckets, series) in self._histograms.items()]
+            counters = [(name, help_text, labels, dict(series))
+                        for name, (help_text, labels, series) in self._counters.items()]
+
+        for name, help_text, labels, buckets, series in histograms:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for label_values, (counts, total) in sorted(series.items()):
+                base = _format_labels(labels, label_values)
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_with_le(base, repr(bound))} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{name}_bucket{_with_le(base, '+Inf')} {cumulative}")
+                lines.append(f"{name}_sum{base} {total}")
+                lines.append(f"{name}_count{base} {cumulative}")
+
+        for name, help_text, labels, series in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for label_values, total in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels, label_values)} {total}")
+
+        gauges = {}
+        for collector in self._collectors:
+            for name, help_text, label_map, value in collector():
+                gauges.setdefault(name, (help_text, []))[1].append((label_map, value))
+        for name, (help_text, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for label_map, value in samples:
+                labels = tuple(label_map)
+                lines.append(f"{name}{_format_labels(labels, tuple(label_map.values()))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+def _with_le(base: str, bound: str) -> str:
+    if base:
+        return base[:-1] + f',le="{bound}"}}'
+    return f'{{le="{bound}"}}'
+
+
+# registro condiviso dall'app e da DatabaseWrapper
+registry = MetricsRegistry()
+
+registry.histogram('db_query_duration_seconds',
+                   "Durata delle operazioni sul database", ('operation', 'kind'))
+registry.counter('db_query_errors_total',
+                 "Operazioni sul database fallite", ('operation', 'kind'))
+registry.counter('db_rows_total',
+                 "Righe lette (query) o modificate (insert/update)", ('operation', 'kind'))
+registry.histogram('http_request_duration_seconds',
+                   "Durata delle richieste HTTP per rotta", ('method', 'route', 'status'))
+registry.counter('order_queue_committed_total',
+                 "Ordini scritti nel database dalla coda di scrittura", ())
+registry.histogram('order_queue_batch_size',
+                   "Ordini scritti con un solo commit dalla coda di scrittura", (),
+                   buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
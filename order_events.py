@@ -0,0 +1,105 @@
+"""
+OrderEventBroker - Distribuisce in tempo reale le modifiche agli ordini (Server-Sent Events)
+"""
+from collections import deque
+from typing import List, Optional, Tuple
+import asyncio
+import threading
+import time
+
+
+class OrderEvent:
+    """Evento già serializzato nel formato text/event-stream"""
+
+    __slots__ = ('seq', 'payload')
+
+    def __init__(self, seq: int, payload: bytes):
+        self.seq = seq
+        self.payload = payload
+
+
+class OrderEventBroker:
+    """Tiene in memoria gli ultimi eventi sugli ordini e sveglia gli abbonati.
+
+    Gli eventi hanno un id `<avvio>-<progressivo>`: un client che si riconnette con
+    `Last-Event-ID` riceve solo quelli successivi. Se l'id appartiene a un avvio
+    precedente del server o è uscito dallo storico, il client riceve un evento
+    `reset` e deve ricaricare la lista completa. Gli abbonati non usano connessioni
+    al database: leggono solo da questo buffer. Gli abbonati possono essere thread
+    (`wait_for_events`) o coroutine della modalità ASGI (`wait_for_events_async`).
+    Il buffer è del singolo processo: vede solo le scritture fatte dal processo stesso.
+    """
+
+    def __init__(self, history: int = 500):
+        self.boot_id = format(int(time.time()), 'x')
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # coppie (event loop, future) delle coroutine in attesa
+
+    def publish(self, event_type: str, data: str) -> str:
+        """Pubblica un evento (data è il JSON già serializzato) e ritorna il suo id"""
+        with self._cond:
+            self._seq += 1
+            event_id = f"{self.boot_id}-{self._seq}"
+            payload = f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n".encode('utf-8')
+            self._events.append(OrderEvent(self._seq, payload))
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        return event_id
+
+    def resume_point(self, last_event_id: Optional[str]) -> Tuple[int, bool]:
+        """Converte un Last-Event-ID nel progressivo da cui ripartire.
+
+        Ritorna (progressivo, reset): se reset è True il client ha perso eventi e
+        deve ricaricare lo stato completo.
+        """
+        with self._cond:
+            current = self._seq
+            oldest = self._events[0].seq if self._events else current + 1
+        if not last_event_id:
+            return current, False
+        boot_id, _, seq = last_event_id.partition('-')
+        if boot_id != self.boot_id or not seq.isdigit():
+            return current, True
+        seq = int(seq)
+        if seq > current or seq + 1 < oldest:
+            return current, True
+        return seq, False
+
+    def wait_for_events(self, after_seq: int, timeout: float) -> List[OrderEvent]:
+        """Attende (al massimo `timeout` secondi) gli eventi successivi a `after_seq`"""
+        with self._cond:
+            if self._seq <= after_seq:
+                self._cond.wait(timeout)
+            if self._seq <= after_seq:
+                return []
+            return [event for event in self._events if event.seq > after_seq]
+
+    async def wait_for_events_async(self, after_seq: int, timeout: float) -> List[OrderEvent]:
+        """Come `wait_for_events`, ma attende senza occupare un thread"""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self._cond:
+            pending = self._seq <= after_seq
+            if pending:
+                self._async_waiters.add((loop, waiter))
+        if pending:
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard((loop, waiter))
+        with self._cond:
+            if self._seq <= after_seq:
+                return []
+            return [event for event in self._events if event.seq > after_seq]
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
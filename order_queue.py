@@ -0,0 +1,219 @@
+"""
+OrderQueue - Coda di scrittura (write-behind) durevole per i nuovi ordini
+
+Con ORDER_INGEST=queue `POST /api/orders` non aspetta la transazione sul database:
+l'ordine validato, con id e numero già assegnati, viene scritto in un journal
+SQLite locale (WAL, synchronous=FULL) e la risposta parte subito. Un thread
+scrittore svuota il journal nel database a blocchi, con un solo commit per blocco
+(group commit). Al riavvio il journal viene riletto, quindi un ordine confermato
+al totem non va perso anche se il processo si ferma prima di averlo scritto.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import json
+import sqlite3
+import threading
+import time
+
+import pymysql
+
+from database_wrapper import OrderConflict
+from metrics import registry as metrics
+
+# attesa massima tra due tentativi di scrittura quando il database non risponde
+MAX_RETRY_DELAY = 30.0
+
+# errori dovuti all'ordine stesso: riprovare non serve (gli altri sono transitori)
+PERMANENT_ERRORS = (sqlite3.IntegrityError, pymysql.err.IntegrityError, pymysql.err.DataError, OrderConflict)
+
+
+class OrderQueue:
+    """Journal locale degli ordini accettati ma non ancora scritti nel database.
+
+    Gli ordini in coda restano visibili in memoria (`get`, `pending`) finché il
+    commit sul database non è avvenuto, così le rotte di lettura li vedono subito.
+    Se il database non risponde la coda riprova con attesa crescente. Un blocco
+    rifiutato per un errore di integrità viene riprovato ordine per ordine: quelli
+    rifiutati anche da soli restano nel journal marcati come falliti (da recuperare
+    a mano) invece di bloccare la coda.
+    """
+
+    def __init__(self, db, path: str, batch_size: int = 200):
+        self.db = db
+        self.path = path
+        self.batch_size = min(batch_size, 500)
+        self._pending = OrderedDict()  # id -> ordine (con item) non ancora nel database
+        self._cond = threading.Condition()
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._replayed = set()
+        self.failed = 0
+        metrics.add_collector(self._gauges)
+
+    # ==================== JOURNAL ====================
+
+    def _open_journal(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # ogni conferma al totem deve sopravvivere a un crash del sistema
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS queued_orders (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                failed INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        """)
+        self._journal = conn
+
+    def start(self) -> int:
+        """Apre il journal, ripristina gli ordini rimasti in coda e avvia lo scrittore.
+
+        Ritorna il numero di ordini ripristinati; il primo tentativo di scriverli
+        avviene subito, prima che il server accetti traffico.
+        """
+        self._open_journal()
+        with self._journal_lock:
+            rows = self._journal.execute(
+                "SELECT payload FROM queued_orders WHERE failed = 0 ORDER BY id").fetchall()
+            self.failed = self._journal.execute(
+                "SELECT COUNT(*) FROM queued_orders WHERE failed = 1").fetchone()[0]
+        with self._cond:
+            for (payload,) in rows:
+                order = json.loads(payload)
+                self._pending[order['id']] = order
+                self._replayed.add(order['id'])
+        if rows:
+            print(f"→ {len(rows)} ordini ripristinati dalla coda, scrittura nel database")
+            self._drain_once()
+        if self.failed:
+            print(f"⚠ {self.failed} ordini falliti nel journal {self.path}")
+        self._thread = threading.Thread(target=self._run, name='order-queue-writer', daemon=True)
+        self._thread.start()
+        return len(rows)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Ferma lo scrittore dopo un ultimo tentativo di svuotare la coda"""
+        if not self._thread:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+        with self._journal_lock:
+            self._journal.close()
+
+    def enqueue(self, order: Dict) -> None:
+        """Scrive l'ordine nel journal (durevole al ritorno) e lo rende visibile alle letture"""
+        payload = json.dumps(order, default=str)
+        with self._journal_lock:
+            self._journal.execute("INSERT INTO queued_orders (id, payload) VALUES (?, ?)",
+                                  (order['id'], payload))
+        with self._cond:
+            self._pending[order['id']] = order
+            self._cond.notify_all()
+
+    # ==================== LETTURE ====================
+
+    def get(self, order_id: int) -> Optional[Dict]:
+        with self._cond:
+            order = self._pending.get(order_id)
+            return dict(order, items=list(order['items'])) if order else None
+
+    def pending(self) -> List[Dict]:
+        """Copia degli ordini ancora in coda, dal meno recente"""
+        with self._cond:
+            return [dict(order, items=list(order['items'])) for order in self._pending.values()]
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def wait_committed(self, order_id: int, timeout: float) -> bool:
+        """Aspetta che l'ordine sia scritto nel database; False se è ancora in coda"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while order_id in self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _gauges(self):
+        yield ('order_queue_depth', "Ordini accettati in attesa di scrittura", {}, self.depth())
+        yield ('order_queue_failed', "Ordini falliti rimasti nel journal", {}, self.failed)
+
+    # ==================== SCRITTORE ====================
+
+    def _run(self) -> None:
+        delay = 0.0
+        while True:
+            with self._cond:
+                retry_at = time.monotonic() + delay
+                while not self._stopping and (not self._pending or time.monotonic() < retry_at):
+                    self._cond.wait(max(0.0, retry_at - time.monotonic()) if self._pending else None)
+                stopping = self._stopping
+            ok = self._drain_once()
+            if stopping:
+                return
+            # il database non risponde: si riprova con attesa crescente
+            delay = 0.0 if ok else min(MAX_RETRY_DELAY, max(0.5, delay * 2))
+
+    def _drain_once(self) -> bool:
+        """Scrive nel database tutto ciò che è in coda, a blocchi; False se il database non risponde"""
+        while True:
+            with self._cond:
+                batch = list(self._pending.values())[:self.batch_size]
+            if not batch:
+                return True
+            try:
+                self._commit(batch)
+            except Exception as e:
+                if len(batch) == 1 or not isinstance(e, PERMANENT_ERRORS):
+                    if not self._handle_failure(batch, e):
+                        return False
+                    continue
+                # un ordine non valido non deve bloccare gli altri: si riprova uno per uno
+                for order in batch:
+                    try:
+                        self._commit([order])
+                    except Exception as single_error:
+                        if not self._handle_failure([order], single_error):
+                            return False
+
+    def _commit(self, batch: List[Dict]) -> None:
+        self.db.create_orders_batch(batch)
+        ids = [order['id'] for order in batch]
+        with self._journal_lock:
+            self._journal.executemany("DELETE FROM queued_orders WHERE id = ?", [(i,) for i in ids])
+        self._remove(ids)
+        metrics.inc('order_queue_committed_total', (), len(ids))
+        metrics.observe('order_queue_batch_size', (), len(ids))
+        if self._replayed.intersection(ids):
+            # i contatori della dashboard sono stati ricostruiti senza gli ordini ripristinati
+            self._replayed.difference_update(ids)
+            self.db.order_stats.invalidate()
+
+    def _handle_failure(self, batch: List[Dict], error: Exception) -> bool:
+        """Ritorna False se conviene smettere e riprovare più tardi"""
+        if not isinstance(error, PERMANENT_ERRORS):
+            print(f"✗ Errore scrittura coda ordini ({len(batch)} in attesa): {error}")
+            return False
+        order = batch[0]
+        print(f"✗ Ordine {order['order_number']} non scrivibile, lasciato nel journal: {error}")
+        with self._journal_lock:
+            self._journal.execute("UPDATE queued_orders SET failed = 1, error = ? WHERE id = ?",
+                                  (str(error), order['id']))
+        self.failed += 1
+        self._remove([order['id']])
+        return True
+
+    def _remove(self, ids: List[int]) -> None:
+        with self._cond:
+            for order_id in ids:
+                self._pending.pop(order_id, None)
+            self._cond.notify_all()
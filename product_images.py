@@ -0,0 +1,176 @@
+"""
+Product images - Archivio locale delle immagini dei prodotti in formati pronti
+
+Lo staff carica l'immagine originale una volta (`POST /api/products/<id>/image`);
+qui viene decodificata e ridotta subito nelle varianti che servono ai client
+(`thumb` per carrello e pannello staff, `totem` per le schede del menu), in WebP.
+I file hanno nomi derivati dal contenuto (`<digest>-<variante>.webp`, dove il
+digest è lo SHA-256 dell'originale e delle impostazioni delle varianti) e non
+vengono mai riscritti: lo stesso URL indica sempre gli stessi byte, quindi i
+client possono tenerli in cache per sempre (`Cache-Control: immutable`) e una
+nuova immagine arriva con un URL nuovo.
+
+Pillow è una dipendenza opzionale: senza, il caricamento risponde con un errore
+mentre le immagini già presenti continuano a essere servite.
+"""
+from typing import Dict, List, Optional
+import hashlib
+import io
+import os
+import re
+import tempfile
+from dotenv import load_dotenv
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+# cartella dei file e URL sotto cui vengono serviti (vedi `GET /api/images/<name>`)
+IMAGE_STORE_PATH = os.getenv('IMAGE_STORE_PATH', 'images')
+IMAGE_URL_PREFIX = '/api/images/'
+
+# lato massimo in pixel di ogni variante; `totem` è quella salvata in products.image_url
+IMAGE_VARIANTS = {
+    'thumb': int(os.getenv('IMAGE_THUMB_SIZE', 160)),
+    'totem': int(os.getenv('IMAGE_TOTEM_SIZE', 480)),
+}
+IMAGE_MAIN_VARIANT = 'totem'
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 80))
+
+# limiti sull'originale caricato (dimensione del file e pixel dopo la decodifica)
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 8 * 1024 * 1024))
+IMAGE_MAX_PIXELS = 40_000_000
+
+# i file servono immutati per un anno: un'immagine diversa ha un nome diverso
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+if Image is not None:
+    # Pillow solleva DecompressionBombError solo sopra il doppio del limite: il limite
+    # vero viene controllato in ImageStore._open, prima di decodificare
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    # WebP se Pillow è compilato con libwebp, altrimenti JPEG/PNG
+    IMAGE_FORMAT = 'webp' if features.check('webp') else None
+else:
+    IMAGE_FORMAT = None
+
+IMAGE_NAME = re.compile(r'^[0-9a-f]{32}-(%s)\.(webp|jpg|png)$' % '|'.join(IMAGE_VARIANTS))
+
+
+class ImageStore:
+    """Varianti ridimensionate delle immagini dei prodotti, salvate su disco per digest"""
+
+    def __init__(self, path: str = IMAGE_STORE_PATH):
+        self.path = path
+
+    def save(self, data: bytes) -> Dict[str, str]:
+        """Crea le varianti di un'immagine e ritorna {variante: URL}.
+
+        Solleva ValueError se i byte non sono un'immagine valida e RuntimeError se
+        Pillow non è installato. Se lo stesso originale è già stato caricato i file
+        esistenti vengono riusati senza ricodificarli.
+        """
+        if Image is None:
+            raise RuntimeError("Pillow non installato: impossibile elaborare le immagini")
+        spec = f"{sorted(IMAGE_VARIANTS.items())}:{IMAGE_QUALITY}:{IMAGE_FORMAT}".encode()
+        digest = hashlib.sha256(spec + b'\0' + data).hexdigest()[:32]
+        existing = self._existing(digest)
+        if existing:
+            return existing
+
+        source = self._open(data)
+        os.makedirs(self.path, exist_ok=True)
+        urls = {}
+        # dalla variante più grande alla più piccola, ognuna ridotta dalla precedente
+        for variant, size in sorted(IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+            source.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+            body, extension = self._encode(source)
+            name = f"{digest}-{variant}.{extension}"
+            self._write(name, body)
+            urls[variant] = IMAGE_URL_PREFIX + name
+        return urls
+
+    def _existing(self, digest: str) -> Optional[Dict[str, str]]:
+        """URL delle varianti già su disco per questo digest (None se ne manca qualcuna)"""
+        urls = {}
+        for variant in IMAGE_VARIANTS:
+            for extension in ('webp', 'jpg', 'png'):
+                name = f"{digest}-{variant}.{extension}"
+                if os.path.exists(os.path.join(self.path, name)):
+                    urls[variant] = IMAGE_URL_PREFIX + name
+                    break
+            else:
+                return None
+        return urls
+
+    def _open(self, data: bytes):
+        """Decodifica l'originale, raddrizzato secondo l'EXIF, in RGB o RGBA"""
+        try:
+            image = Image.open(io.BytesIO(data))
+            # l'intestazione basta per le dimensioni: i pixel non sono ancora decodificati
+            if image.width * image.height > IMAGE_MAX_PIXELS:
+                raise Image.DecompressionBombError(image.width * image.height)
+            # JPEG: decodifica direttamente a una scala ridotta se l'originale è molto grande
+            largest = max(IMAGE_VARIANTS.values())
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        except Image.DecompressionBombError:
+            raise ValueError(f"Immagine troppo grande (massimo {IMAGE_MAX_PIXELS} pixel)")
+        except (OSError, SyntaxError, ValueError):
+            raise ValueError("File non riconosciuto come immagine")
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        return image.convert('RGBA' if transparent else 'RGB')
+
+    def _encode(self, image) -> tuple:
+        buffer = io.BytesIO()
+        if IMAGE_FORMAT == 'webp':
+            image.save(buffer, 'WEBP', quality=IMAGE_QUALITY, method=6)
+            return buffer.getvalue(), 'webp'
+        if image.mode == 'RGBA':
+            image.save(buffer, 'PNG', optimize=True)
+            return buffer.getvalue(), 'png'
+        image.save(buffer, 'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+        return buffer.getvalue(), 'jpg'
+
+    def _write(self, name: str, body: bytes) -> None:
+        """Scrive il file in modo atomico; un file già presente non viene toccato"""
+        target = os.path.join(self.path, name)
+        if os.path.exists(target):
+            return
+        fd, temp = tempfile.mkstemp(dir=self.path, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(body)
+            # leggibile anche da un reverse proxy che serva direttamente la cartella
+            os.chmod(temp, 0o644)
+            os.replace(temp, target)
+        except Exception:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+
+
+def image_variants(image_url: Optional[str]) -> Optional[Dict[str, str]]:
+    """URL di tutte le varianti a partire da quello salvato in products.image_url.
+
+    Per un URL esterno (immagini inserite prima dell'archivio locale) ogni variante
+    è l'URL stesso; None se il prodotto non ha immagine.
+    """
+    if not image_url:
+        return None
+    name = image_url[len(IMAGE_URL_PREFIX):] if image_url.startswith(IMAGE_URL_PREFIX) else ''
+    match = IMAGE_NAME.match(name)
+    if not match:
+        return {variant: image_url for variant in IMAGE_VARIANTS}
+    return {variant: image_url.replace(f"-{match.group(1)}.", f"-{variant}.")
+            for variant in IMAGE_VARIANTS}
+
+
+def with_image_variants(rows: List[Dict]) -> List[Dict]:
+    """Aggiunge `images` ({variante: URL}) alle righe dei prodotti"""
+    for row in rows:
+        row['images'] = image_variants(row.get('image_url'))
+    return rows
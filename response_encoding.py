@@ -0,0 +1,146 @@
+"""
+Response encoding - Serializzazione JSON veloce e compressione delle risposte
+
+`FastJSONProvider` sostituisce il provider JSON di Flask/Quart: usa orjson se
+installato (altrimenti il modulo json della libreria standard) e serializza
+direttamente `Decimal` (come numero) e `datetime` (ISO 8601), i tipi che arrivano
+da MySQL. Le risposte più grandi di `COMPRESS_MIN_SIZE` vengono compresse con
+brotli (se installato) o gzip, secondo l'`Accept-Encoding` del client; i payload
+statici già serializzati (il menu) vengono compressi una volta sola.
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional, Tuple
+import gzip
+import json
+import os
+import threading
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# soglia in byte sotto la quale la compressione non conviene
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', '1') != '0'
+
+# codifiche in ordine di preferenza del server (a parità di qualità richiesta dal client)
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'}
+
+# livelli per le risposte dinamiche (compresse a ogni richiesta) e per quelle statiche
+# (compresse una volta e riutilizzate, quindi conviene il livello massimo)
+DYNAMIC_LEVELS = {'br': 2, 'gzip': 3}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def _default(value):
+    """Tipi non JSON nativi che arrivano dal database"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Oggetto di tipo {type(value).__name__} non serializzabile in JSON")
+
+
+class FastJSONProvider(JSONProvider):
+    """Provider JSON per `app.json` basato su orjson (stdlib come ripiego).
+
+    Rispetto al provider di default l'output è compatto e in UTF-8, i `Decimal`
+    diventano numeri e le date stringhe ISO 8601, uguali con MySQL e con SQLite.
+    """
+
+    def encode(self, obj) -> bytes:
+        """Serializza direttamente in bytes (senza passare da str)"""
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=_default, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self.encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype='application/json')
+
+
+def negotiate_encoding(accept_encodings) -> Optional[str]:
+    """Codifica da usare secondo l'header Accept-Encoding già interpretato dalla richiesta"""
+    if not RESPONSE_COMPRESSION:
+        return None
+    return accept_encodings.best_match(SUPPORTED_ENCODINGS)
+
+
+def compress(body: bytes, encoding: str, levels=DYNAMIC_LEVELS) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=levels['br'])
+    # mtime=0: stesso input, stessi byte (utile per gli ETag)
+    return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+
+
+def compressible(response) -> bool:
+    """True se la risposta ha un corpo già completo abbastanza grande da comprimere.
+
+    Le risposte in streaming (SSE, export) non hanno `content_length` e vengono saltate.
+    """
+    return (response.status_code == 200
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and response.content_length is not None
+            and response.content_length >= COMPRESS_MIN_SIZE)
+
+
+class CompressedPayloads:
+    """Varianti compresse dei payload statici, indicizzate per (etag, codifica).
+
+    L'ETag identifica il contenuto, quindi una variante non può mai diventare
+    obsoleta: basta limitare il numero di voci (le meno usate vengono scartate).
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def get(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                return compressed
+        compressed = compress(body, encoding, STATIC_LEVELS)
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return compressed
+
+
+compressed_payloads = CompressedPayloads()
+
+
+def encode_static_payload(body: bytes, etag: str, accept_encodings) -> Tuple[bytes, str, Optional[str]]:
+    """Ritorna (corpo, etag, codifica) per un payload statico già serializzato.
+
+    Ogni codifica ha un proprio ETag forte, come richiesto per rappresentazioni diverse.
+    """
+    encoding = negotiate_encoding(accept_encodings) if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        return body, etag, None
+    return compressed_payloads.get(etag, encoding, body), f"{etag}-{encoding}", encoding
@@ -0,0 +1,28 @@
+"""
+Fixture comuni dei test: ogni test lavora su un file SQLite temporaneo, mai su MySQL
+"""
+import os
+import sys
+
+# prima di importare i moduli del backend: load_dotenv non sovrascrive le variabili
+# già impostate, quindi il DB_HOST del file .env non viene usato
+os.environ['DB_HOST'] = ''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from database_wrapper import DatabaseWrapper
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Wrapper sincrono su un database SQLite vuoto, con schema, migrazioni e un prodotto"""
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'test.db'))
+    wrapper = DatabaseWrapper()
+    wrapper.connect()
+    wrapper.init_schema()
+    wrapper.migrate()
+    category_id = wrapper.add_category('Panini')
+    wrapper.product_id = wrapper.add_product('Hamburger', 'Classico', 5.5, category_id)
+    yield wrapper
+    wrapper.disconnect()
@@ -0,0 +1,144 @@
+"""
+Parità tra le due modalità del backend: la stessa sequenza di richieste viene
+eseguita sull'app Flask (app.py) e sull'app Quart (asgi_app.py), ognuna in un
+processo separato con un database SQLite nuovo, e le risposte devono coincidere.
+
+Le app leggono la configurazione all'import, quindi ogni esecuzione avviene in un
+sottoprocesso (`python tests/test_asgi_parity.py <wsgi|asgi>`).
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_MARKER = 'PARITY-RESULT '
+
+# campi che dipendono dall'orologio e non dalla logica delle rotte
+VOLATILE_FIELDS = {'created_at', 'updated_at', 'archived_at', 'timestamp', 'next_since',
+                   'next_cursor', 'prev_cursor'}
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {key: '<volatile>' if key in VOLATILE_FIELDS and value[key] is not None else normalize(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def scenario(call, db):
+    """Sequenza di richieste sulle rotte che hanno una versione asincrona.
+
+    `call(method, path, body)` ritorna (codice, JSON); `db` è il wrapper sincrono,
+    usato solo per preparare l'archivio.
+    """
+    results = []
+
+    def step(method, path, body=None):
+        status, data = call(method, path, body)
+        results.append((method, path, status, normalize(data)))
+        return data
+
+    step('GET', '/api/categories')
+    products = step('GET', '/api/products')['data']
+    product_id = products[0]['id']
+
+    created = step('POST', '/api/orders', {'items': [{'product_id': product_id, 'quantity': 2}]})
+    order_id = created['order_id']
+    step('POST', '/api/orders', {'items': [{'product_id': product_id, 'quantity': 1.5}]})
+    step('POST', '/api/orders', {'items': [{'product_id': 999999, 'quantity': 1}]})
+    step('POST', '/api/orders', {})
+    second = step('POST', '/api/orders', {'items': [{'product_id': products[-1]['id'], 'quantity': 1}]})
+
+    step('GET', '/api/orders?limit=5')
+    step('GET', '/api/orders?limit=1')
+    step('GET', f'/api/orders/{order_id}')
+    step('PUT', f'/api/orders/{order_id}/status', {'status': 'preparing'})
+    step('PUT', f'/api/orders/{order_id}/status', {'status': 'bogus'})
+    step('PUT', '/api/orders/999999/status', {'status': 'ready'})
+    step('GET', '/api/orders?status=preparing')
+    step('GET', '/api/orders?since=2000-01-01T00:00:00')
+    step('GET', '/api/orders?since=2000-01-01T00:00:00&status=pending')
+    step('PUT', f"/api/orders/{second['order_id']}/status", {'status': 'cancelled'})
+    step('GET', '/api/orders/stats')
+
+    # ordine consegnato da tempo e spostato nell'archivio: leggibile ma non modificabile
+    step('PUT', f'/api/orders/{order_id}/status', {'status': 'delivered'})
+    db.execute_update("UPDATE orders SET created_at = '2000-01-01 12:00:00' WHERE id = %s", (order_id,))
+    db.archive_orders(days=1)
+    step('GET', f'/api/orders/{order_id}')
+    step('PUT', f'/api/orders/{order_id}/status', {'status': 'pending'})
+    step('GET', '/api/orders/stats')
+    return results
+
+
+def run_wsgi():
+    import app as wsgi
+
+    wsgi.bootstrap()
+    client = wsgi.app.test_client()
+
+    def call(method, path, body):
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json()
+
+    return scenario(call, wsgi.db)
+
+
+def run_asgi():
+    import asyncio
+    import asgi_app
+
+    async def main():
+        async with asgi_app.app.test_app() as test_app:
+            client = test_app.test_client()
+            loop = asyncio.get_running_loop()
+
+            def call(method, path, body):
+                # lo scenario è sincrono: ogni richiesta gira sul loop del client di test
+                future = asyncio.run_coroutine_threadsafe(request(method, path, body), loop)
+                return future.result()
+
+            async def request(method, path, body):
+                response = await client.open(path, method=method, json=body)
+                return response.status_code, await response.get_json()
+
+            return await loop.run_in_executor(None, scenario, call, asgi_app.sync_db)
+
+    return asyncio.run(main())
+
+
+def run_mode(mode, tmp_path, active_view):
+    env = dict(os.environ, DB_HOST='', SQLITE_PATH=str(tmp_path / f'{mode}.db'),
+               ORDER_INGEST='sync', ACTIVE_ORDERS_VIEW=active_view, PYTHONPATH=ROOT)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), mode], cwd=str(tmp_path),
+                               env=env, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    line = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)][-1]
+    return [tuple(step) for step in json.loads(line[len(RESULT_MARKER):])]
+
+
+@pytest.mark.parametrize('active_view', ['0', '1'])
+def test_wsgi_and_asgi_answer_the_same(tmp_path, active_view):
+    wsgi_results = run_mode('wsgi', tmp_path, active_view)
+    asgi_results = run_mode('asgi', tmp_path, active_view)
+
+    statuses = [status for _, _, status, _ in wsgi_results]
+    assert 409 in statuses and 404 in statuses
+    for expected, actual in zip(wsgi_results, asgi_results):
+        assert actual == expected
+    assert len(asgi_results) == len(wsgi_results)
+
+
+if __name__ == '__main__':
+    # mai il database di .env né local.db: solo il file passato da run_mode
+    if not os.environ.get('SQLITE_PATH'):
+        sys.exit("Impostare SQLITE_PATH (file SQLite temporaneo) o eseguire con pytest")
+    os.environ['DB_HOST'] = ''
+    sys.path.insert(0, ROOT)
+    results = run_wsgi() if sys.argv[1] == 'wsgi' else run_asgi()
+    print(RESULT_MARKER + json.dumps(results, default=str))
@@ -0,0 +1,69 @@
+"""
+Coda di scrittura: id riservati a blocchi e ordini creati direttamente nel frattempo
+"""
+from datetime import datetime, timezone
+
+from order_queue import OrderQueue
+
+
+def queued_order(db, order_id):
+    """Ordine come lo prepara app.queue_order, con id già riservato"""
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'id': order_id,
+        'order_number': db.next_order_number(),
+        'total_price': 5.5,
+        'status': 'pending',
+        'created_at': now,
+        'updated_at': now,
+        'items': [{'id': None, 'order_id': order_id, 'product_id': db.product_id,
+                   'quantity': 1, 'price': 5.5, 'name': 'Hamburger', 'category_id': None}],
+    }
+
+
+def test_direct_order_does_not_take_reserved_id(db, tmp_path):
+    queue = OrderQueue(db, str(tmp_path / 'queue.db'))
+    queue.start()
+    try:
+        # il blocco viene riservato prima che la coda scriva il suo primo ordine
+        reserved_id = db.next_order_id()
+        order = queued_order(db, reserved_id)
+
+        direct_number = db.next_order_number()
+        direct_id = db.create_order(direct_number,
+                                    [{'product_id': db.product_id, 'quantity': 1, 'price': 5.5}], 5.5)
+        assert direct_id > reserved_id
+
+        queue.enqueue(order)
+        assert queue.wait_committed(reserved_id, 5)
+    finally:
+        queue.stop()
+
+    assert queue.failed == 0
+    assert db.get_order_by_id(reserved_id)['order_number'] == order['order_number']
+    assert db.get_order_by_id(direct_id)['order_number'] == direct_number
+    assert len(db.get_order_items(reserved_id)) == 1
+
+
+def test_conflicting_id_stays_in_journal(db, tmp_path):
+    queue = OrderQueue(db, str(tmp_path / 'queue.db'))
+    queue.start()
+    try:
+        reserved_id = db.next_order_id()
+        order = queued_order(db, reserved_id)
+        # un altro processo ha scritto un ordine diverso con lo stesso id
+        db.execute_update("INSERT INTO orders (id, order_number, total_price, status) "
+                          "VALUES (%s, %s, 1, 'pending')", (reserved_id, 'ALTRO-1'))
+
+        queue.enqueue(order)
+        assert queue.wait_committed(reserved_id, 5)
+    finally:
+        queue.stop()
+
+    # l'ordine non è perso: resta nel journal marcato come fallito
+    assert queue.failed == 1
+    assert db.get_order_by_id(reserved_id)['order_number'] == 'ALTRO-1'
+    queue._open_journal()
+    rows = queue._journal.execute("SELECT id, failed FROM queued_orders").fetchall()
+    queue._journal.close()
+    assert rows == [(reserved_id, 1)]
@@ -0,0 +1,12 @@
+"""
+Punto di ingresso per server WSGI esterni (es. `gunicorn wsgi:app`)
+
+La fase di avvio (`bootstrap`) parte in background appena il worker importa il
+modulo, prima della prima richiesta: `GET /api/ready` risponde 503 finché non è
+terminata, le altre richieste arrivate nel frattempo aspettano. Non usare
+`--preload`: il thread di avvio e le connessioni aperte non passano ai worker
+creati con il fork.
+"""
+from app import app, start_bootstrap
+
+start_bootstrap()